@@ -0,0 +1,257 @@
+"""
+Authentication that doesn't hash a password or query the database on every
+request.
+
+Access tokens are signed with SECRET_KEY and expire after
+ACCESS_TOKEN_EXPIRES_IN, so verifying one is an HMAC and a timestamp check.
+Clients get a pair of tokens from `POST /auth/token/`, send the access token
+as `Authorization: Bearer <token>`, and trade the longer-lived refresh token
+for a new pair at `POST /auth/token/refresh/` once it expires.
+
+The legacy Basic and Token schemes remember what they verified in the `auth`
+cache for a short while: Basic the user behind a keyed hash of the username
+and password, and Token the user behind a keyed hash of the key. Neither the
+password nor the key is stored.
+
+All three schemes load users from the same cache, which is local to each
+process, and every verified credential carries a hash of the user's
+password (see get_session_auth_hash()), so changing a password revokes the
+tokens and cached Basic credentials that came before it.
+
+So that other processes see a change straight away, saving or deleting a
+user, or deleting one of their tokens, also gives the user a new
+generation in the shared `auth_revocations` cache. Cached users and
+credentials remember the generation they were verified at, and are checked
+again against the database once it has moved on. That costs one read of the
+shared cache per request.
+"""
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core import signing
+from django.core.cache import caches
+from django.utils.crypto import constant_time_compare, salted_hmac
+from django.utils.translation import gettext_lazy as _
+from rest_framework import authentication, exceptions
+
+# How long an access token is valid for
+ACCESS_TOKEN_EXPIRES_IN = 15 * 60
+
+ACCESS_TOKEN_SALT = 'accounts.authentication.access'
+
+# How long a refresh token can be traded for a new pair of tokens
+REFRESH_TOKEN_EXPIRES_IN = 7 * 24 * 60 * 60
+
+REFRESH_TOKEN_SALT = 'accounts.authentication.refresh'
+
+CREDENTIALS_SALT = 'accounts.authentication.credentials'
+
+
+def get_cache():
+    return caches['auth']
+
+
+def get_revocations():
+    return caches['auth_revocations']
+
+
+def get_auth_hash(user):
+    """
+    Returns a short hash of `user`'s password, which changes along with it.
+    """
+    return user.get_session_auth_hash()[:16]
+
+
+def get_user_key(pk):
+    return f'accounts:user:{pk}'
+
+
+def get_credentials_key(scheme, *credentials):
+    digest = salted_hmac(CREDENTIALS_SALT, '\0'.join([scheme, *credentials]), algorithm='sha256')
+    return f'accounts:credentials:{digest.hexdigest()}'
+
+
+def get_generation_key(pk):
+    return f'accounts:generation:{pk}'
+
+
+def get_generation(pk):
+    """
+    Returns the current generation of the user with the primary key `pk`.
+    """
+    return get_revocations().get(get_generation_key(pk), '')
+
+
+def revoke(pk):
+    """
+    Makes every process verify the user with the primary key `pk`, and the
+    credentials they have cached for them, against the database again.
+    """
+    get_cache().delete(get_user_key(pk))
+    # Entries cached before this expire within the `auth` cache's timeout,
+    # so the new generation only needs to outlive them
+    get_revocations().set(
+        get_generation_key(pk), uuid.uuid4().hex, timeout=get_cache().default_timeout
+    )
+
+
+def get_user(pk, generation):
+    """
+    Returns the active user with the primary key `pk` from the cache, loading
+    them if they are missing or were cached before `generation`, or None if
+    there is no such user.
+    """
+    cache = get_cache()
+    key = get_user_key(pk)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == generation:
+        return cached[1]
+
+    user = get_user_model().objects.filter(pk=pk, is_active=True).first()
+    if user is None:
+        return None
+    cache.set(key, (generation, user))
+    return user
+
+
+def cache_user(user):
+    """
+    Caches `user`, who has just been verified, and returns their generation.
+    """
+    generation = get_generation(user.pk)
+    get_cache().set(get_user_key(user.pk), (generation, user))
+    return generation
+
+
+def user_changed(sender, instance, **kwargs):
+    revoke(instance.pk)
+
+
+def token_deleted(sender, instance, **kwargs):
+    get_cache().delete(get_credentials_key('token', instance.key))
+    revoke(instance.user_id)
+
+
+def connect_signals():
+    from django.db.models.signals import post_delete, post_save
+    from rest_framework.authtoken.models import Token
+
+    User = get_user_model()
+    post_save.connect(user_changed, sender=User)
+    post_delete.connect(user_changed, sender=User)
+    post_delete.connect(token_deleted, sender=Token)
+
+
+def get_verified_user(pk, auth_hash, generation=None):
+    """
+    Returns the user with the primary key `pk`, as long as their password
+    hasn't changed since `auth_hash` was taken, or None. If `generation` is
+    given, the user mustn't have been revoked since it was current either.
+    """
+    current = get_generation(pk)
+    if generation is not None and generation != current:
+        return None
+    user = get_user(pk, current)
+    if user is None or not constant_time_compare(get_auth_hash(user), auth_hash):
+        return None
+    return user
+
+
+def make_access_token(user):
+    return signing.dumps(
+        {'user': str(user.pk), 'auth': get_auth_hash(user)},
+        salt=ACCESS_TOKEN_SALT
+    )
+
+
+def make_refresh_token(user):
+    return signing.dumps(
+        {'user': str(user.pk), 'auth': get_auth_hash(user)},
+        salt=REFRESH_TOKEN_SALT
+    )
+
+
+def make_tokens(user):
+    """
+    Returns a new access token and refresh token for `user`.
+    """
+    return {
+        'access': make_access_token(user),
+        'refresh': make_refresh_token(user),
+        'expires_in': ACCESS_TOKEN_EXPIRES_IN,
+    }
+
+
+def refresh_tokens(token):
+    """
+    Returns a new pair of tokens in exchange for the refresh `token`. Unlike
+    access tokens, the user is loaded from the database rather than the
+    cache, so a password change anywhere is seen straight away.
+
+    Raises signing.SignatureExpired if the token is older than
+    REFRESH_TOKEN_EXPIRES_IN, or signing.BadSignature if it is invalid or its
+    user is inactive, deleted or has changed their password.
+    """
+    payload = signing.loads(token, salt=REFRESH_TOKEN_SALT, max_age=REFRESH_TOKEN_EXPIRES_IN)
+    user = get_user_model().objects.filter(pk=payload['user'], is_active=True).first()
+    if user is None or not constant_time_compare(get_auth_hash(user), payload['auth']):
+        raise signing.BadSignature('The refresh token has been revoked.')
+    return make_tokens(user)
+
+
+class AccessTokenAuthentication(authentication.TokenAuthentication):
+    """
+    Authenticates signed access tokens: `Authorization: Bearer <token>`.
+    """
+    keyword = 'Bearer'
+
+    def authenticate_credentials(self, key):
+        try:
+            payload = signing.loads(key, salt=ACCESS_TOKEN_SALT, max_age=ACCESS_TOKEN_EXPIRES_IN)
+        except signing.SignatureExpired:
+            raise exceptions.AuthenticationFailed(_('Access token expired.'))
+        except signing.BadSignature:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+
+        user = get_verified_user(payload['user'], payload['auth'])
+        if user is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        return (user, key)
+
+
+class CachedBasicAuthentication(authentication.BasicAuthentication):
+    """
+    BasicAuthentication that only checks the password again once the `auth`
+    cache has forgotten it was right.
+    """
+    def authenticate_credentials(self, userid, password, request=None):
+        cache = get_cache()
+        key = get_credentials_key('basic', userid, password)
+        cached = cache.get(key)
+        if cached is not None:
+            user = get_verified_user(*cached)
+            if user is not None:
+                return (user, None)
+
+        user, auth = super().authenticate_credentials(userid, password, request)
+        cache.set(key, (str(user.pk), get_auth_hash(user), cache_user(user)))
+        return (user, auth)
+
+
+class CachedTokenAuthentication(authentication.TokenAuthentication):
+    """
+    TokenAuthentication that remembers which user a key belongs to in the
+    `auth` cache. Deleting the token revokes it in every process.
+    """
+    def authenticate_credentials(self, key):
+        cache = get_cache()
+        cache_key = get_credentials_key('token', key)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            user = get_verified_user(*cached)
+            if user is not None:
+                return (user, key)
+
+        user, token = super().authenticate_credentials(key)
+        cache.set(cache_key, (str(user.pk), get_auth_hash(user), cache_user(user)))
+        return (user, token)
@@ -0,0 +1,140 @@
+import base64
+import json
+from datetime import timedelta
+from unittest.mock import MagicMock, patch
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from freezegun import freeze_time
+from rest_framework.test import APIClient as Client
+from rest_framework.authtoken.models import Token
+
+from accounts.authentication import ACCESS_TOKEN_EXPIRES_IN, REFRESH_TOKEN_EXPIRES_IN
+from accounts.models import User
+from documents.models import Topic
+
+
+class AuthenticationTestCase(TestCase):
+    """
+    Integration tests for access tokens and the cached Basic and Token schemes
+    """
+    def setUp(self):
+        caches['auth'].clear()
+        caches['auth_revocations'].clear()
+        self.client = Client()
+        self.user = User.objects.create(username="jdoe", email="jdoe@example.com")
+        self.user.set_password("correct horse")
+        self.user.save()
+
+    def basic(self, password="correct horse"):
+        credentials = base64.b64encode(f"jdoe:{password}".encode()).decode()
+        return f"Basic {credentials}"
+
+    def post_topic(self, authorization):
+        self.client.credentials(HTTP_AUTHORIZATION=authorization)
+        name = f"topic {Topic.objects.count()}"
+        return self.client.post("/topics/", {"name": name, "folders": [], "documents": []}, format="json")
+
+    def change_password(self, password):
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password(password)
+        user.save()
+
+    def get_tokens(self):
+        self.client.credentials(HTTP_AUTHORIZATION=self.basic())
+        response = self.client.post("/auth/token/")
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_basic_checks_password_once(self):
+        with patch.object(User, "check_password", autospec=True, side_effect=User.check_password) as check:
+            self.assertEqual(self.post_topic(self.basic()).status_code, 201)
+            self.assertEqual(self.post_topic(self.basic()).status_code, 201)
+        self.assertEqual(check.call_count, 1)
+        self.assertEqual(self.post_topic(self.basic("wrong")).status_code, 401)
+
+    def test_basic_cache_invalidated_by_password_change(self):
+        self.assertEqual(self.post_topic(self.basic()).status_code, 201)
+        self.change_password("battery staple")
+        self.assertEqual(self.post_topic(self.basic()).status_code, 401)
+        self.assertEqual(self.post_topic(self.basic("battery staple")).status_code, 201)
+
+    def test_token_cached(self):
+        token = Token.objects.create(user=self.user)
+        # Deleting the token clears its primary key
+        key = token.key
+        self.assertEqual(self.post_topic(f"Token {key}").status_code, 201)
+        with CaptureQueriesContext(connection) as queries:
+            self.post_topic(f"Token {key}")
+        self.assertFalse([q for q in queries if "authtoken_token" in q["sql"]])
+
+        token.delete()
+        self.assertEqual(self.post_topic(f"Token {key}").status_code, 401)
+
+    def test_revocations_reach_other_processes(self):
+        token = Token.objects.create(user=self.user)
+        self.assertEqual(self.post_topic(f"Token {token.key}").status_code, 201)
+        self.assertEqual(self.post_topic(self.basic()).status_code, 201)
+
+        # Another process deactivates the user: only the shared cache changes
+        with patch("accounts.authentication.get_cache", return_value=MagicMock(default_timeout=60)):
+            User.objects.filter(pk=self.user.pk).update(is_active=False)
+            User.objects.get(pk=self.user.pk).save()
+        self.assertEqual(self.post_topic(f"Token {token.key}").status_code, 401)
+        self.assertEqual(self.post_topic(self.basic()).status_code, 401)
+
+    def test_token_deletion_reaches_other_processes(self):
+        token = Token.objects.create(user=self.user)
+        key = token.key
+        self.assertEqual(self.post_topic(f"Token {key}").status_code, 201)
+        with patch("accounts.authentication.get_cache", return_value=MagicMock(default_timeout=60)):
+            token.delete()
+        self.assertEqual(self.post_topic(f"Token {key}").status_code, 401)
+
+    def test_access_token(self):
+        tokens = self.get_tokens()
+        self.assertEqual(tokens["expires_in"], ACCESS_TOKEN_EXPIRES_IN)
+        self.assertEqual(self.post_topic(f"Bearer {tokens['access']}").status_code, 201)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.post_topic(f"Bearer {tokens['access']}")
+        self.assertFalse([q for q in queries if "accounts_user" in q["sql"]])
+        self.assertEqual(Topic.objects.count(), 2)
+
+    def test_access_token_rejected(self):
+        tokens = self.get_tokens()
+        self.assertEqual(self.post_topic(f"Bearer {tokens['access']}x").status_code, 401)
+        self.assertEqual(self.post_topic(f"Bearer {tokens['refresh']}").status_code, 401)
+
+        with freeze_time(timezone.now() + timedelta(seconds=ACCESS_TOKEN_EXPIRES_IN + 1)):
+            self.assertEqual(self.post_topic(f"Bearer {tokens['access']}").status_code, 401)
+
+    def test_access_token_revoked_by_password_change(self):
+        tokens = self.get_tokens()
+        self.change_password("battery staple")
+        self.assertEqual(self.post_topic(f"Bearer {tokens['access']}").status_code, 401)
+
+        self.client.credentials()
+        response = self.client.post("/auth/token/refresh/", {"refresh": tokens["refresh"]}, format="json")
+        self.assertEqual(response.status_code, 401)
+
+    def test_refresh(self):
+        tokens = self.get_tokens()
+        self.client.credentials()
+        with freeze_time(timezone.now() + timedelta(seconds=ACCESS_TOKEN_EXPIRES_IN + 1)):
+            response = self.client.post("/auth/token/refresh/", {"refresh": tokens["refresh"]}, format="json")
+            self.assertEqual(response.status_code, 200)
+            access = json.loads(response.content)["access"]
+            self.assertEqual(self.post_topic(f"Bearer {access}").status_code, 201)
+
+        with freeze_time(timezone.now() + timedelta(seconds=REFRESH_TOKEN_EXPIRES_IN + 1)):
+            response = self.client.post("/auth/token/refresh/", {"refresh": tokens["refresh"]}, format="json")
+            self.assertEqual(response.status_code, 401)
+
+    def test_tokens_require_authentication(self):
+        self.assertEqual(self.client.post("/auth/token/").status_code, 401)
+        self.assertEqual(self.client.post("/auth/token/refresh/", {}, format="json").status_code, 400)
+        for body in (["refresh"], "refresh", 1, None):
+            self.assertEqual(self.client.post("/auth/token/refresh/", body, format="json").status_code, 400)
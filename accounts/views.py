@@ -0,0 +1,42 @@
+from django.core import signing
+from rest_framework import exceptions
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from accounts.authentication import make_tokens, refresh_tokens
+
+
+class AccessTokenView(APIView):
+    """
+    Issues an access token and a refresh token to an authenticated user.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        return Response(make_tokens(request.user))
+
+
+class RefreshAccessTokenView(APIView):
+    """
+    Trades a refresh token for a new access token and refresh token. The
+    access token being refreshed has usually expired, so requests aren't
+    authenticated.
+    """
+    authentication_classes = []
+    permission_classes = [AllowAny]
+
+    def get_authenticate_header(self, request):
+        return 'Bearer realm="api"'
+
+    def post(self, request, *args, **kwargs):
+        # A JSON body can be a list or a scalar rather than an object
+        token = request.data.get('refresh') if isinstance(request.data, dict) else None
+        if not isinstance(token, str):
+            raise exceptions.ValidationError({'refresh': ['This field is required.']})
+        try:
+            return Response(refresh_tokens(token))
+        except signing.SignatureExpired:
+            raise exceptions.AuthenticationFailed('Refresh token expired.')
+        except signing.BadSignature:
+            raise exceptions.AuthenticationFailed('Invalid refresh token.')
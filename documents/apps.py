@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_migrate
 
 
 class DocumentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'documents'
+
+    def ready(self):
+        from documents import cache, conditional, deletion, topic_index
+        from documents.models import Document
+        from documents.search import install_search
+        from documents.tree import document_deleted
+        cache.connect_signals()
+        conditional.connect_signals()
+        deletion.connect_signals()
+        topic_index.connect_signals()
+        post_delete.connect(document_deleted, sender=Document)
+        post_migrate.connect(install_search, sender=self)
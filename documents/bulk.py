@@ -0,0 +1,363 @@
+"""
+Batch create, update and delete support for the document store API.
+
+Each viewset gets a `/bulk/` endpoint that accepts an array of items. Foreign
+keys across the whole batch are validated with one IN query per relation,
+rows are written with bulk_create()/bulk_update(), and many-to-many links are
+inserted straight into the through tables, all in a single transaction. Each
+item is validated on its own, so the response has a result for every item in
+the request, in the same order.
+"""
+from collections.abc import Mapping
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.relations import ManyRelatedField
+from rest_framework.response import Response
+
+from documents import topic_index
+from documents.cache import invalidate
+from documents.conditional import touch
+from documents.models import Topic
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    A PrimaryKeyRelatedField that can look up its related objects from a map
+    preloaded for a whole batch, instead of querying for every value.
+
+    It behaves exactly like a PrimaryKeyRelatedField until preload() is
+    called.
+    """
+    preloaded = None
+
+    def preload(self, values):
+        pk_field = self.get_queryset().model._meta.pk
+        pks = set()
+        for value in values:
+            try:
+                pks.add(pk_field.to_python(value))
+            except (DjangoValidationError, TypeError):
+                # to_internal_value() will report the bad value
+                pass
+        self.preloaded = self.get_queryset().in_bulk(pks)
+
+    def to_internal_value(self, data):
+        if self.preloaded is None:
+            return super().to_internal_value(data)
+
+        try:
+            pk = self.get_queryset().model._meta.pk.to_python(data)
+        except (DjangoValidationError, TypeError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+        try:
+            return self.preloaded[pk]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+
+
+def set_related_in_bulk(model, name, links, replace=False, batch_size=None):
+    """
+    Writes many-to-many links straight to the through table of the relation
+    `name` on `model`, which may be a forward or a reverse relation.
+
+    `links` maps the pk of each `model` instance to its related objects. If
+    `replace` is True, the existing links of those instances are removed
+    first.
+
+    The related objects on the other side of every link that is added or
+    removed have their `updated_at` bumped, since their representations list
+    the links too. The `model` instances are assumed to be saved alongside.
+    """
+    descriptor = getattr(model, name)
+    field = descriptor.field
+    through = descriptor.through
+
+    if descriptor.reverse:
+        own, other = field.m2m_reverse_field_name(), field.m2m_field_name()
+        related_model = field.model
+    else:
+        own, other = field.m2m_field_name(), field.m2m_reverse_field_name()
+        related_model = field.related_model
+
+    touched = set()
+    removed = []
+    if replace:
+        existing = through.objects.filter(**{f'{own}_id__in': list(links)})
+        removed = list(existing)
+        touched.update(getattr(link, f'{other}_id') for link in removed)
+        existing.delete()
+
+    # An object listed twice is still only linked once
+    rows = [
+        through(**{f'{own}_id': pk, f'{other}_id': related_pk})
+        for pk, related_objects in links.items()
+        for related_pk in dict.fromkeys(related.pk for related in related_objects)
+    ]
+    through.objects.bulk_create(rows, batch_size=batch_size)
+
+    touched.update(getattr(row, f'{other}_id') for row in rows)
+    touch(related_model, touched)
+
+    if through is Topic.documents.through:
+        # No m2m_changed is sent for these links, so update the index here
+        topic_index.links_changed(
+            removed=[(link.topic_id, link.document_id) for link in removed],
+            added=[(row.topic_id, row.document_id) for row in rows]
+        )
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    A ListSerializer that validates its items one at a time (against a shared
+    map of preloaded related objects) and writes them in bulk.
+
+    Items that pass validation but can't be written are left out of the
+    write and reported in `item_errors`, by pk.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.item_errors = {}
+
+    def get_m2m_sources(self):
+        return [
+            field.source
+            for field in self.child.fields.values()
+            if isinstance(field, ManyRelatedField) and not field.read_only
+        ]
+
+    def preload_relations(self, items):
+        """
+        Fetches the related objects referenced anywhere in `items` with one
+        query per relation.
+        """
+        for field in self.child.fields.values():
+            if field.read_only:
+                continue
+
+            many = isinstance(field, ManyRelatedField)
+            relation = field.child_relation if many else field
+            if not isinstance(relation, BulkPrimaryKeyRelatedField):
+                continue
+
+            values = []
+            for item in items:
+                if not isinstance(item, Mapping) or item.get(field.field_name) in (None, ''):
+                    continue
+                value = item[field.field_name]
+                if many:
+                    values.extend(value if isinstance(value, list) else [value])
+                else:
+                    values.append(value)
+
+            relation.preload(values)
+
+    def validate_items(self, instances=None):
+        """
+        Validates every item in `initial_data` independently, so one invalid
+        item doesn't reject the whole batch.
+
+        Returns a list with a `(validated_data, errors)` pair for each item,
+        exactly one of which is None.
+        """
+        items = self.initial_data
+        self.preload_relations(items)
+
+        results = []
+        for index, item in enumerate(items):
+            self.child.instance = instances[index] if instances else None
+            try:
+                results.append((self.child.run_validation(item), None))
+            except serializers.ValidationError as exc:
+                results.append((None, exc.detail))
+        self.child.instance = None
+
+        return results
+
+    def perform_bulk_create(self, validated_data):
+        model = self.child.Meta.model
+        return model.objects.bulk_create([model(**attrs) for attrs in validated_data])
+
+    def create(self, validated_data):
+        model = self.child.Meta.model
+        m2m_sources = self.get_m2m_sources()
+        related = [
+            {source: attrs.pop(source) for source in m2m_sources if source in attrs}
+            for attrs in validated_data
+        ]
+
+        with transaction.atomic():
+            instances = self.perform_bulk_create(validated_data)
+            for source in m2m_sources:
+                set_related_in_bulk(model, source, {
+                    instance.pk: objects[source]
+                    for instance, objects in zip(instances, related)
+                    if source in objects
+                })
+
+        invalidate(model)
+        return instances
+
+    def update(self, instances, validated_data):
+        model = self.child.Meta.model
+        m2m_sources = self.get_m2m_sources()
+        related = {source: {} for source in m2m_sources}
+        fields = {'updated_at'}
+        now = timezone.now()
+
+        for instance, attrs in zip(instances, validated_data):
+            for source in m2m_sources:
+                if source in attrs:
+                    related[source][instance.pk] = attrs.pop(source)
+            for k, v in attrs.items():
+                setattr(instance, k, v)
+                fields.add(k)
+            # bulk_update() doesn't run auto_now
+            instance.updated_at = now
+
+        with transaction.atomic():
+            model.objects.bulk_update(instances, fields=sorted(fields))
+            for source, links in related.items():
+                set_related_in_bulk(model, source, links, replace=True)
+
+        invalidate(model, [instance.pk for instance in instances])
+        return instances
+
+
+class BulkModelMixin:
+    """
+    Adds a `/bulk/` endpoint to a ModelViewSet: POST an array of objects to
+    create them, PATCH an array of objects with ids to update them, or DELETE
+    an array of ids to delete them.
+
+    The serializer's list_serializer_class must be a BulkListSerializer.
+    """
+    bulk_max_items = 1000
+
+    @action(detail=False, methods=['post', 'patch', 'delete'])
+    def bulk(self, request, *args, **kwargs):
+        if not isinstance(request.data, list):
+            raise serializers.ValidationError({
+                'non_field_errors': ['Expected a list of items.']
+            })
+
+        if len(request.data) > self.bulk_max_items:
+            raise serializers.ValidationError({
+                'non_field_errors': [f'At most {self.bulk_max_items} items can be sent at once.']
+            })
+
+        handler = {
+            'POST': self.bulk_create,
+            'PATCH': self.bulk_update,
+            'DELETE': self.bulk_destroy,
+        }[request.method]
+        return handler(request.data)
+
+    def get_bulk_response(self, results, item_status, response_status=None):
+        """
+        Responds with `response_status` (which defaults to `item_status`) if
+        every item succeeded, or with 207 Multi-Status if any of them failed.
+        """
+        if all(result['status'] == item_status for result in results):
+            return Response(results, status=response_status or item_status)
+        return Response(results, status=status.HTTP_207_MULTI_STATUS)
+
+    def to_pk(self, value):
+        try:
+            return self.get_queryset().model._meta.pk.to_python(value)
+        except (DjangoValidationError, TypeError):
+            return None
+
+    def bulk_create(self, items):
+        serializer = self.get_serializer(data=items, many=True)
+        validated = serializer.validate_items()
+        instances = iter(serializer.create([
+            attrs for attrs, errors in validated if errors is None
+        ]))
+
+        results = []
+        for attrs, errors in validated:
+            if errors is None:
+                results.append({'status': status.HTTP_201_CREATED, 'id': next(instances).pk})
+            else:
+                results.append({'status': status.HTTP_400_BAD_REQUEST, 'errors': errors})
+
+        return self.get_bulk_response(results, status.HTTP_201_CREATED)
+
+    def bulk_update(self, items):
+        pks = [
+            self.to_pk(item.get('id')) if isinstance(item, Mapping) else None
+            for item in items
+        ]
+        found = self.get_queryset().model.objects.in_bulk([pk for pk in pks if pk])
+
+        results = [None] * len(items)
+        indexes = []
+        for index, pk in enumerate(pks):
+            if pk in found:
+                indexes.append(index)
+            else:
+                results[index] = {
+                    'status': status.HTTP_404_NOT_FOUND,
+                    'errors': {'id': ['Not found.']}
+                }
+
+        instances = [found[pks[index]] for index in indexes]
+        serializer = self.get_serializer(
+            instances, data=[items[index] for index in indexes], many=True, partial=True
+        )
+        validated = serializer.validate_items(instances)
+
+        valid_instances, valid_data = [], []
+        for index, instance, (attrs, errors) in zip(indexes, instances, validated):
+            if errors is None:
+                valid_instances.append(instance)
+                valid_data.append(attrs)
+                results[index] = {'status': status.HTTP_200_OK, 'id': instance.pk}
+            else:
+                results[index] = {'status': status.HTTP_400_BAD_REQUEST, 'errors': errors}
+
+        if valid_instances:
+            serializer.update(valid_instances, valid_data)
+
+        for index, instance in zip(indexes, instances):
+            if instance.pk in serializer.item_errors:
+                results[index] = {
+                    'status': status.HTTP_400_BAD_REQUEST,
+                    'errors': serializer.item_errors[instance.pk]
+                }
+
+        return self.get_bulk_response(results, status.HTTP_200_OK)
+
+    def perform_bulk_destroy(self, queryset):
+        with transaction.atomic():
+            queryset.delete()
+
+    def bulk_destroy(self, items):
+        pks = [self.to_pk(item) for item in items]
+        queryset = self.get_queryset().model.objects.filter(pk__in=[pk for pk in pks if pk])
+        found = set(queryset.values_list('pk', flat=True))
+
+        results = []
+        for item, pk in zip(items, pks):
+            if pk is None:
+                results.append({
+                    'status': status.HTTP_400_BAD_REQUEST,
+                    'errors': {'id': [f'"{item}" is not a valid id.']}
+                })
+            elif pk in found:
+                results.append({'status': status.HTTP_204_NO_CONTENT, 'id': pk})
+            else:
+                results.append({
+                    'status': status.HTTP_404_NOT_FOUND,
+                    'errors': {'id': ['Not found.']}
+                })
+
+        self.perform_bulk_destroy(queryset)
+
+        # A 204 can't carry the per-item results, so respond with a 200
+        return self.get_bulk_response(results, status.HTTP_204_NO_CONTENT, status.HTTP_200_OK)
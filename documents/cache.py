@@ -0,0 +1,220 @@
+"""
+An opt-in shared cache for serialized list and detail responses.
+
+Set RESPONSE_CACHE_ENABLED to cache the JSON responses of the list and
+retrieve actions in the `responses` cache. List responses are keyed by their
+normalized query string along with the model's version, and detail responses
+by primary key along with the object's own version. Both contain absolute
+URLs, so they're keyed by scheme and host too.
+
+Entries are invalidated once the transaction that changed them commits:
+
+- Saving or deleting an object invalidates it (post_save and post_delete).
+- So does everything that bumps `updated_at` or `children_updated_at` for
+  conditional GETs (linking topics, adding or removing child folders, bulk
+  writes, see documents.conditional).
+- Invalidating objects moves their versions on, which drops their cached
+  detail responses, and moves the model's version on, which drops its
+  cached lists. Other objects' detail responses are kept. Moving a folder
+  also changes which documents a `folder_subtree` filter matches, so it
+  drops the cached document lists.
+
+Versions are read before a response is built, so a response built from
+rows that changed while it was being built is stored under an old version
+and never served.
+
+Responses that are going to be cached are built from the primary, even for
+requests that would otherwise read from a replica, since a lagging replica
+can still have the rows from before the change that moved the version on.
+"""
+import hashlib
+import uuid
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import urlencode
+from rest_framework.response import Response
+
+from documents.models import Document, Folder, Topic
+from documents.replicas import read_from_primary
+
+RESPONSE_CACHE_ALIAS = 'responses'
+
+KEY_PREFIX = 'documents:responses'
+
+CACHED_HEADERS = ('ETag', 'Last-Modified')
+
+
+def get_cache():
+    return caches[RESPONSE_CACHE_ALIAS]
+
+
+def is_enabled():
+    return bool(settings.RESPONSE_CACHE_ENABLED)
+
+
+def get_version_key(model, pk=None):
+    if pk is None:
+        return f'{KEY_PREFIX}:{model._meta.label_lower}:version'
+    return f'{KEY_PREFIX}:{model._meta.label_lower}:{pk}:version'
+
+
+def get_version(model, pk=None):
+    """
+    Returns the current version of `model`'s lists, or of the detail of its
+    instance with primary key `pk`. Versions are random rather than
+    counters, so a version that is evicted from the cache can never be
+    handed out again.
+    """
+    cache = get_cache()
+    key = get_version_key(model, pk)
+    version = cache.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        if not cache.add(key, version, timeout=None if pk is None else DEFAULT_TIMEOUT):
+            # Another worker got there first
+            version = cache.get(key, version)
+    return version
+
+
+def get_list_key(model, version, query):
+    digest = hashlib.md5(query.encode()).hexdigest()
+    return f'{KEY_PREFIX}:{model._meta.label_lower}:list:{version}:{digest}'
+
+
+def get_detail_key(model, version, pk, origin):
+    digest = hashlib.md5(origin.encode()).hexdigest()
+    return f'{KEY_PREFIX}:{model._meta.label_lower}:detail:{pk}:{version}:{digest}'
+
+
+def invalidate(model, pks=()):
+    """
+    Drops every cached list response of `model`, and the cached detail
+    responses of its instances with primary keys `pks`, once the current
+    transaction commits.
+    """
+    if not is_enabled():
+        return
+    transaction.on_commit(partial(_invalidate, model, list(pks)))
+
+
+def invalidate_folder_paths(paths):
+    """
+    Like invalidate(), for the folders at `paths`.
+    """
+    if not is_enabled():
+        return
+    invalidate(Folder, Folder.objects.filter(path__in=list(paths)).values_list('pk', flat=True))
+
+
+def _invalidate(model, pks):
+    cache = get_cache()
+    cache.set(get_version_key(model), uuid.uuid4().hex, timeout=None)
+    # An object's version can expire along with its detail responses, since
+    # a new version never matches an old response
+    if pks:
+        cache.set_many({get_version_key(model, pk): uuid.uuid4().hex for pk in pks})
+
+
+def instance_changed(sender, instance, raw=False, **kwargs):
+    if not raw:
+        invalidate(sender, [instance.pk])
+
+
+def connect_signals():
+    for model in (Folder, Document, Topic):
+        post_save.connect(instance_changed, sender=model)
+        post_delete.connect(instance_changed, sender=model)
+
+
+class ResponseCacheMixin:
+    """
+    Serves the list and retrieve actions of a ModelViewSet from the response
+    cache, when it is enabled. Only the default JSON renderer's responses are
+    cached.
+
+    Cached responses keep their ETag, so a matching If-None-Match is answered
+    with a 304 without touching the database at all.
+    """
+    def get_cache_dependencies(self, request):
+        """
+        Returns the other models whose changes should drop the cached list
+        responses for `request`.
+        """
+        return []
+
+    def get_response_cache_key(self, request):
+        if not is_enabled() or request.method != 'GET':
+            return None
+        if request.accepted_renderer.format != 'json':
+            return None
+
+        model = self.get_queryset().model
+        # Pagination links and file URLs are absolute, so responses depend on
+        # the scheme and host too
+        origin = f'{request.scheme}://{request.get_host()}'
+        if self.action == 'list':
+            query = urlencode(sorted(request.query_params.lists()), doseq=True)
+            version = ':'.join(
+                get_version(dependency)
+                for dependency in [model, *self.get_cache_dependencies(request)]
+            )
+            return get_list_key(model, version, f'{origin}?{query}')
+
+        if self.action == 'retrieve' and not request.query_params:
+            try:
+                pk = model._meta.pk.to_python(self.kwargs[self.lookup_url_kwarg or self.lookup_field])
+            except ValidationError:
+                return None
+            return get_detail_key(model, get_version(model, pk), pk, origin)
+
+        return None
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(request, super().list, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(request, super().retrieve, *args, **kwargs)
+
+    def get_cached_response(self, request, handler, *args, **kwargs):
+        key = self.get_response_cache_key(request)
+        if key is None:
+            return handler(request, *args, **kwargs)
+
+        cached = get_cache().get(key)
+        if cached is not None:
+            return self.replay_response(request, *cached)
+
+        with read_from_primary():
+            response = handler(request, *args, **kwargs)
+        if isinstance(response, Response) and response.status_code == 200:
+            response.add_post_render_callback(partial(self.store_response, key))
+        return response
+
+    def store_response(self, key, response):
+        headers = {
+            header: response[header]
+            for header in CACHED_HEADERS
+            if response.has_header(header)
+        }
+        get_cache().set(key, (response.content, response['Content-Type'], headers))
+
+    def replay_response(self, request, content, content_type, headers):
+        etag = headers.get('ETag')
+        if etag:
+            not_modified = get_conditional_response(request, etag=etag)
+            if not_modified is not None:
+                not_modified['ETag'] = etag
+                return not_modified
+
+        response = HttpResponse(content, content_type=content_type)
+        for header, value in headers.items():
+            response[header] = value
+        return response
@@ -0,0 +1,165 @@
+"""
+Conditional GET support for the document store API.
+
+Detail responses are validated by the object's `updated_at`, and list
+responses by the count and the latest `updated_at` of the filtered queryset,
+which takes one aggregate query. A request whose If-None-Match matches gets a
+304 before anything is serialized.
+
+For that to work, `updated_at` has to change whenever an object's
+representation does, including when its topics (or its folders and
+documents) are linked or unlinked without the object itself being saved. A
+folder's `children` are derived from the tree rather than edited, so adding,
+moving or deleting a child bumps the parent's `children_updated_at` instead.
+The signal handlers here, and the bulk helpers in documents.bulk and
+documents.tree, touch the affected rows.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag, urlencode
+from rest_framework.response import Response
+
+from documents.cache import invalidate, invalidate_folder_paths
+from documents.models import Document, Folder, Topic
+
+
+def touch(model, pks):
+    """
+    Bumps the `updated_at` of the `model` instances with primary keys `pks`,
+    and drops their cached responses.
+    """
+    pks = list(pks)
+    if pks:
+        model.objects.filter(pk__in=pks).update(updated_at=timezone.now())
+        invalidate(model, pks)
+
+
+def touch_parent(folder):
+    if folder.depth > 1:
+        parent_path = Folder._get_parent_path_from_path(folder.path)
+        Folder.objects.filter(path=parent_path).update(children_updated_at=timezone.now())
+        invalidate_folder_paths([parent_path])
+
+
+def topic_links_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        touch(type(instance), [instance.pk])
+        touch(model, pk_set)
+    elif action == 'pre_clear':
+        own = type(instance)._meta.model_name if reverse else 'topic'
+        other = model._meta.model_name
+        touch(type(instance), [instance.pk])
+        touch(model, sender.objects.filter(
+            **{f'{own}_id': instance.pk}
+        ).values_list(f'{other}_id', flat=True))
+
+
+def folder_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        touch_parent(instance)
+
+
+def folder_deleted(sender, instance, **kwargs):
+    touch_parent(instance)
+
+
+def tagged_deleting(sender, instance, **kwargs):
+    # Deleting the links doesn't send m2m_changed, so touch the topics now
+    touch(Topic, instance.topics.values_list('pk', flat=True))
+
+
+def topic_deleting(sender, instance, **kwargs):
+    touch(Folder, instance.folders.values_list('pk', flat=True))
+    touch(Document, instance.documents.values_list('pk', flat=True))
+
+
+def connect_signals():
+    m2m_changed.connect(topic_links_changed, sender=Topic.folders.through)
+    m2m_changed.connect(topic_links_changed, sender=Topic.documents.through)
+    post_save.connect(folder_saved, sender=Folder)
+    post_delete.connect(folder_deleted, sender=Folder)
+    pre_delete.connect(tagged_deleting, sender=Folder)
+    pre_delete.connect(tagged_deleting, sender=Document)
+    pre_delete.connect(topic_deleting, sender=Topic)
+
+
+def make_etag(*parts):
+    return quote_etag(hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest())
+
+
+def with_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    Adds strong ETags and Last-Modified headers to the list and retrieve
+    actions of a ModelViewSet, and answers matching conditional requests with
+    a 304 before serializing anything.
+
+    List responses only honour If-None-Match: a deleted row lowers the count
+    without changing the latest `updated_at`, so If-Modified-Since alone
+    can't tell that the list changed.
+    """
+    # The timestamp fields that change whenever a representation does
+    validator_fields = ['updated_at']
+
+    def get_etag_parts(self, request):
+        # Responses differ by renderer, e.g. JSON vs. the browsable API, and
+        # the JSON renderers don't produce the same bytes
+        return [
+            self.get_queryset().model._meta.label,
+            request.accepted_media_type,
+            request.accepted_renderer.format,
+        ]
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        validators = queryset.order_by().aggregate(
+            count=Count('pk'),
+            **{field: Max(field) for field in self.validator_fields}
+        )
+        timestamps = [validators[field] for field in self.validator_fields]
+        last_modified = max(filter(None, timestamps), default=None)
+
+        query = urlencode(sorted(request.query_params.lists()), doseq=True)
+        etag = make_etag(*self.get_etag_parts(request), query, validators['count'], *timestamps)
+
+        not_modified = get_conditional_response(request, etag=etag)
+        if not_modified is not None:
+            return with_validators(not_modified, etag, last_modified)
+
+        return with_validators(self.list_response(queryset), etag, last_modified)
+
+    def list_response(self, queryset):
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+
+        timestamps = [getattr(instance, field) for field in self.validator_fields]
+        last_modified = max(filter(None, timestamps))
+
+        etag = make_etag(*self.get_etag_parts(request), instance.pk, *timestamps)
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=int(last_modified.timestamp())
+        )
+        if not_modified is not None:
+            return with_validators(not_modified, etag, last_modified)
+
+        serializer = self.get_serializer(instance)
+        return with_validators(Response(serializer.data), etag, last_modified)
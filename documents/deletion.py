@@ -0,0 +1,221 @@
+"""
+Deleting folder subtrees and documents, and their files, in bulk.
+
+Deleting a folder through the ORM loads every folder and document below it,
+and every topic link, into Python and deletes them one by one.
+delete_subtrees() deletes whole branches with a handful of set-based
+DELETEs keyed on materialized path prefixes instead, in one transaction,
+and does the bookkeeping the signal handlers would have done per object:
+document counts, the parents' `numchild` and `children_updated_at`,
+conditional GET timestamps, the response cache and the topic index.
+delete_documents() does the same for a set of documents.
+
+Deleting a Document doesn't delete its file from storage, so the files of
+deleted documents are queued as OrphanedFile rows in the same transaction,
+with a single INSERT ... SELECT for a subtree. The purge_orphaned_files
+command then deletes them from storage in batches, with one S3
+DeleteObjects request per 1000 files.
+"""
+from collections import Counter
+
+from django.core.files.storage import default_storage
+from django.db import connections, router, transaction
+from django.db.models import DateTimeField, F, Q, Value
+from django.utils import timezone
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from documents import topic_index
+from documents.cache import invalidate, is_enabled as is_cache_enabled
+from documents.conditional import touch
+from documents.models import Document, Folder, OrphanedFile, Topic
+from documents.uploads import S3UploadBackend
+
+# S3 deletes at most 1000 objects per DeleteObjects request
+PURGE_BATCH_SIZE = 1000
+
+
+def queue_orphaned_files(documents):
+    """
+    Queues the files of `documents` for deletion from storage, with a single
+    INSERT ... SELECT.
+    """
+    rows = documents.exclude(file='').annotate(
+        queued_at=Value(timezone.now(), output_field=DateTimeField())
+    ).values('file', 'queued_at')
+
+    using = router.db_for_write(OrphanedFile)
+    connection = connections[using]
+    select, params = rows.query.get_compiler(using).as_sql()
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {quote(OrphanedFile._meta.db_table)} ({quote('key')}, {quote('created_at')}) {select}",
+            params
+        )
+
+
+def document_deleted(sender, instance, **kwargs):
+    if instance.file:
+        OrphanedFile.objects.create(key=instance.file.name)
+
+
+def connect_signals():
+    from django.db.models.signals import post_delete
+    post_delete.connect(document_deleted, sender=Document)
+
+
+def delete_subtrees(folders):
+    """
+    Deletes `folders` with every folder and document below them, and queues
+    the documents' files for deletion from storage.
+
+    Returns the number of folders and of documents that were deleted.
+    """
+    with transaction.atomic():
+        # Lock the roots, and skip any that are inside another root
+        roots = []
+        for folder in Folder.objects.select_for_update().filter(
+            pk__in=[folder.pk for folder in folders]
+        ).order_by('path'):
+            if not roots or not folder.path.startswith(roots[-1].path):
+                roots.append(folder)
+        if not roots:
+            return 0, 0
+
+        branches = Q()
+        for root in roots:
+            branches |= Q(path__startswith=root.path)
+        subtree = Folder.objects.filter(branches)
+        documents = Document.objects.filter(folder__in=subtree)
+        folder_links = Topic.folders.through.objects.filter(folder__in=subtree)
+        document_links = Topic.documents.through.objects.filter(document__in=documents)
+
+        # The topics lose folders or documents, so their representations change
+        touch(Topic, Topic.objects.filter(
+            Q(pk__in=folder_links.values('topic_id')) | Q(pk__in=document_links.values('topic_id'))
+        ).values_list('pk', flat=True))
+
+        if is_cache_enabled():
+            invalidate(Folder, subtree.values_list('pk', flat=True))
+            invalidate(Document, documents.values_list('pk', flat=True))
+        if topic_index.is_enabled():
+            topic_index.changed([('remove_documents', list(documents.values_list('pk', flat=True)))])
+
+        queue_orphaned_files(documents)
+
+        using = router.db_for_write(Folder)
+        document_links._raw_delete(using)
+        folder_links._raw_delete(using)
+        deleted_documents = documents._raw_delete(using)
+        deleted_folders = subtree._raw_delete(using)
+
+        # The branches' documents no longer count towards their ancestors.
+        # Every ancestor is in `below`, even when no documents were deleted,
+        # so each has its `updated_at` bumped and its cached responses
+        # dropped along with its counts
+        below = {}
+        removed_children = {}
+        for root in roots:
+            total = root.document_count + root.descendant_document_count
+            for path in Folder.get_ancestor_paths(root.path):
+                below[path] = below.get(path, 0) - total
+            if root.depth > 1:
+                parent_path = Folder._get_parent_path_from_path(root.path)
+                removed_children[parent_path] = removed_children.get(parent_path, 0) + 1
+        Folder.apply_document_count_deltas({}, below)
+
+        now = timezone.now()
+        for parent_path, count in removed_children.items():
+            Folder.objects.filter(path=parent_path).update(
+                numchild=F('numchild') - count,
+                children_updated_at=now
+            )
+
+    return deleted_folders, deleted_documents
+
+
+def delete_documents(documents):
+    """
+    Deletes `documents`, and queues their files for deletion from storage.
+
+    Returns the number of documents that were deleted.
+    """
+    with transaction.atomic():
+        rows = list(documents.select_for_update().values_list('pk', 'folder_id'))
+        if not rows:
+            return 0
+
+        pks = [pk for pk, _ in rows]
+        documents = Document.objects.filter(pk__in=pks)
+        links = Topic.documents.through.objects.filter(document_id__in=pks)
+
+        # The topics lose documents, so their representations change
+        touch(Topic, links.values_list('topic_id', flat=True).distinct())
+        invalidate(Document, pks)
+
+        queue_orphaned_files(documents)
+
+        using = router.db_for_write(Document)
+        links._raw_delete(using)
+        deleted = documents._raw_delete(using)
+
+        counts = Counter(folder_id for _, folder_id in rows)
+        Folder.adjust_document_counts({folder_id: -count for folder_id, count in counts.items()})
+
+        topic_index.changed([('remove_documents', pks)])
+
+    return deleted
+
+
+def delete_files(storage, keys):
+    """
+    Deletes the files stored at `keys`, and returns the keys that couldn't
+    be deleted. Files on S3 are deleted PURGE_BATCH_SIZE at a time.
+    """
+    keys = list(keys)
+    failed = set()
+    if isinstance(storage, S3Boto3Storage):
+        backend = S3UploadBackend(storage)
+        for start in range(0, len(keys), PURGE_BATCH_SIZE):
+            batch = {backend.get_object_key(key): key for key in keys[start:start + PURGE_BATCH_SIZE]}
+            response = storage.bucket.delete_objects(Delete={
+                'Objects': [{'Key': object_key} for object_key in batch],
+                'Quiet': True,
+            })
+            failed.update(batch[error['Key']] for error in response.get('Errors', []))
+        return failed
+
+    for key in keys:
+        try:
+            storage.delete(key)
+        except OSError:
+            failed.add(key)
+    return failed
+
+
+def purge_orphaned_files(storage=None, batch_size=PURGE_BATCH_SIZE):
+    """
+    Deletes the queued files from `storage`, `batch_size` at a time, and
+    returns how many were purged and how many failed. Files that failed stay
+    queued for the next run. Files that a document still refers to are only
+    dropped from the queue.
+    """
+    storage = storage or default_storage
+    purged = failed = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            OrphanedFile.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', 'key')[:batch_size]
+        )
+        if not batch:
+            return purged, failed
+        last_pk = batch[-1][0]
+
+        keys = {key for _, key in batch}
+        keys -= set(Document.objects.filter(file__in=keys).values_list('file', flat=True))
+        failed_keys = delete_files(storage, keys)
+        OrphanedFile.objects.filter(
+            pk__in=[pk for pk, key in batch if key not in failed_keys]
+        ).delete()
+        purged += len(keys) - len(failed_keys)
+        failed += len(failed_keys)
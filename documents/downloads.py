@@ -0,0 +1,162 @@
+"""
+Serves the contents of Document files.
+
+When the storage can presign URLs (S3), clients are redirected to download
+the file straight from storage. Otherwise the file is streamed from storage in
+fixed-size chunks, with support for single byte ranges (so video and PDF
+viewers can seek cheaply) and conditional requests. The file is never read
+into memory as a whole.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.http import http_date, parse_etags, quote_etag
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.negotiation import DefaultContentNegotiation
+from storages.backends.s3boto3 import S3Boto3Storage
+
+CHUNK_SIZE = 64 * 1024
+
+RANGE_RE = re.compile(r'^\s*bytes=(\d*)-(\d*)\s*$')
+
+
+class FileContentNegotiation(DefaultContentNegotiation):
+    """
+    Lets clients that only accept the file's own media type (like a PDF
+    viewer) download it, rather than rejecting them with a 406. Errors are
+    still rendered with the view's first renderer.
+    """
+    def select_renderer(self, request, renderers, format_suffix=None):
+        try:
+            return super().select_renderer(request, renderers, format_suffix)
+        except NotAcceptable:
+            return renderers[0], renderers[0].media_type
+
+
+def can_presign(storage):
+    return isinstance(storage, S3Boto3Storage)
+
+
+def get_file_etag(name, size, modified_time):
+    """
+    Returns a strong ETag for the file stored at `name`, which changes
+    whenever the file is replaced.
+    """
+    key = f'{name}:{size}:{modified_time.timestamp()}'
+    return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+
+def parse_range(header, size):
+    """
+    Returns the inclusive `(start, end)` offsets of the byte range requested
+    by a Range `header`, or None if the whole file should be served.
+
+    Raises ValueError if the range is well-formed but can't be satisfied.
+    Invalid ranges are ignored, as RFC 7233 requires, and so are multiple
+    ranges, which aren't supported.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match:
+        return None
+
+    start, end = match.groups()
+    if not start and not end:
+        return None
+
+    if not start:
+        # A suffix range: the last `end` bytes
+        length = int(end)
+        if not length or not size:
+            raise ValueError('Unsatisfiable range.')
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    if end and int(end) < start:
+        # A range that ends before it starts is invalid, not unsatisfiable
+        return None
+    if start >= size:
+        raise ValueError('Unsatisfiable range.')
+    end = min(int(end), size - 1) if end else size - 1
+    return start, end
+
+
+def stream_file(storage, name, start, length, chunk_size=CHUNK_SIZE):
+    """
+    Yields `length` bytes of the file stored at `name` from offset `start`,
+    one chunk at a time.
+    """
+    with storage.open(name, 'rb') as f:
+        if start:
+            f.seek(start)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def serve_file(request, field_file):
+    """
+    Returns a response that serves the contents of `field_file`, either as a
+    redirect to a presigned URL or as a stream.
+    """
+    storage, name = field_file.storage, field_file.name
+    filename = os.path.basename(name)
+
+    if settings.DOCUMENT_DOWNLOAD_REDIRECT and can_presign(storage):
+        return HttpResponseRedirect(storage.url(name, parameters={
+            'ResponseContentDisposition': f'inline; filename="{filename}"'
+        }))
+
+    size = storage.size(name)
+    modified_time = storage.get_modified_time(name)
+    etag = get_file_etag(name, size, modified_time)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(modified_time.timestamp()),
+        'Accept-Ranges': 'bytes',
+    }
+
+    if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if etag in if_none_match or '*' in if_none_match:
+        return with_headers(HttpResponse(status=304), headers)
+
+    # Only honour a Range if the client's copy is still current
+    range_header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if if_range and if_range.strip() != etag:
+        range_header = None
+
+    try:
+        byte_range = parse_range(range_header, size)
+    except ValueError:
+        headers['Content-Range'] = f'bytes */{size}'
+        return with_headers(HttpResponse(status=416), headers)
+
+    if byte_range is None:
+        start, end, status = 0, size - 1, 200
+    else:
+        start, end = byte_range
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    length = end - start + 1
+    response = StreamingHttpResponse(
+        stream_file(storage, name, start, length),
+        status=status,
+        content_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    )
+    headers['Content-Length'] = str(length)
+    headers['Content-Disposition'] = f'inline; filename="{filename}"'
+    return with_headers(response, headers)
+
+
+def with_headers(response, headers):
+    for header, value in headers.items():
+        response[header] = value
+    return response
@@ -0,0 +1,193 @@
+"""
+Shaping responses with query parameters.
+
+- `?fields=id,name` only includes the given fields, and `?omit=file` leaves
+  the given fields out. Fields that aren't included aren't loaded either: the
+  queryset only selects the columns the remaining fields need, and skips the
+  prefetches of omitted relations.
+- `?expand=` adds optional fields, or inlines related objects in place of
+  their ids. `?expand=folder,topics` inlines a document's folder and topics
+  (likewise a folder's topics, and a topic's folders and documents), from
+  the same prefetches the ids come from.
+  `?expand=ancestors,path_names` adds breadcrumbs, the folders above a folder
+  or document. A list resolves the ancestors of its whole page with one query
+  (see documents.tree.prefetch_ancestors()).
+
+Breadcrumbs and inlined objects change whenever the related objects do,
+without the object that includes them being saved. So expanded responses are
+also validated by, and cached against, the related model as a whole.
+
+Only the list and retrieve actions are shaped. Writes always accept and
+return every field.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import ManyToManyField, Max
+from django.utils.http import urlencode
+from rest_framework import permissions, serializers
+from rest_framework.relations import ManyRelatedField
+
+from documents.models import Document, Folder, Topic
+
+BREADCRUMB_FIELDS = {'ancestors', 'path_names'}
+
+# The related models each expanded field depends on
+EXPANSION_DEPENDENCIES = {
+    'ancestors': Folder,
+    'path_names': Folder,
+    'folder': Folder,
+    'folders': Folder,
+    'documents': Document,
+    'topics': Topic,
+}
+
+SHAPING_PARAMS = ('fields', 'omit', 'expand')
+
+
+def get_param_set(request, param):
+    """
+    Returns the set of comma-separated names given in the `param` query
+    parameter of `request`, which may be repeated.
+    """
+    if request is None:
+        return set()
+    return {
+        name.strip()
+        for value in request.query_params.getlist(param)
+        for name in value.split(',')
+        if name.strip()
+    }
+
+
+def get_expand(request):
+    """
+    Returns the set of field names a `request` asked to expand.
+    """
+    return get_param_set(request, 'expand')
+
+
+def expands_breadcrumbs(request):
+    return bool(get_expand(request) & BREADCRUMB_FIELDS)
+
+
+def is_shaped(request):
+    return request is not None and request.method in permissions.SAFE_METHODS
+
+
+class ExpandableFieldsMixin:
+    """
+    Applies `?fields=`, `?omit=` and `?expand=` to a serializer's fields.
+
+    The fields listed in `Meta.expandable_fields` are left out unless they
+    are expanded. The relations in `Meta.expanded_fields`, a dictionary of
+    field names to serializer classes, are inlined with those serializers
+    when they are expanded.
+    """
+    def get_fields(self):
+        fields = super().get_fields()
+        request = self.context.get('request')
+        expand = get_expand(request)
+
+        for name in getattr(self.Meta, 'expandable_fields', []):
+            if name not in expand:
+                fields.pop(name, None)
+
+        for name, serializer_class in getattr(self.Meta, 'expanded_fields', {}).items():
+            if name in expand and name in fields:
+                field = fields[name]
+                fields[name] = serializer_class(
+                    many=isinstance(field, ManyRelatedField),
+                    read_only=True,
+                    **({'source': field.source} if field.source and field.source != name else {})
+                )
+
+        if is_shaped(request):
+            only = get_param_set(request, 'fields')
+            omit = get_param_set(request, 'omit')
+            for name in list(fields):
+                if (only and name not in only) or name in omit:
+                    del fields[name]
+
+        return fields
+
+
+class ExpandMixin:
+    """
+    Shapes the querysets of a viewset's list and retrieve actions to the
+    fields being serialized, and makes their conditional GETs and cached
+    responses account for the expanded fields.
+    """
+    # The relations to prefetch when their fields are serialized
+    prefetch_fields = []
+
+    # The foreign keys to select along with each row when they're inlined
+    select_fields = []
+
+    # Extra columns that serialized fields depend on, beyond their own
+    field_columns = {}
+
+    # Columns that are always loaded
+    required_columns = []
+
+    def is_shaping(self):
+        return self.action in ('list', 'retrieve') and is_shaped(self.request)
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if not self.is_shaping():
+            return queryset
+
+        fields = self.get_serializer().fields
+        model = queryset.model
+
+        # The cursor pagination keys on `created_at`
+        columns = {
+            model._meta.pk.name,
+            'created_at',
+            *self.required_columns,
+            *getattr(self, 'validator_fields', [])
+        }
+        for name, field in fields.items():
+            columns.update(self.field_columns.get(name, []))
+            try:
+                model_field = model._meta.get_field(field.source)
+            except FieldDoesNotExist:
+                continue
+            if model_field.concrete and not isinstance(model_field, ManyToManyField):
+                columns.add(model_field.name)
+
+        # A single object gains nothing from prefetching, and may not even be
+        # serialized if it hasn't been modified
+        prefetches = []
+        if self.action == 'list':
+            prefetches = [name for name in self.prefetch_fields if name in fields]
+        queryset = queryset.prefetch_related(None).prefetch_related(*prefetches).only(*columns)
+
+        selects = [
+            name for name in self.select_fields
+            if isinstance(fields.get(name), serializers.BaseSerializer)
+        ]
+        if selects:
+            queryset = queryset.select_related(*selects)
+        return queryset
+
+    def get_etag_parts(self, request):
+        parts = super().get_etag_parts(request)
+        # Detail ETags don't include the query string, so add the shaping
+        # parameters that change the representation
+        parts.append(urlencode(sorted(
+            (param, sorted(get_param_set(request, param))) for param in SHAPING_PARAMS
+        ), doseq=True))
+        for dependency in self.get_expansion_dependencies(request):
+            parts.append(dependency.objects.aggregate(Max('updated_at'))['updated_at__max'])
+        return parts
+
+    def get_cache_dependencies(self, request):
+        return super().get_cache_dependencies(request) + self.get_expansion_dependencies(request)
+
+    def get_expansion_dependencies(self, request):
+        dependencies = []
+        for name in sorted(get_expand(request)):
+            dependency = EXPANSION_DEPENDENCIES.get(name)
+            if dependency and dependency not in dependencies:
+                dependencies.append(dependency)
+        return dependencies
@@ -0,0 +1,76 @@
+"""
+Faceted counts for filtered sets of documents.
+
+Rather than one COUNT per topic, the documents matching a DocumentFilter are
+counted per topic with a single GROUP BY over the topics through table, and
+per folder branch with a single GROUP BY over a prefix of the folders'
+materialized paths.
+"""
+from django.db.models import Count
+from django.db.models.functions import Substr
+
+from documents.models import Folder, Topic
+from documents.tree import subtree_q
+
+
+def get_topic_facets(documents):
+    """
+    Returns the number of `documents` tagged with each topic, most common
+    first. Topics that tag none of them are left out.
+    """
+    links = Topic.documents.through.objects.filter(
+        document__in=documents.order_by().values('pk')
+    )
+    rows = links.values('topic_id', 'topic__name').annotate(
+        count=Count('document_id')
+    ).order_by('-count', 'topic__name', 'topic_id')
+
+    return [
+        {'id': row['topic_id'], 'name': row['topic__name'], 'count': row['count']}
+        for row in rows
+    ]
+
+
+def get_folder_facets(documents, parent=None):
+    """
+    Returns the total number of `documents`, and the number inside the
+    branch of each child of `parent` (or of each root folder), most common
+    first.
+
+    `documents` should already be limited to `parent`'s branch. Documents
+    directly inside `parent` count towards the total, but not towards any
+    branch.
+    """
+    depth = parent.depth + 1 if parent else 1
+    branch_path = Substr('folder__path', 1, depth * Folder.steplen)
+    rows = documents.order_by().annotate(
+        branch_path=branch_path
+    ).values('branch_path').annotate(count=Count('pk'))
+
+    counts = {row['branch_path']: row['count'] for row in rows}
+    total = sum(counts.values())
+    if parent:
+        counts.pop(parent.path, None)
+
+    branches = Folder.objects.filter(path__in=counts, depth=depth).values('pk', 'name', 'path')
+    facets = [
+        {'id': branch['pk'], 'name': branch['name'], 'count': counts[branch['path']]}
+        for branch in branches
+    ]
+    facets.sort(key=lambda facet: (-facet['count'], facet['name'], str(facet['id'])))
+    return total, facets
+
+
+def get_facets(documents, parent=None):
+    """
+    Returns the facet counts of `documents`, optionally within `parent`'s
+    branch, in three queries whatever the number of topics and folders.
+    """
+    if parent:
+        documents = documents.filter(subtree_q(parent.pk, prefix='folder__'))
+    count, folders = get_folder_facets(documents, parent)
+    return {
+        'count': count,
+        'topics': get_topic_facets(documents),
+        'folders': folders,
+    }
@@ -1,36 +1,82 @@
 import django_filters
-from django.core.exceptions import ObjectDoesNotExist
+from django import forms
 
+from documents import topic_index
 from documents.models import Document, Folder, Topic
+from documents.search import search
+from documents.tree import ancestors_q, descendants_q, subtree_q
+
+
+class IntegerFilter(django_filters.NumberFilter):
+    field_class = forms.IntegerField
+
+
+class UUIDInFilter(django_filters.BaseInFilter, django_filters.UUIDFilter):
+    pass
+
+
+class SearchFilter(django_filters.CharFilter):
+    """
+    Full-text search over names and descriptions, ranked by relevance.
+    See documents.search.
+    """
+    def filter(self, qs, value):
+        if not value:
+            return qs
+        return search(qs, value)
 
 
 class FolderFilter(django_filters.FilterSet):
+    search = SearchFilter()
     parent = django_filters.UUIDFilter(method="filter_parent")
     child = django_filters.UUIDFilter(method="filter_child")
+    ancestor_of = django_filters.UUIDFilter(method="filter_ancestor_of")
+    descendant_of = django_filters.UUIDFilter(method="filter_descendant_of")
+    depth = IntegerFilter(field_name='depth', min_value=1)
+    min_depth = IntegerFilter(field_name='depth', lookup_expr='gte', min_value=1)
+    max_depth = IntegerFilter(field_name='depth', lookup_expr='lte', min_value=1)
+    is_root = django_filters.BooleanFilter(method="filter_is_root")
+    is_leaf = django_filters.BooleanFilter(method="filter_is_leaf")
     topics = django_filters.ModelMultipleChoiceFilter(queryset=Topic.objects.all())
     created_at = django_filters.IsoDateTimeFromToRangeFilter()
     updated_at = django_filters.IsoDateTimeFromToRangeFilter()
 
+    # Each tree filter compiles to a single predicate on `path` and `depth`,
+    # so an unknown folder id simply matches nothing
+
     def filter_parent(self, queryset, name, value):
-        try:
-            child_pks = Folder.objects.get(pk=value).get_children()
-            return queryset.filter(pk__in=child_pks)
-        except ObjectDoesNotExist:
-            return Folder.objects.none()
+        return queryset.filter(descendants_q(value, max_depth=1))
 
     def filter_child(self, queryset, name, value):
-        try:
-            parent = Folder.objects.get(pk=value).get_parent()
-            return queryset.filter(pk=parent.pk)
-        except (ObjectDoesNotExist, AttributeError):
-            return Folder.objects.none()
+        return queryset.filter(ancestors_q(value, levels=1))
+
+    def filter_ancestor_of(self, queryset, name, value):
+        return queryset.filter(ancestors_q(value))
+
+    def filter_descendant_of(self, queryset, name, value):
+        return queryset.filter(descendants_q(value))
+
+    def filter_is_root(self, queryset, name, value):
+        return queryset.filter(depth=1) if value else queryset.exclude(depth=1)
+
+    def filter_is_leaf(self, queryset, name, value):
+        return queryset.filter(numchild=0) if value else queryset.exclude(numchild=0)
 
     class Meta:
         model = Folder
         fields = [
             'id',
             'name',
+            'search',
             'parent',
+            'child',
+            'ancestor_of',
+            'descendant_of',
+            'depth',
+            'min_depth',
+            'max_depth',
+            'is_root',
+            'is_leaf',
             'topics',
             'created_at',
             'updated_at'
@@ -38,24 +84,54 @@ class FolderFilter(django_filters.FilterSet):
 
 
 class DocumentFilter(django_filters.FilterSet):
+    search = SearchFilter()
     folder_id = django_filters.UUIDFilter(field_name='folder__pk', lookup_expr='exact')
+    folder_subtree = django_filters.UUIDFilter(method="filter_folder_subtree")
+    max_depth = IntegerFilter(method="filter_max_depth", min_value=0)
     topics = django_filters.ModelMultipleChoiceFilter(queryset=Topic.objects.all())
+    topics_all = UUIDInFilter(method="filter_topics_all")
+    topics_any = UUIDInFilter(method="filter_topics_any")
+    topics_none = UUIDInFilter(method="filter_topics_none")
     created_at = django_filters.IsoDateTimeFromToRangeFilter()
     updated_at = django_filters.IsoDateTimeFromToRangeFilter()
 
+    def filter_folder_subtree(self, queryset, name, value):
+        max_depth = self.form.cleaned_data.get('max_depth')
+        return queryset.filter(subtree_q(value, max_depth, prefix='folder__'))
+
+    def filter_max_depth(self, queryset, name, value):
+        # Only meaningful alongside folder_subtree, which applies it
+        return queryset
+
+    def filter_topics_all(self, queryset, name, value):
+        return topic_index.filter_topics_all(queryset, value)
+
+    def filter_topics_any(self, queryset, name, value):
+        return topic_index.filter_topics_any(queryset, value)
+
+    def filter_topics_none(self, queryset, name, value):
+        return topic_index.filter_topics_none(queryset, value)
+
     class Meta:
         model = Document
         fields = [
             'id',
             'name',
+            'search',
             'folder_id',
+            'folder_subtree',
+            'max_depth',
             'topics',
+            'topics_all',
+            'topics_any',
+            'topics_none',
             'created_at',
             'updated_at'
         ]
 
 
 class TopicFilter(django_filters.FilterSet):
+    search = SearchFilter()
     folders = django_filters.ModelMultipleChoiceFilter(queryset=Folder.objects.all())
     documents = django_filters.ModelMultipleChoiceFilter(queryset=Document.objects.all())
     created_at = django_filters.IsoDateTimeFromToRangeFilter()
@@ -66,6 +142,7 @@ class TopicFilter(django_filters.FilterSet):
         fields = [
             'id',
             'name',
+            'search',
             'folders',
             'documents',
             'created_at',
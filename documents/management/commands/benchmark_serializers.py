@@ -0,0 +1,84 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from documents.models import Document, Folder, Topic
+from documents.renderers import ORJSONRenderer, orjson
+from documents.serializers import DocumentSerializer, FolderSerializer, TopicSerializer
+from documents.tree import add_folders
+from documents.values import FolderValuesSerializer, ValuesSerializer
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures how many rows per second the list endpoints serialize and render, "
+        "with the ModelSerializers and with the values() fast path. The rows are "
+        "created in a transaction that is rolled back afterward."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000,
+                            help="How many folders, documents and topics to serialize")
+        parser.add_argument('--repeat', type=int, default=5,
+                            help="How many times to run each case, keeping the fastest")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.create_rows(options['rows'])
+            request = Request(APIRequestFactory().get('/'))
+            for model, serializer_class, values_serializer_class in [
+                (Folder, FolderSerializer, FolderValuesSerializer),
+                (Document, DocumentSerializer, ValuesSerializer),
+                (Topic, TopicSerializer, ValuesSerializer),
+            ]:
+                self.benchmark(model, serializer_class, values_serializer_class, request, options)
+            transaction.set_rollback(True)
+
+    def create_rows(self, rows):
+        root = Folder.add_root(name="benchmark")
+        folders = add_folders([(root, Folder(name=f"folder {i}")) for i in range(rows - 1)])
+        topics = Topic.objects.bulk_create([Topic(name=f"topic {i}") for i in range(rows)])
+        documents = Document.objects.bulk_create([
+            Document(name=f"document {i}", folder=folders[i % len(folders)], file=f"benchmark/{i}.txt")
+            for i in range(rows)
+        ])
+        for i, topic in enumerate(topics[:10]):
+            topic.folders.add(*folders[i::10])
+            topic.documents.add(*documents[i::10])
+
+    def benchmark(self, model, serializer_class, values_serializer_class, request, options):
+        queryset = model.objects.order_by('-created_at', '-id')[:options['rows']]
+        serializer = serializer_class(context={'request': request})
+        m2m = [
+            name for name in ('topics', 'folders', 'documents')
+            if name in serializer.fields
+        ]
+
+        def model_serializer():
+            return serializer_class(queryset.prefetch_related(*m2m), many=True, context={'request': request}).data
+
+        def values_serializer():
+            values = values_serializer_class(serializer)
+            return values.serialize(queryset.values(*values.columns))
+
+        cases = [
+            ('ModelSerializer + JSONRenderer', model_serializer, JSONRenderer()),
+            ('values() + JSONRenderer', values_serializer, JSONRenderer()),
+        ]
+        if orjson is not None:
+            cases.append(('values() + ORJSONRenderer', values_serializer, ORJSONRenderer()))
+
+        self.stdout.write(model._meta.verbose_name_plural.title())
+        for label, serialize, renderer in cases:
+            best = None
+            for _ in range(options['repeat']):
+                start = time.perf_counter()
+                data = serialize()
+                renderer.render(data)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            self.stdout.write(f"  {label:<32} {len(data) / best:>12,.0f} rows/sec")
@@ -0,0 +1,32 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from documents.serializers import FolderImportSerializer
+
+
+class Command(BaseCommand):
+    help = "Imports a nested JSON tree of folders in one pass"
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="Path to the JSON tree, or - to read from stdin")
+        parser.add_argument('--parent', help="Id of the folder to import under. Imports "
+                                             "as root folders if omitted.")
+
+    def handle(self, *args, **options):
+        if options['file'] == '-':
+            folders = json.load(sys.stdin)
+        else:
+            with open(options['file']) as f:
+                folders = json.load(f)
+
+        serializer = FolderImportSerializer(data={
+            'parent': options['parent'],
+            'folders': folders,
+        })
+        if not serializer.is_valid():
+            raise CommandError(json.dumps(serializer.errors, indent=2))
+
+        top_level = serializer.save()
+        self.stdout.write(f"Imported {len(top_level)} top-level folders")
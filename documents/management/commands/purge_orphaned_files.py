@@ -0,0 +1,39 @@
+import time
+import traceback
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from documents.deletion import PURGE_BATCH_SIZE, purge_orphaned_files
+
+
+class Command(BaseCommand):
+    help = "Deletes the files of deleted documents from storage"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PURGE_BATCH_SIZE,
+                            help="How many files to delete per storage request")
+        parser.add_argument('--loop', action='store_true',
+                            help="Keep running, purging the queue every --interval seconds")
+        parser.add_argument('--interval', type=int, default=60,
+                            help="How many seconds to wait between runs with --loop")
+
+    def handle(self, *args, **options):
+        if not options['loop']:
+            self.purge(options['batch_size'], verbose=True)
+            return
+
+        while True:
+            # A storage or database outage shouldn't stop the worker: log it
+            # and try again next time, with a fresh database connection
+            try:
+                self.purge(options['batch_size'])
+            except Exception:
+                self.stderr.write(f"Purging orphaned files failed:\n{traceback.format_exc()}")
+                close_old_connections()
+            time.sleep(options['interval'])
+
+    def purge(self, batch_size, verbose=False):
+        purged, failed = purge_orphaned_files(batch_size=batch_size)
+        if purged or failed or verbose:
+            self.stdout.write(f"Purged {purged} files, {failed} failed")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from documents.tree import repair_document_counts
+
+
+class Command(BaseCommand):
+    help = "Recomputes the document counts of folders whose counts have drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report how many folders have drifted without fixing them")
+
+    def handle(self, *args, **options):
+        drifted = repair_document_counts(dry_run=options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write(f"{drifted} folders have drifted document counts")
+        else:
+            self.stdout.write(f"Repaired the document counts of {drifted} folders")
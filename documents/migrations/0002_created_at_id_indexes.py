@@ -0,0 +1,25 @@
+# Generated by Django 3.2.12 on 2026-10-17 00:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['created_at', 'id'], name='document_created_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='folder',
+            index=models.Index(fields=['created_at', 'id'], name='folder_created_at_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='topic',
+            index=models.Index(fields=['created_at', 'id'], name='topic_created_at_id_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.12 on 2026-10-17 00:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0002_created_at_id_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['folder', 'created_at', 'id'], name='document_folder_created_idx'),
+        ),
+    ]
@@ -0,0 +1,85 @@
+# Generated by Django 3.2.12 on 2026-10-17 00:18
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+SEARCH_TABLES = [
+    'documents_folder',
+    'documents_document',
+    'documents_topic',
+]
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('pg_catalog.english', coalesce({row}name, '')), 'A') || "
+    "setweight(to_tsvector('pg_catalog.english', coalesce({row}long_description, '')), 'B')"
+)
+
+
+def install_search_triggers(apps, schema_editor):
+    """
+    Keeps search_vector up to date with a trigger, so every write path
+    (including bulk_create() and QuerySet.update()) maintains it.
+
+    Only Postgres has tsvector columns; SQLite uses the FTS5 tables installed
+    by documents.search instead.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    for table in SEARCH_TABLES:
+        schema_editor.execute(f"""
+            CREATE FUNCTION {table}_search_vector_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := {SEARCH_VECTOR.format(row='NEW.')};
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        """)
+        schema_editor.execute(f"""
+            CREATE TRIGGER {table}_search_vector_trigger
+            BEFORE INSERT OR UPDATE OF name, long_description ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE {table}_search_vector_update()
+        """)
+        schema_editor.execute(
+            f"UPDATE {table} SET search_vector = {SEARCH_VECTOR.format(row='')}"
+        )
+        schema_editor.execute(
+            f"CREATE INDEX {table}_search_vector_idx ON {table} USING gin(search_vector)"
+        )
+
+
+def remove_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    for table in SEARCH_TABLES:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {table}_search_vector_idx")
+        schema_editor.execute(f"DROP TRIGGER IF EXISTS {table}_search_vector_trigger ON {table}")
+        schema_editor.execute(f"DROP FUNCTION IF EXISTS {table}_search_vector_update()")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0003_document_folder_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(install_search_triggers, remove_search_triggers),
+    ]
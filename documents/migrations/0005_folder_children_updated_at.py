@@ -0,0 +1,18 @@
+# Generated by Django 3.2.12 on 2026-10-17 00:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0004_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='children_updated_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+    ]
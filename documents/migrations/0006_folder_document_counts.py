@@ -0,0 +1,44 @@
+# Generated by Django 3.2.12 on 2026-10-17 00:52
+
+from django.db import migrations, models
+from django.db.models import F, Func, IntegerField, OuterRef, Subquery
+
+
+def count_documents(apps, schema_editor):
+    Folder = apps.get_model('documents', 'Folder')
+    Document = apps.get_model('documents', 'Document')
+
+    def count(documents):
+        return Subquery(
+            documents.order_by().annotate(count=Func(F('pk'), function='COUNT')).values('count'),
+            output_field=IntegerField()
+        )
+
+    Folder.objects.using(schema_editor.connection.alias).update(
+        document_count=count(Document.objects.filter(folder=OuterRef('pk'))),
+        descendant_document_count=count(Document.objects.filter(
+            folder__path__startswith=OuterRef('path'),
+            folder__depth__gt=OuterRef('depth')
+        ))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0005_folder_children_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='folder',
+            name='descendant_document_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='folder',
+            name='document_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.2.12 on 2026-10-17 01:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0006_folder_document_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrphanedFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Orphaned file',
+                'verbose_name_plural': 'Orphaned files',
+            },
+        ),
+    ]
@@ -1,5 +1,8 @@
 import uuid
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.db import models, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 from treebeard.mp_tree import MP_Node
 
@@ -30,18 +33,114 @@ class Folder(MP_Node):
         default=""
     )
 
+    # Maintained by a database trigger, see documents.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
     created_at = models.DateTimeField(auto_now_add=True)
 
     updated_at = models.DateTimeField(auto_now=True)
 
+    # When a child was last added, moved in or out, or deleted. `children` is
+    # derived from the tree, so those changes don't bump updated_at, but
+    # conditional GETs need to see them; see documents.conditional
+    children_updated_at = models.DateTimeField(null=True, editable=False)
+
+    # The number of documents directly inside the folder, and inside all of
+    # its descendants. Both are kept up to date incrementally, see
+    # adjust_document_counts(), and can be recomputed with the
+    # repair_document_counts command if they ever drift
+    document_count = models.IntegerField(default=0, editable=False)
+
+    descendant_document_count = models.IntegerField(default=0, editable=False)
+
     node_order_by = ['name', 'id']
 
     def __str__(self):
         return f"Folder: {self.name}"
 
+    def get_cached_children(self):
+        """
+        Returns the children populated by documents.tree.prefetch_tree(), or
+        falls back to treebeard's get_children() query if there are none.
+        """
+        try:
+            return self._cached_children
+        except AttributeError:
+            return self.get_children()
+
+    def get_cached_ancestors(self):
+        """
+        Returns the ancestors populated by documents.tree.prefetch_ancestors(),
+        root first, or falls back to treebeard's get_ancestors() query if there
+        are none.
+        """
+        try:
+            return self._cached_ancestors
+        except AttributeError:
+            return list(self.get_ancestors())
+
+    @classmethod
+    def get_ancestor_paths(cls, path):
+        """
+        Returns the paths of all the ancestors of the node at `path`.
+        """
+        return [path[:end] for end in range(cls.steplen, len(path), cls.steplen)]
+
+    @classmethod
+    def adjust_document_counts(cls, deltas):
+        """
+        Applies `deltas`, a dictionary mapping folder pks to the change in the
+        number of documents directly inside them, to the document counts of
+        those folders and of all their ancestors.
+        """
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+        if not deltas:
+            return
+
+        own, below = {}, {}
+        for pk, path in cls.objects.filter(pk__in=deltas).values_list('pk', 'path'):
+            own[path] = own.get(path, 0) + deltas[pk]
+            for ancestor_path in cls.get_ancestor_paths(path):
+                below[ancestor_path] = below.get(ancestor_path, 0) + deltas[pk]
+
+        cls.apply_document_count_deltas(own, below)
+
+    @classmethod
+    def apply_document_count_deltas(cls, own, below):
+        """
+        Adds `own[path]` to the `document_count` and `below[path]` to the
+        `descendant_document_count` of the folder at each path, in a single
+        UPDATE. The counts are part of the folders' representations, so the
+        same UPDATE bumps their `updated_at`, and their cached responses are
+        dropped.
+        """
+        from documents.cache import invalidate_folder_paths
+
+        def increment(field, deltas):
+            if not deltas:
+                return F(field)
+            return F(field) + Case(
+                *[When(path=path, then=Value(delta)) for path, delta in deltas.items()],
+                default=Value(0),
+                output_field=IntegerField()
+            )
+
+        paths = set(own) | set(below)
+        if paths:
+            cls.objects.filter(path__in=paths).update(
+                document_count=increment('document_count', own),
+                descendant_document_count=increment('descendant_document_count', below),
+                updated_at=timezone.now()
+            )
+            invalidate_folder_paths(paths)
+
     class Meta:
         verbose_name = _("Folder")
         verbose_name_plural = _("Folders")
+        indexes = [
+            # Supports keyset pagination, see documents.pagination
+            models.Index(fields=['created_at', 'id'], name='folder_created_at_id_idx'),
+        ]
 
 
 class Document(models.Model):
@@ -64,6 +163,9 @@ class Document(models.Model):
         default=""
     )
 
+    # Maintained by a database trigger, see documents.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
     file = models.FileField()
 
     folder = models.ForeignKey(to="documents.Folder", on_delete=models.CASCADE)
@@ -75,9 +177,48 @@ class Document(models.Model):
     def __str__(self):
         return f"Document: {self.name}"
 
+    def get_cached_ancestors(self):
+        """
+        Returns the document's folder and the folder's ancestors, root first.
+        """
+        return [*self.folder.get_cached_ancestors(), self.folder]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember which folder's document counts include this document,
+        # unless the folder was deferred; save() looks it up then
+        if 'folder_id' in instance.__dict__:
+            instance._counted_folder_id = instance.folder_id
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Update the folders' document counts in the same transaction
+        with transaction.atomic(using=kwargs.get('using')):
+            if self._state.adding:
+                counted_folder_id = None
+            elif hasattr(self, '_counted_folder_id'):
+                counted_folder_id = self._counted_folder_id
+            else:
+                counted_folder_id = type(self).objects.filter(pk=self.pk).values_list('folder_id', flat=True).first()
+            super().save(*args, **kwargs)
+            if counted_folder_id != self.folder_id:
+                deltas = {self.folder_id: 1}
+                if counted_folder_id is not None:
+                    deltas[counted_folder_id] = -1
+                Folder.adjust_document_counts(deltas)
+            self._counted_folder_id = self.folder_id
+
     class Meta:
         verbose_name = _("Document")
         verbose_name_plural = _("Documents")
+        indexes = [
+            # Supports keyset pagination, see documents.pagination
+            models.Index(fields=['created_at', 'id'], name='document_created_at_id_idx'),
+            # Supports paginating the documents of a folder or a folder
+            # subtree, see DocumentFilter
+            models.Index(fields=['folder', 'created_at', 'id'], name='document_folder_created_idx'),
+        ]
 
 
 class Topic(models.Model):
@@ -97,6 +238,9 @@ class Topic(models.Model):
         default=""
     )
 
+    # Maintained by a database trigger, see documents.search
+    search_vector = SearchVectorField(null=True, editable=False)
+
     folders = models.ManyToManyField(to="documents.Folder", related_name="topics")
 
     documents = models.ManyToManyField(to="documents.Document", related_name="topics")
@@ -111,3 +255,25 @@ class Topic(models.Model):
     class Meta:
         verbose_name = _("Topic")
         verbose_name_plural = _("Topics")
+        indexes = [
+            # Supports keyset pagination, see documents.pagination
+            models.Index(fields=['created_at', 'id'], name='topic_created_at_id_idx'),
+        ]
+
+
+class OrphanedFile(models.Model):
+    """
+    A stored file whose Document was deleted, queued for the
+    purge_orphaned_files command to delete from storage. See
+    documents.deletion.
+    """
+    key = models.CharField(max_length=255)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Orphaned file: {self.key}"
+
+    class Meta:
+        verbose_name = _("Orphaned file")
+        verbose_name_plural = _("Orphaned files")
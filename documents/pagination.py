@@ -0,0 +1,220 @@
+import uuid
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    BasePagination, Cursor, CursorPagination, PageNumberPagination
+)
+
+from documents.search import is_ranked
+
+
+def estimate_count(queryset):
+    """
+    Returns the Postgres planner's estimate of the number of rows in the
+    queryset's table, or None if no estimate is available.
+
+    The estimate comes from pg_class.reltuples, which is maintained by VACUUM
+    and ANALYZE, so it costs a single catalog lookup instead of a full scan.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+            [queryset.model._meta.db_table]
+        )
+        row = cursor.fetchone()
+
+    # reltuples is -1 (or 0 on older versions) for never-analyzed tables
+    if row is None or row[0] <= 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A Paginator that serves the planner's row estimate as the count of
+    unfiltered querysets.
+
+    Planner estimates are imprecise for small tables, so tables estimated to
+    have fewer than `estimate_threshold` rows are still counted exactly, as
+    are filtered querysets.
+    """
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        if not self.object_list.query.where:
+            estimate = estimate_count(self.object_list)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                return estimate
+        return super().count
+
+
+class EstimatedCountPagination(PageNumberPagination):
+    """
+    Page number pagination that avoids a COUNT(*) over the whole table for
+    unfiltered list requests. See EstimatedCountPaginator.
+    """
+    django_paginator_class = EstimatedCountPaginator
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Cursor pagination keyed on `(created_at, id)`.
+
+    DRF's CursorPagination only keys on the first ordering field, and falls
+    back to an OFFSET to step over rows that share a timestamp. Including the
+    primary key in the position makes every position unique, so each page is
+    fetched with a single index range scan and no OFFSET at all.
+    """
+    ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+        current_position = self.cursor.position if self.cursor else None
+
+        if reverse:
+            queryset = queryset.order_by('created_at', 'id')
+        else:
+            queryset = queryset.order_by('-created_at', '-id')
+
+        if current_position is not None:
+            created_at, pk = self._parse_position(current_position)
+            if reverse:
+                queryset = queryset.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+                )
+            else:
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+                )
+
+        # We always fetch an extra item in order to determine if there is a
+        # page following on from this one.
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_following = len(results) > len(self.page)
+
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = current_position is not None
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+
+        if self.page:
+            position = self._get_position_from_instance(self.page[-1], self.ordering)
+        else:
+            position = self.cursor.position
+
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+
+        if self.page:
+            position = self._get_position_from_instance(self.page[0], self.ordering)
+        else:
+            position = self.cursor.position
+
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def _get_position_from_instance(self, instance, ordering):
+        if isinstance(instance, dict):
+            # A row from values(), see documents.values
+            return f"{instance['created_at'].isoformat()}|{instance['id']}"
+        return f"{instance.created_at.isoformat()}|{instance.pk}"
+
+    def _parse_position(self, position):
+        try:
+            created_at, _, pk = position.partition('|')
+            created_at = parse_datetime(created_at)
+            pk = uuid.UUID(pk)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
+
+        if created_at is None:
+            raise NotFound(self.invalid_cursor_message)
+
+        return created_at, pk
+
+
+class DocumentStorePagination(BasePagination):
+    """
+    Paginates with KeysetCursorPagination by default. Clients that still
+    need page numbers can opt into EstimatedCountPagination by passing the
+    `page` query parameter.
+
+    Search results are ordered by relevance rather than by `(created_at,
+    id)`, so they are always paginated by page number.
+    """
+    cursor_pagination_class = KeysetCursorPagination
+    page_number_pagination_class = EstimatedCountPagination
+
+    def __init__(self):
+        self.cursor_pagination = self.cursor_pagination_class()
+        self.page_number_pagination = self.page_number_pagination_class()
+        self.paginator = self.cursor_pagination
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if (
+            self.page_number_pagination.page_query_param in request.query_params or
+            is_ranked(queryset)
+        ):
+            self.paginator = self.page_number_pagination
+        else:
+            self.paginator = self.cursor_pagination
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.cursor_pagination.get_paginated_response_schema(schema)
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.paginator, 'display_page_controls', False)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_results(self, data):
+        return data['results']
+
+    def get_schema_fields(self, view):
+        return (
+            self.cursor_pagination.get_schema_fields(view) +
+            self.page_number_pagination.get_schema_fields(view)
+        )
+
+    def get_schema_operation_parameters(self, view):
+        return (
+            self.cursor_pagination.get_schema_operation_parameters(view) +
+            self.page_number_pagination.get_schema_operation_parameters(view)
+        )
@@ -0,0 +1,56 @@
+"""
+Faster renderers, for clients that ask for them.
+
+DRF's JSONRenderer stays the default, so responses are unchanged unless a
+client asks for `?format=orjson` (the same JSON, from orjson) or for
+MessagePack, with `Accept: application/msgpack` or `?format=msgpack`.
+"""
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+def encode_default(obj):
+    """
+    Encodes the types the serializers can return that orjson and msgpack
+    don't support natively (like UUIDs, decimals and lazy strings), the same
+    way DRF's JSON encoder does.
+    """
+    return JSONEncoder().default(obj)
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = 'application/json'
+    format = 'orjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None:
+            raise ImproperlyConfigured('ORJSONRenderer requires the orjson package.')
+        return orjson.dumps(data, default=encode_default)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if msgpack is None:
+            raise ImproperlyConfigured('MessagePackRenderer requires the msgpack package.')
+        return msgpack.packb(data, default=encode_default, use_bin_type=True)
@@ -0,0 +1,132 @@
+"""
+Routing reads to database replicas.
+
+The viewsets' safe requests read from a replica in DATABASE_REPLICAS, picked
+at random in proportion to its weight. A replica that can't be connected to
+is skipped for REPLICA_RETRY_AFTER seconds, and when none are available the
+request reads from the primary (`default`) like everything else.
+
+Replicas lag behind the primary, so after a successful write the response
+sets a cookie that pins the client's reads to the primary for
+REPLICA_PIN_SECONDS. Clients that don't keep cookies can send the
+`X-Read-Primary` header instead, with the same effect.
+
+Anything built from a read that outlives the request, like a cached response
+or the topic index, is read from the primary too (see read_from_primary()).
+A lagging replica could otherwise hand back rows from before a change that
+already invalidated them, and they'd be kept as if they were fresh.
+"""
+import contextlib
+import contextvars
+import random
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+from rest_framework.permissions import SAFE_METHODS
+
+PIN_COOKIE = 'read_primary'
+PIN_HEADER = 'HTTP_X_READ_PRIMARY'
+
+# The replica that reads are routed to during the current request, if any
+_replica = contextvars.ContextVar('replica', default=None)
+
+# When each unavailable replica may be tried again, in this process
+_unavailable_until = {}
+
+
+def get_replicas():
+    """
+    Returns the aliases and weights of the replicas that are available.
+    """
+    now = time.monotonic()
+    return {
+        alias: weight
+        for alias, weight in settings.DATABASE_REPLICAS.items()
+        if weight > 0 and _unavailable_until.get(alias, 0) <= now
+    }
+
+
+def mark_unavailable(alias):
+    _unavailable_until[alias] = time.monotonic() + settings.REPLICA_RETRY_AFTER
+
+
+def choose_replica():
+    """
+    Returns the alias of an available replica, chosen by weight, or None.
+    """
+    replicas = get_replicas()
+    while replicas:
+        alias = random.choices(list(replicas), weights=list(replicas.values()))[0]
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError:
+            mark_unavailable(alias)
+            del replicas[alias]
+        else:
+            return alias
+    return None
+
+
+@contextlib.contextmanager
+def read_from_primary():
+    """
+    Reads from the primary inside the block, even during a request that
+    reads from a replica.
+    """
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def is_pinned(request):
+    return PIN_COOKIE in request.COOKIES or bool(request.META.get(PIN_HEADER))
+
+
+class ReplicaRouter:
+    """
+    Sends reads to the replica chosen for the current request, and
+    everything else to the primary.
+    """
+    def db_for_read(self, model, **hints):
+        return _replica.get()
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+
+class ReplicaReadMixin:
+    """
+    Reads from a replica during a viewset's safe requests, unless the client
+    wrote recently, and pins the client to the primary after each write.
+    """
+    def dispatch(self, request, *args, **kwargs):
+        # Reset the replica however the request ends, including with an
+        # exception that DRF doesn't handle, so that the thread's later
+        # requests don't inherit it
+        token = _replica.set(None)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            _replica.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        # Users and tokens are still read from the primary, since a replica
+        # may not have them yet
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and not is_pinned(request):
+            _replica.set(choose_replica())
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            response.set_cookie(
+                PIN_COOKIE, '1', max_age=settings.REPLICA_PIN_SECONDS,
+                secure=request.is_secure(), httponly=True, samesite='Lax'
+            )
+        return response
@@ -0,0 +1,133 @@
+"""
+Full-text search over the names and descriptions of folders, documents and
+topics.
+
+On Postgres, each table has a `search_vector` tsvector column with a GIN
+index, which a trigger keeps up to date on every write (see migration 0004).
+Names are weighted above descriptions when results are ranked.
+
+SQLite has no tsvector, so local development and the test suite use an FTS5
+virtual table per model instead, kept up to date by triggers of its own. The
+FTS5 tables are (re)installed after every `migrate`, since SQLite drops a
+table's triggers whenever Django rebuilds the table to alter it.
+
+Any other database falls back to a case-insensitive substring search,
+without an index.
+"""
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+
+SEARCH_CONFIG = 'english'
+
+SEARCH_TABLES = [
+    'documents_folder',
+    'documents_document',
+    'documents_topic',
+]
+
+
+def search(queryset, terms):
+    """
+    Filters `queryset` down to the rows matching the search `terms`, ordered
+    by relevance. Each row is annotated with its `search_rank`, higher being
+    more relevant.
+    """
+    connection = connections[queryset.db]
+
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(terms, config=SEARCH_CONFIG, search_type='websearch')
+        queryset = queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        )
+    elif connection.vendor == 'sqlite':
+        # Quote every word so FTS5 doesn't parse the user's input as query
+        # syntax. Quoted words are implicitly ANDed together.
+        match = ' '.join(
+            '"{}"'.format(word.replace('"', '""')) for word in terms.split()
+        )
+        if not match:
+            return queryset
+
+        table = queryset.model._meta.db_table
+        fts = f'{table}_fts'
+        queryset = queryset.filter(pk__in=RawSQL(
+            f'SELECT id FROM "{table}" WHERE rowid IN '
+            f'(SELECT rowid FROM "{fts}" WHERE "{fts}" MATCH %s)',
+            (match,)
+        )).annotate(search_rank=RawSQL(
+            # FTS5's rank is lower for better matches, so flip it around
+            f'SELECT -rank FROM "{fts}" WHERE "{fts}" MATCH %s AND "{fts}".rowid = "{table}".rowid',
+            (match,)
+        ))
+    else:
+        # Every word must appear in the name or the description, and each
+        # word found in the name ranks the row higher
+        words = terms.split()
+        if not words:
+            return queryset
+
+        for word in words:
+            queryset = queryset.filter(Q(name__icontains=word) | Q(long_description__icontains=word))
+        queryset = queryset.annotate(search_rank=sum(
+            (Case(When(name__icontains=word, then=Value(1)), default=Value(0)) for word in words),
+            Value(0, output_field=IntegerField())
+        ))
+
+    return queryset.order_by('-search_rank', '-created_at', '-id')
+
+
+def is_ranked(queryset):
+    """
+    Returns True if `queryset` is ordered by search relevance.
+    """
+    return 'search_rank' in queryset.query.annotations
+
+
+def install_sqlite_fts(connection):
+    """
+    Creates (or recreates) the FTS5 tables and their triggers, and rebuilds
+    their indexes from the content tables.
+    """
+    with connection.cursor() as cursor:
+        for table in SEARCH_TABLES:
+            fts = f'{table}_fts'
+            cursor.execute(f'DROP TABLE IF EXISTS "{fts}"')
+            for trigger in ('ai', 'ad', 'au'):
+                cursor.execute(f'DROP TRIGGER IF EXISTS "{fts}_{trigger}"')
+
+            cursor.execute(
+                f'CREATE VIRTUAL TABLE "{fts}" USING fts5('
+                f"name, long_description, content='{table}', content_rowid='rowid')"
+            )
+            cursor.execute(
+                f'CREATE TRIGGER "{fts}_ai" AFTER INSERT ON "{table}" BEGIN '
+                f'INSERT INTO "{fts}"(rowid, name, long_description) '
+                f'VALUES (new.rowid, new.name, new.long_description); '
+                f'END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER "{fts}_ad" AFTER DELETE ON "{table}" BEGIN '
+                f'INSERT INTO "{fts}"("{fts}", rowid, name, long_description) '
+                f'VALUES (\'delete\', old.rowid, old.name, old.long_description); '
+                f'END'
+            )
+            cursor.execute(
+                f'CREATE TRIGGER "{fts}_au" AFTER UPDATE ON "{table}" BEGIN '
+                f'INSERT INTO "{fts}"("{fts}", rowid, name, long_description) '
+                f'VALUES (\'delete\', old.rowid, old.name, old.long_description); '
+                f'INSERT INTO "{fts}"(rowid, name, long_description) '
+                f'VALUES (new.rowid, new.name, new.long_description); '
+                f'END'
+            )
+            cursor.execute(f'INSERT INTO "{fts}"("{fts}") VALUES (\'rebuild\')')
+
+
+def install_search(sender, using='default', **kwargs):
+    """
+    post_migrate handler that installs the SQLite FTS5 fallback.
+    """
+    connection = connections[using]
+    if connection.vendor == 'sqlite':
+        install_sqlite_fts(connection)
@@ -1,23 +1,123 @@
+from django.core import signing
+from django.core.files.storage import default_storage
+from django.db import transaction
 from rest_framework import serializers
+from treebeard.exceptions import InvalidMoveToDescendant, PathOverflow
 
+from documents.bulk import BulkListSerializer, BulkPrimaryKeyRelatedField
+from documents.expand import BREADCRUMB_FIELDS, ExpandableFieldsMixin
 from documents.models import Document, Folder, Topic
+from documents.tree import add_folders, import_folders, lock_last_root, move_folder, prefetch_ancestors, prefetch_tree
+from documents.uploads import read_upload_token
 
 
-class FolderSerializer(serializers.ModelSerializer):
-    parent = serializers.PrimaryKeyRelatedField(
+class FolderListSerializer(BulkListSerializer):
+    """
+    Resolves the parents and children (and, if expanded, the ancestors) for a
+    whole page of folders at once, instead of letting every folder query for
+    its own.
+    """
+    def to_representation(self, data):
+        folders = prefetch_tree(data)
+        if BREADCRUMB_FIELDS & set(self.child.fields):
+            prefetch_ancestors(folders)
+        return super().to_representation(folders)
+
+    def perform_bulk_create(self, validated_data):
+        return add_folders([
+            (attrs.pop('get_parent', None), Folder(**attrs))
+            for attrs in validated_data
+        ])
+
+    def update(self, instances, validated_data):
+        # Each move was validated against the tree as it was before the
+        # batch, so it can still clash with an earlier move in the same batch
+        # (A into B, then B into A). Those items are reported as errors and
+        # left out, and the rest of the batch goes ahead.
+        kept_instances, kept_data = [], []
+
+        with transaction.atomic():
+            for instance, attrs in zip(instances, validated_data):
+                if 'get_parent' in attrs:
+                    try:
+                        with transaction.atomic():
+                            move_folder(instance, attrs.pop('get_parent'))
+                    except InvalidMoveToDescendant:
+                        self.item_errors[instance.pk] = {
+                            'parent': ['A folder cannot be moved into one of its descendants.']
+                        }
+                        continue
+                    except PathOverflow:
+                        self.item_errors[instance.pk] = {
+                            'parent': ['The folder is too deep to move here.']
+                        }
+                        continue
+                kept_instances.append(instance)
+                kept_data.append(attrs)
+
+            if kept_instances:
+                super().update(kept_instances, kept_data)
+
+        return kept_instances
+
+
+class FolderBreadcrumbSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Folder
+        fields = ['id', 'name']
+
+
+class FolderSummarySerializer(serializers.ModelSerializer):
+    """
+    A folder inlined with ?expand=.
+    """
+    class Meta:
+        model = Folder
+        fields = ['id', 'name', 'long_description', 'created_at', 'updated_at']
+
+
+class DocumentSummarySerializer(serializers.ModelSerializer):
+    """
+    A document inlined with ?expand=.
+    """
+    class Meta:
+        model = Document
+        fields = ['id', 'name', 'long_description', 'folder', 'file', 'created_at', 'updated_at']
+
+
+class TopicSummarySerializer(serializers.ModelSerializer):
+    """
+    A topic inlined with ?expand=.
+    """
+    class Meta:
+        model = Topic
+        fields = ['id', 'name', 'long_description', 'created_at', 'updated_at']
+
+
+class FolderSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    parent = BulkPrimaryKeyRelatedField(
         allow_null=True,
         source="get_parent",
         queryset=Folder.objects.all()
     )
     children = serializers.PrimaryKeyRelatedField(
-        source="get_children",
+        source="get_cached_children",
         many=True,
         read_only=True
     )
-    topics = serializers.PrimaryKeyRelatedField(
+    topics = BulkPrimaryKeyRelatedField(
         many=True,
         queryset=Topic.objects.all()
     )
+    ancestors = FolderBreadcrumbSerializer(
+        source="get_cached_ancestors",
+        many=True,
+        read_only=True
+    )
+    path_names = serializers.SerializerMethodField()
+
+    def get_path_names(self, obj):
+        return [ancestor.name for ancestor in obj.get_cached_ancestors()] + [obj.name]
 
     def validate_parent(self, value):
         if value and self.instance and self.instance.pk and self.instance.pk == value.pk:
@@ -25,6 +125,11 @@ class FolderSerializer(serializers.ModelSerializer):
                 'A folder cannot be its own parent.'
             )
 
+        if value and self.instance and self.instance.pk and value.is_descendant_of(self.instance):
+            raise serializers.ValidationError(
+                'A folder cannot be moved into one of its descendants.'
+            )
+
         return value
 
     def create(self, validated_data):
@@ -37,62 +142,66 @@ class FolderSerializer(serializers.ModelSerializer):
 
         folder = Folder(**validated_data)
 
-        if parent:
-            parent.add_child(instance=folder)
-        else:
-            root = Folder.get_last_root_node()
-
-            if root:
-                root.add_sibling(instance=folder)
+        with transaction.atomic():
+            if parent:
+                parent.add_child(instance=folder)
             else:
-                Folder.add_root(instance=folder)
+                # Lock the last root, so that concurrent writes can't pick
+                # the same path for a new root
+                root = lock_last_root()
+
+                if root:
+                    root.add_sibling(instance=folder)
+                else:
+                    Folder.add_root(instance=folder)
 
-        if topics:
-            folder.topics.set(topics)
-            folder.save()
+            if topics:
+                folder.topics.set(topics)
+                folder.save()
 
         return folder
 
     def update(self, instance, validated_data):
-        try:
-            parent = validated_data.pop('get_parent')
-        except KeyError:
-            parent = instance.get_parent()
+        with transaction.atomic():
+            try:
+                topics = validated_data.pop('topics')
+                instance.topics.set(topics)
+            except KeyError:
+                pass
 
-        try:
-            topics = validated_data.pop('topics')
-        except KeyError:
-            topics = instance.topics.all()
+            try:
+                parent = validated_data.pop('get_parent')
+                move = True
+            except KeyError:
+                move = False
 
-        instance.topics.set(topics)
+            for k, v in validated_data.items():
+                setattr(instance, k, v)
 
-        for k, v in validated_data.items():
-            setattr(instance, k, v)
+            # Only write the fields we were given, so we never clobber the
+            # tree fields (path, depth, numchild) with stale in-memory values
+            instance.save(update_fields=[*validated_data, 'updated_at'])
 
-        instance.save()
-
-        if parent is None:
-            last_root = Folder.get_last_root_node()
-            instance.move(last_root, "sorted-sibling")
-        else:
-            instance.move(parent, "sorted-child")
-
-        # FIXME: This fix_tree() call probably shouldn't be here.
-        # Occasionally, treebeard's denormalized fields seem to get out of sync
-        # after moving nodes. fix_tree() will repair any inconsistencies.
-        #
-        # Putting this call in the request lifecycle is almost certainly
-        # something that will not scale, but in the interest of time I've
-        # thrown it in here to make the demo functional. Without it, I was
-        # periodically getting IntegrityErrors from the check condition on
-        # num_children.
-        instance.fix_tree()
+            if move:
+                # The parent was validated before the tree was locked, so a
+                # concurrent move can still make this one invalid
+                try:
+                    move_folder(instance, parent)
+                except InvalidMoveToDescendant:
+                    raise serializers.ValidationError({
+                        'parent': ['A folder cannot be moved into one of its descendants.']
+                    })
+                except PathOverflow:
+                    raise serializers.ValidationError({
+                        'parent': ['The folder is too deep to move here.']
+                    })
 
         # Need to refetch instance because of treebeard's caching
         return Folder.objects.get(pk=instance.pk)
 
     class Meta:
         model = Folder
+        list_serializer_class = FolderListSerializer
         fields = [
             'id',
             'name',
@@ -100,22 +209,152 @@ class FolderSerializer(serializers.ModelSerializer):
             'parent',
             'topics',
             'children',
+            'document_count',
+            'descendant_document_count',
+            'ancestors',
+            'path_names',
             'created_at',
             'updated_at'
         ]
+        expandable_fields = ['ancestors', 'path_names']
+        expanded_fields = {'topics': TopicSummarySerializer}
+
 
+class FolderImportNodeSerializer(serializers.Serializer):
+    """
+    A folder in a tree being imported, along with all of its descendants.
+    """
+    name = serializers.CharField(max_length=255)
+    long_description = serializers.CharField(allow_blank=True, required=False, default="")
+    topics = serializers.ListField(child=serializers.UUIDField(), required=False, default=list)
+    children = serializers.ListField(child=serializers.DictField(), required=False, default=list)
 
-class DocumentSerializer(serializers.ModelSerializer):
-    folder = serializers.PrimaryKeyRelatedField(
+    def validate_children(self, value):
+        if not value:
+            # Most nodes in a tree are leaves, so skip building a serializer
+            return value
+
+        serializer = FolderImportNodeSerializer(data=value, many=True)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+
+class FolderImportSerializer(serializers.Serializer):
+    """
+    Imports a nested tree of new folders under `parent`, or as new root
+    folders if `parent` is null. See documents.tree.import_folders().
+    """
+    parent = BulkPrimaryKeyRelatedField(
+        allow_null=True,
+        required=False,
+        default=None,
         queryset=Folder.objects.all()
     )
-    topics = serializers.PrimaryKeyRelatedField(
+    folders = FolderImportNodeSerializer(many=True)
+
+    def validate_folders(self, value):
+        topic_pks = set()
+        stack = list(value)
+        while stack:
+            node = stack.pop()
+            topic_pks.update(node['topics'])
+            stack.extend(node['children'])
+
+        missing = topic_pks - set(Topic.objects.filter(pk__in=topic_pks).values_list('pk', flat=True))
+        if missing:
+            raise serializers.ValidationError(
+                f'Invalid topic pks: {", ".join(sorted(str(pk) for pk in missing))}.'
+            )
+
+        return value
+
+    def create(self, validated_data):
+        try:
+            return import_folders(validated_data['folders'], validated_data['parent'])
+        except PathOverflow:
+            raise serializers.ValidationError({
+                'folders': ['The tree is too deep or too wide to import here.']
+            })
+
+
+class FolderTreeQuerySerializer(serializers.Serializer):
+    """
+    Query parameters for the folder tree endpoints.
+    """
+    max_depth = serializers.IntegerField(min_value=0, required=False, default=None)
+    document_counts = serializers.BooleanField(required=False, default=False)
+
+
+class DocumentListSerializer(BulkListSerializer):
+    """
+    Keeps the folders' document counts up to date for bulk writes, which
+    bypass Document.save(), and resolves the ancestors of a whole page of
+    documents at once when they're expanded.
+    """
+    def to_representation(self, data):
+        if BREADCRUMB_FIELDS & set(self.child.fields):
+            data = list(data)
+            # The list view selects the folders along with the documents, but
+            # load any that are missing in one go
+            missing = {
+                document.folder_id
+                for document in data
+                if not Document.folder.is_cached(document)
+            }
+            folders = Folder.objects.in_bulk(missing) if missing else {}
+            for document in data:
+                if not Document.folder.is_cached(document):
+                    document.folder = folders[document.folder_id]
+            prefetch_ancestors([document.folder for document in data])
+        return super().to_representation(data)
+
+    def perform_bulk_create(self, validated_data):
+        documents = super().perform_bulk_create(validated_data)
+        deltas = {}
+        for document in documents:
+            deltas[document.folder_id] = deltas.get(document.folder_id, 0) + 1
+            document._counted_folder_id = document.folder_id
+        Folder.adjust_document_counts(deltas)
+        return documents
+
+    def update(self, instances, validated_data):
+        counted = {instance.pk: instance.folder_id for instance in instances}
+
+        with transaction.atomic():
+            instances = super().update(instances, validated_data)
+
+            deltas = {}
+            for instance in instances:
+                if instance.folder_id != counted[instance.pk]:
+                    deltas[counted[instance.pk]] = deltas.get(counted[instance.pk], 0) - 1
+                    deltas[instance.folder_id] = deltas.get(instance.folder_id, 0) + 1
+                instance._counted_folder_id = instance.folder_id
+            Folder.adjust_document_counts(deltas)
+
+        return instances
+
+
+class DocumentSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    folder = BulkPrimaryKeyRelatedField(
+        queryset=Folder.objects.all()
+    )
+    topics = BulkPrimaryKeyRelatedField(
         many=True,
         queryset=Topic.objects.all()
     )
+    ancestors = FolderBreadcrumbSerializer(
+        source="get_cached_ancestors",
+        many=True,
+        read_only=True
+    )
+    path_names = serializers.SerializerMethodField()
+
+    def get_path_names(self, obj):
+        return [ancestor.name for ancestor in obj.get_cached_ancestors()] + [obj.name]
 
     class Meta:
         model = Document
+        list_serializer_class = DocumentListSerializer
         fields = [
             'id',
             'name',
@@ -123,23 +362,104 @@ class DocumentSerializer(serializers.ModelSerializer):
             'folder',
             'file',
             'topics',
+            'ancestors',
+            'path_names',
             'created_at',
             'updated_at'
         ]
+        expandable_fields = ['ancestors', 'path_names']
+        expanded_fields = {'folder': FolderSummarySerializer, 'topics': TopicSummarySerializer}
+
+
+class UploadTokenField(serializers.CharField):
+    """
+    Accepts the signed `upload` token of a direct-to-storage upload issued to
+    the requesting user, and returns its storage key.
+    """
+    default_error_messages = {
+        'expired': 'The upload has expired.',
+        'invalid': 'Invalid upload.',
+    }
+
+    def to_internal_value(self, data):
+        token = super().to_internal_value(data)
+        try:
+            return read_upload_token(token, self.context['request'].user)
+        except signing.SignatureExpired:
+            self.fail('expired')
+        except signing.BadSignature:
+            self.fail('invalid')
+
+
+class DocumentBulkSerializer(DocumentSerializer):
+    """
+    Used by the bulk endpoint. Files can't be uploaded in a JSON array, so
+    each document refers to a file uploaded directly to storage by the
+    signed `upload` token it was issued with. A storage key of the client's
+    choosing would let them point a document, and so the purge queue once
+    it's deleted, at anyone's file.
+    """
+    upload = UploadTokenField(source='file', write_only=True)
+    file = serializers.FileField(read_only=True)
+
+    class Meta(DocumentSerializer.Meta):
+        fields = DocumentSerializer.Meta.fields + ['upload']
+
+
+class DocumentUploadSerializer(serializers.Serializer):
+    """
+    Requests a target to upload a document's file to directly. See
+    documents.uploads.
+    """
+    filename = serializers.CharField(max_length=255)
+    content_type = serializers.CharField(max_length=255, required=False, default='')
+
+
+class DocumentFinalizeSerializer(DocumentSerializer):
+    """
+    Creates a Document for a file that was uploaded directly to storage,
+    given the signed `upload` token the upload target was issued with.
+    """
+    upload = UploadTokenField(write_only=True)
+    file = serializers.FileField(read_only=True)
+
+    def validate_upload(self, key):
+        if not default_storage.exists(key):
+            raise serializers.ValidationError("The file hasn't been uploaded yet.")
+
+        if Document.objects.filter(file=key).exists():
+            raise serializers.ValidationError('The upload has already been finalized.')
+
+        return key
+
+    def create(self, validated_data):
+        validated_data['file'] = validated_data.pop('upload')
+        return super().create(validated_data)
+
+    class Meta(DocumentSerializer.Meta):
+        fields = DocumentSerializer.Meta.fields + ['upload']
+
+
+class DocumentMultipartCompleteSerializer(DocumentSerializer):
+    """
+    Creates a Document for the file assembled by a completed multipart upload.
+    """
+    file = serializers.FileField(read_only=True)
 
 
-class TopicSerializer(serializers.ModelSerializer):
-    folders = serializers.PrimaryKeyRelatedField(
+class TopicSerializer(ExpandableFieldsMixin, serializers.ModelSerializer):
+    folders = BulkPrimaryKeyRelatedField(
         many=True,
         queryset=Folder.objects.all()
     )
-    documents = serializers.PrimaryKeyRelatedField(
+    documents = BulkPrimaryKeyRelatedField(
         many=True,
         queryset=Document.objects.all()
     )
 
     class Meta:
         model = Topic
+        list_serializer_class = BulkListSerializer
         fields = [
             'id',
             'name',
@@ -149,3 +469,4 @@ class TopicSerializer(serializers.ModelSerializer):
             'created_at',
             'updated_at'
         ]
+        expanded_fields = {'folders': FolderSummarySerializer, 'documents': DocumentSummarySerializer}
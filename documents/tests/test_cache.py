@@ -0,0 +1,176 @@
+import json
+from unittest.mock import patch
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient as Client
+from rest_framework.authtoken.models import Token
+
+from accounts.models import User
+from documents.cache import get_cache
+from documents.conditional import ConditionalGetMixin
+from documents.models import Document, Folder, Topic
+from documents.tree import move_folder
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True)
+class ResponseCacheTestCase(TestCase):
+    """
+    Integration tests for the shared response cache
+    """
+    def setUp(self):
+        get_cache().clear()
+        self.client = Client()
+
+        self.user = User.objects.create(username="jdoe", email="jdoe@example.com")
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.auth_client = Client()
+        self.auth_client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        self.root_folder = Folder.add_root(name="root")
+        self.child_folder = Folder.objects.get(pk=self.root_folder.pk).add_child(name="child")
+        self.other_folder = Folder.add_root(name="other")
+
+        self.document = Document(name="doc", folder=self.child_folder)
+        self.document.file.save("foo.txt", ContentFile(b"lorem ipsum"))
+        self.document.save()
+
+        self.topic = Topic.objects.create(name="topic")
+
+    def get(self, url, **kwargs):
+        response = self.client.get(url, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_list_cached(self):
+        first = self.get("/documents/?page=1")
+        with self.assertNumQueries(0):
+            second = self.get("/documents/?page=1")
+        self.assertEqual(first, second)
+
+    def test_list_keyed_by_normalized_query(self):
+        self.get("/folders/?page=1&name=root")
+        with self.assertNumQueries(0):
+            self.get("/folders/?name=root&page=1")
+        self.assertEqual(self.get("/folders/?page=1&name=child")["count"], 1)
+
+    def test_detail_keyed_by_origin(self):
+        url = f"/documents/{self.document.pk}/"
+        self.assertTrue(self.get(url)["file"].startswith("http://testserver/"))
+        self.assertTrue(self.get(url, secure=True)["file"].startswith("https://testserver/"))
+        self.assertTrue(self.get(url, HTTP_HOST="localhost")["file"].startswith("http://localhost/"))
+
+    def test_cached_not_modified(self):
+        etag = self.client.get("/topics/")["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get("/topics/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_browsable_api_not_cached(self):
+        self.client.get("/topics/", HTTP_ACCEPT="text/html")
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get("/topics/", HTTP_ACCEPT="text/html")
+        self.assertTrue(queries.captured_queries)
+
+    def test_save_invalidates(self):
+        url = f"/documents/{self.document.pk}/"
+        self.get(url)
+        self.get("/documents/?page=1")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.auth_client.patch(url, {"name": "renamed"}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.get(url)["name"], "renamed")
+        self.assertEqual(self.get("/documents/?page=1")["results"][0]["name"], "renamed")
+
+    def test_save_keeps_other_details(self):
+        other = Document.objects.create(name="other", folder=self.child_folder)
+        other_url = f"/documents/{other.pk}/"
+        topic_url = f"/topics/{self.topic.pk}/"
+        self.get(other_url)
+        self.get(topic_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.auth_client.patch(f"/documents/{self.document.pk}/", {"name": "renamed"}, format="json")
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(other_url)["name"], "other")
+            self.get(topic_url)
+        self.assertEqual(self.get("/documents/?page=1")["count"], 2)
+
+    def test_change_during_response_not_cached(self):
+        url = f"/documents/{self.document.pk}/"
+        retrieve = ConditionalGetMixin.retrieve
+
+        def retrieve_and_rename(view, request, *args, **kwargs):
+            response = retrieve(view, request, *args, **kwargs)
+            # Another request renames the document before this one is cached
+            with self.captureOnCommitCallbacks(execute=True):
+                document = Document.objects.get(pk=self.document.pk)
+                document.name = "renamed"
+                document.save()
+            return response
+
+        with patch.object(ConditionalGetMixin, "retrieve", retrieve_and_rename):
+            self.assertEqual(self.get(url)["name"], "doc")
+        self.assertEqual(self.get(url)["name"], "renamed")
+
+    def test_delete_invalidates(self):
+        self.assertEqual(self.get("/documents/?page=1")["count"], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Document.objects.get(pk=self.document.pk).delete()
+        self.assertEqual(self.get("/documents/?page=1")["count"], 0)
+
+    def test_topic_links_invalidate_both_sides(self):
+        document_url = f"/documents/{self.document.pk}/"
+        topic_url = f"/topics/{self.topic.pk}/"
+        self.get(document_url)
+        self.get(topic_url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.topic.documents.add(self.document)
+
+        self.assertEqual(self.get(document_url)["topics"], [str(self.topic.pk)])
+        self.assertEqual(self.get(topic_url)["documents"], [str(self.document.pk)])
+
+    def test_new_child_invalidates_parent(self):
+        url = f"/folders/{self.root_folder.pk}/"
+        self.assertEqual(len(self.get(url)["children"]), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Folder.objects.get(pk=self.root_folder.pk).add_child(name="new child")
+        self.assertEqual(len(self.get(url)["children"]), 2)
+
+    def test_move_invalidates_parents_and_subtrees(self):
+        root_url = f"/folders/{self.root_folder.pk}/"
+        other_url = f"/folders/{self.other_folder.pk}/"
+        subtree_url = f"/documents/?page=1&folder_subtree={self.other_folder.pk}"
+        self.get(root_url)
+        self.get(other_url)
+        self.assertEqual(self.get(subtree_url)["count"], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            move_folder(self.child_folder, self.other_folder)
+
+        self.assertEqual(self.get(root_url)["children"], [])
+        self.assertEqual(self.get(other_url)["children"], [str(self.child_folder.pk)])
+        self.assertEqual(self.get(subtree_url)["count"], 1)
+
+    def test_bulk_update_invalidates(self):
+        url = f"/topics/{self.topic.pk}/"
+        self.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.auth_client.patch("/topics/bulk/", [
+                {"id": str(self.topic.pk), "name": "renamed"}
+            ], format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get(url)["name"], "renamed")
+
+    @override_settings(RESPONSE_CACHE_ENABLED=False)
+    def test_disabled(self):
+        self.get("/topics/")
+        with CaptureQueriesContext(connection) as queries:
+            self.get("/topics/")
+        self.assertTrue(queries.captured_queries)
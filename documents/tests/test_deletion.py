@@ -0,0 +1,192 @@
+import json
+from io import StringIO
+from unittest.mock import MagicMock, patch
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient as Client
+from rest_framework.authtoken.models import Token
+from storages.backends.s3boto3 import S3Boto3Storage
+
+from accounts.models import User
+from documents.deletion import delete_files, purge_orphaned_files
+from documents.models import Document, Folder, OrphanedFile, Topic
+from documents.tree import repair_document_counts
+
+
+class SubtreeDeleteTestCase(TestCase):
+    """
+    Integration tests for deleting folder subtrees and purging their files
+    """
+    def setUp(self):
+        self.user = User.objects.create(username="jdoe", email="jdoe@example.com")
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client = Client()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        self.root_folder = Folder.add_root(name="root")
+        self.child_folder = Folder.objects.get(pk=self.root_folder.pk).add_child(name="child")
+        self.grandchild_folder = Folder.objects.get(pk=self.child_folder.pk).add_child(name="grandchild")
+        self.sibling_folder = Folder.objects.get(pk=self.root_folder.pk).add_child(name="sibling")
+
+        self.topic = Topic.objects.create(name="topic")
+        self.topic.folders.add(self.child_folder, self.sibling_folder)
+        self.documents = [
+            self.create_document(folder)
+            for folder in (self.child_folder, self.grandchild_folder, self.grandchild_folder, self.sibling_folder)
+        ]
+
+    def create_document(self, folder):
+        document = Document(name="doc", folder=folder)
+        document.file.save("doc.txt", ContentFile(b"lorem ipsum"))
+        document.save()
+        document.topics.add(self.topic)
+        return document
+
+    def test_delete_subtree(self):
+        updated_at = Topic.objects.get(pk=self.topic.pk).updated_at
+        response = self.client.delete(f"/folders/{self.child_folder.pk}/")
+        self.assertEqual(response.status_code, 204)
+
+        self.assertCountEqual(Folder.objects.all(), [self.root_folder, self.sibling_folder])
+        self.assertCountEqual(Document.objects.all(), [self.documents[3]])
+        topic = Topic.objects.get(pk=self.topic.pk)
+        self.assertCountEqual(topic.folders.all(), [self.sibling_folder])
+        self.assertCountEqual(topic.documents.all(), [self.documents[3]])
+        self.assertGreater(topic.updated_at, updated_at)
+
+        root = Folder.objects.get(pk=self.root_folder.pk)
+        self.assertEqual(root.numchild, 1)
+        self.assertEqual(root.descendant_document_count, 1)
+        self.assertEqual(repair_document_counts(dry_run=True), 0)
+
+        self.assertCountEqual(
+            OrphanedFile.objects.values_list("key", flat=True),
+            [document.file.name for document in self.documents[:3]]
+        )
+
+    def test_delete_touches_ancestors(self):
+        empty = Folder.objects.get(pk=self.grandchild_folder.pk).add_child(name="empty")
+        updated_at = {
+            folder.pk: folder.updated_at
+            for folder in Folder.objects.filter(pk__in=[self.root_folder.pk, self.child_folder.pk])
+        }
+        response = self.client.delete(f"/folders/{empty.pk}/")
+        self.assertEqual(response.status_code, 204)
+        for folder in Folder.objects.filter(pk__in=updated_at):
+            self.assertGreater(folder.updated_at, updated_at[folder.pk])
+
+    def test_queries_independent_of_subtree_size(self):
+        # Authenticate once, so that the token is cached for both deletes
+        self.client.get("/folders/")
+        with CaptureQueriesContext(connection) as small:
+            self.client.delete(f"/folders/{self.grandchild_folder.pk}/")
+
+        for i in range(5):
+            folder = Folder.objects.get(pk=self.sibling_folder.pk).add_child(name=f"folder {i}")
+            self.create_document(folder)
+        with CaptureQueriesContext(connection) as large:
+            self.client.delete(f"/folders/{self.sibling_folder.pk}/")
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(Folder.objects.count(), 2)
+
+    def test_bulk_delete_nested(self):
+        response = self.client.delete("/folders/bulk/", [
+            str(self.child_folder.pk), str(self.grandchild_folder.pk)
+        ], format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result["status"] for result in json.loads(response.content)], [204, 204])
+        self.assertCountEqual(Folder.objects.all(), [self.root_folder, self.sibling_folder])
+        self.assertEqual(repair_document_counts(dry_run=True), 0)
+        self.assertEqual(OrphanedFile.objects.count(), 3)
+
+    def test_bulk_delete_documents(self):
+        updated_at = Topic.objects.get(pk=self.topic.pk).updated_at
+        response = self.client.delete("/documents/bulk/", [
+            str(document.pk) for document in self.documents[1:]
+        ], format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result["status"] for result in json.loads(response.content)], [204, 204, 204])
+
+        self.assertCountEqual(Document.objects.all(), [self.documents[0]])
+        topic = Topic.objects.get(pk=self.topic.pk)
+        self.assertCountEqual(topic.documents.all(), [self.documents[0]])
+        self.assertGreater(topic.updated_at, updated_at)
+        self.assertEqual(Folder.objects.get(pk=self.root_folder.pk).descendant_document_count, 1)
+        self.assertEqual(repair_document_counts(dry_run=True), 0)
+        self.assertCountEqual(
+            OrphanedFile.objects.values_list("key", flat=True),
+            [document.file.name for document in self.documents[1:]]
+        )
+
+    def test_bulk_delete_queries_independent_of_batch_size(self):
+        # Authenticate once, so that the token is cached for both deletes
+        self.client.get("/documents/")
+        with CaptureQueriesContext(connection) as small:
+            self.client.delete("/documents/bulk/", [str(self.documents[0].pk)], format="json")
+
+        documents = self.documents[1:] + [self.create_document(self.root_folder) for _ in range(5)]
+        with CaptureQueriesContext(connection) as large:
+            self.client.delete("/documents/bulk/", [str(document.pk) for document in documents], format="json")
+        self.assertEqual(len(large), len(small))
+        self.assertFalse(Document.objects.exists())
+        self.assertEqual(repair_document_counts(dry_run=True), 0)
+
+    def test_document_delete_queues_file(self):
+        response = self.client.delete(f"/documents/{self.documents[3].pk}/")
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(OrphanedFile.objects.get().key, self.documents[3].file.name)
+
+    def test_purge(self):
+        self.client.delete(f"/folders/{self.child_folder.pk}/")
+        # A file that a document still refers to is only dropped from the queue
+        OrphanedFile.objects.create(key=self.documents[3].file.name)
+
+        out = StringIO()
+        call_command("purge_orphaned_files", stdout=out)
+        self.assertEqual(out.getvalue(), "Purged 3 files, 0 failed\n")
+        self.assertFalse(OrphanedFile.objects.exists())
+        for document in self.documents[:3]:
+            self.assertFalse(default_storage.exists(document.file.name))
+        self.assertTrue(default_storage.exists(self.documents[3].file.name))
+
+    def test_purge_s3_in_batches(self):
+        storage = MagicMock(spec=S3Boto3Storage)
+        storage._clean_name.side_effect = lambda name: name
+        storage._normalize_name.side_effect = lambda name: f"media/{name}"
+
+        def delete_objects(Delete):
+            keys = [obj["Key"] for obj in Delete["Objects"]]
+            return {"Errors": [{"Key": key, "Code": "AccessDenied"} for key in keys if key == "media/file5"]}
+        storage.bucket.delete_objects.side_effect = delete_objects
+
+        failed = delete_files(storage, [f"file{i}" for i in range(2500)])
+        self.assertEqual(failed, {"file5"})
+        batches = [call.kwargs["Delete"]["Objects"] for call in storage.bucket.delete_objects.call_args_list]
+        self.assertEqual([len(batch) for batch in batches], [1000, 1000, 500])
+        self.assertEqual(batches[0][0], {"Key": "media/file0"})
+
+    def test_failed_purges_stay_queued(self):
+        OrphanedFile.objects.create(key="a")
+        OrphanedFile.objects.create(key="b")
+        storage = MagicMock(spec=S3Boto3Storage)
+        storage._clean_name.side_effect = lambda name: name
+        storage._normalize_name.side_effect = lambda name: name
+        storage.bucket.delete_objects.return_value = {"Errors": [{"Key": "b", "Code": "InternalError"}]}
+
+        self.assertEqual(purge_orphaned_files(storage), (1, 1))
+        self.assertEqual(list(OrphanedFile.objects.values_list("key", flat=True)), ["b"])
+
+    def test_purge_loop_survives_errors(self):
+        stderr = StringIO()
+        with patch("documents.management.commands.purge_orphaned_files.purge_orphaned_files",
+                   side_effect=[OSError("storage is down"), (0, 0)]) as purge, \
+                patch("documents.management.commands.purge_orphaned_files.time.sleep",
+                      side_effect=[None, KeyboardInterrupt]):
+            with self.assertRaises(KeyboardInterrupt):
+                call_command("purge_orphaned_files", "--loop", stdout=StringIO(), stderr=stderr)
+        self.assertEqual(purge.call_count, 2)
+        self.assertIn("storage is down", stderr.getvalue())
@@ -1,13 +1,27 @@
 import json
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from io import BytesIO
+from unittest.mock import patch
+from botocore.stub import Stubber
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
 from django.core.files.uploadedfile import SimpleUploadedFile
 from rest_framework.test import APIClient as Client
 from rest_framework.authtoken.models import Token
 from freezegun import freeze_time
+from storages.backends.s3boto3 import S3Boto3Storage
 
 from accounts.models import User
-from documents.models import Document, Folder
+from documents import topic_index
+from documents.bulk import set_related_in_bulk
+from documents.cache import get_cache
+from documents.models import Document, Folder, Topic
+from documents.uploads import S3UploadBackend, UploadNotFound, make_upload_token
 
 
 class DocumentApiTestCase(TestCase):
@@ -15,6 +29,13 @@ class DocumentApiTestCase(TestCase):
     Base class for Document endpoint integration tests
     """
     def setUp(self):
+        # Keep uploaded and saved files out of the real MEDIA_ROOT
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+
         self.url = "/documents/"
         self.username = "jdoe"
         self.password = "p@ssw0rd"
@@ -61,7 +82,7 @@ class DocumentApiAnonymousTestCase(DocumentApiTestCase):
 
     def test_anonymous_user_read(self):
         client = Client()
-        response = client.get(self.url)
+        response = client.get(f"{self.url}?page=1")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json.loads(response.content)["count"], 2)
 
@@ -101,7 +122,7 @@ class DocumentApiAuthenticatedUserTestCase(DocumentApiTestCase):
         self.assertIsNotNone(new_file.file)
 
     def test_authenticated_user_read(self):
-        response = self.client.get(self.url)
+        response = self.client.get(f"{self.url}?page=1")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json.loads(response.content)["count"], 2)
 
@@ -124,24 +145,763 @@ class DocumentApiFilterTestCase(DocumentApiTestCase):
     Integration tests for filters at Document endpoints
     """
     def test_filter_name(self):
-        response = self.client.get(f"{self.url}?name=doc 1")
+        response = self.client.get(f"{self.url}?page=1&name=doc 1")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json.loads(response.content)["count"], 1)
 
     def test_filter_folder_id(self):
-        response = self.client.get(f"{self.url}?folder_id={self.root_folder.pk}")
+        response = self.client.get(f"{self.url}?page=1&folder_id={self.root_folder.pk}")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json.loads(response.content)["count"], 1)
 
+    def test_filter_folder_subtree(self):
+        response = self.client.get(f"{self.url}?page=1&folder_subtree={self.root_folder.pk}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["count"], 2)
+
+        response = self.client.get(f"{self.url}?page=1&folder_subtree={self.child_folder.pk}")
+        json_resp = json.loads(response.content)
+        self.assertEqual(json_resp["count"], 1)
+        self.assertEqual(json_resp["results"][0]["id"], str(self.document2.pk))
+
+    def test_filter_folder_subtree_max_depth(self):
+        response = self.client.get(f"{self.url}?page=1&folder_subtree={self.root_folder.pk}&max_depth=0")
+        json_resp = json.loads(response.content)
+        self.assertEqual(json_resp["count"], 1)
+        self.assertEqual(json_resp["results"][0]["id"], str(self.document1.pk))
+
+    def test_filter_folder_subtree_excludes_siblings(self):
+        sibling = Folder.add_root(name="sibling")
+        Document.objects.create(name="doc 3", folder=sibling, file="baz.txt")
+        response = self.client.get(f"{self.url}?page=1&folder_subtree={self.root_folder.pk}")
+        self.assertEqual(json.loads(response.content)["count"], 2)
+
+    def test_filter_folder_subtree_missing(self):
+        response = self.client.get(f"{self.url}?page=1&folder_subtree=6d8b1b51-9b6b-4e3f-8f0a-59a6c2d2a0f1")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["count"], 0)
+
     def test_filter_created_at(self):
-        response = self.client.get(f"{self.url}?created_at_before=2021-01-31T19:58:21.942889Z")
+        response = self.client.get(f"{self.url}?page=1&created_at_before=2021-01-31T19:58:21.942889Z")
         self.assertEqual(response.status_code, 200)
         json_resp = json.loads(response.content)
         self.assertEqual(json_resp["count"], 1)
         self.assertEqual(json_resp["results"][0]["id"], str(self.document1.pk))
 
     def test_filter_updated_at(self):
-        response = self.client.get(f"{self.url}?updated_at_before=2021-01-31T19:58:21.942889Z")
+        response = self.client.get(f"{self.url}?page=1&updated_at_before=2021-01-31T19:58:21.942889Z")
         json_resp = json.loads(response.content)
         self.assertEqual(json_resp["count"], 1)
         self.assertEqual(json_resp["results"][0]["id"], str(self.document1.pk))
+
+    def test_filter_search(self):
+        Document.objects.filter(pk=self.document2.pk).update(
+            long_description="Quarterly revenue figures"
+        )
+        response = self.client.get(f"{self.url}?search=revenue")
+        self.assertEqual(response.status_code, 200)
+        json_resp = json.loads(response.content)
+        self.assertEqual(json_resp["count"], 1)
+        self.assertEqual(json_resp["results"][0]["id"], str(self.document2.pk))
+
+    def test_filter_search_ranks_names_first(self):
+        Document.objects.filter(pk=self.document1.pk).update(name="revenue")
+        Document.objects.filter(pk=self.document2.pk).update(
+            long_description="Quarterly revenue figures, and more revenue"
+        )
+        response = self.client.get(f"{self.url}?search=revenue")
+        json_resp = json.loads(response.content)
+        self.assertEqual(
+            [result["id"] for result in json_resp["results"]],
+            [str(self.document1.pk), str(self.document2.pk)]
+        )
+
+    def test_filter_search_after_rename(self):
+        response = self.client.get(f"{self.url}?search=invoice")
+        self.assertEqual(json.loads(response.content)["count"], 0)
+
+        self.document1.name = "invoice"
+        self.document1.save()
+        response = self.client.get(f"{self.url}?search=invoice")
+        self.assertEqual(json.loads(response.content)["count"], 1)
+
+    def test_filter_search_syntax(self):
+        response = self.client.get(f'{self.url}?search="doc" OR NOT (1')
+        self.assertEqual(response.status_code, 200)
+
+    def test_filter_search_fallback(self):
+        Document.objects.filter(pk=self.document1.pk).update(name="Revenue")
+        Document.objects.filter(pk=self.document2.pk).update(
+            long_description="Quarterly revenue figures"
+        )
+        with patch.object(connection, "vendor", "mysql"):
+            response = self.client.get(f"{self.url}?search=revenue")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                [result["id"] for result in json.loads(response.content)["results"]],
+                [str(self.document1.pk), str(self.document2.pk)]
+            )
+
+            response = self.client.get(f"{self.url}?search=quarterly+revenue")
+            self.assertEqual(json.loads(response.content)["count"], 1)
+
+
+class DocumentApiBulkTestCase(DocumentApiTestCase):
+    """
+    Integration tests for the Document bulk endpoint
+    """
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.topic = Topic.objects.create(name="topic")
+        self.upload_token = make_upload_token("uploads/1/foo.txt", self.user)
+
+    def test_bulk_create(self):
+        items = [
+            {
+                "name": f"bulk {i}",
+                "folder": str(self.child_folder.pk),
+                "upload": make_upload_token(f"uploads/{i}/foo.txt", self.user),
+                "topics": [str(self.topic.pk)]
+            }
+            for i in range(20)
+        ]
+        # auth, folders, topics, savepoint, insert documents, folder paths,
+        # update document counts, insert topic links, touch topics, release
+        # savepoint
+        with self.assertNumQueries(10):
+            response = self.client.post(f"{self.url}bulk/", items, format="json")
+        self.assertEqual(response.status_code, 201)
+        results = json.loads(response.content)
+        self.assertEqual(len(results), 20)
+        self.assertEqual(Document.objects.count(), 22)
+        self.assertEqual(self.topic.documents.count(), 20)
+
+    def test_bulk_create_partial_failure(self):
+        response = self.client.post(f"{self.url}bulk/", [
+            {"name": "good", "folder": str(self.child_folder.pk), "upload": self.upload_token, "topics": []},
+            {"name": "bad", "folder": "6d8b1b51-9b6b-4e3f-8f0a-59a6c2d2a0f1", "upload": self.upload_token, "topics": []},
+        ], format="json")
+        self.assertEqual(response.status_code, 207)
+        results = json.loads(response.content)
+        self.assertEqual(results[0]["status"], 201)
+        self.assertEqual(results[1]["status"], 400)
+        self.assertIn("folder", results[1]["errors"])
+        self.assertTrue(Document.objects.filter(name="good").exists())
+        self.assertFalse(Document.objects.filter(name="bad").exists())
+
+    def test_bulk_create_requires_own_upload(self):
+        other = User.objects.create(username="other", email="other@example.com")
+        response = self.client.post(f"{self.url}bulk/", [
+            {"name": "key", "folder": str(self.child_folder.pk), "upload": self.document1.file.name, "topics": []},
+            {"name": "stolen", "folder": str(self.child_folder.pk),
+             "upload": make_upload_token("uploads/1/foo.txt", other), "topics": []},
+            {"name": "missing", "folder": str(self.child_folder.pk), "topics": []},
+        ], format="json")
+        self.assertEqual(response.status_code, 207)
+        results = json.loads(response.content)
+        self.assertEqual([result["status"] for result in results], [400, 400, 400])
+        self.assertTrue(all("upload" in result["errors"] for result in results))
+        self.assertEqual(Document.objects.count(), 2)
+
+    def test_bulk_update(self):
+        response = self.client.patch(f"{self.url}bulk/", [
+            {"id": str(self.document1.pk), "name": "renamed", "topics": [str(self.topic.pk)]},
+            {"id": str(self.document2.pk), "folder": str(self.root_folder.pk)},
+        ], format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Document.objects.get(pk=self.document1.pk).name, "renamed")
+        self.assertEqual(Document.objects.get(pk=self.document2.pk).folder_id, self.root_folder.pk)
+        self.assertEqual(list(self.topic.documents.all()), [self.document1])
+
+    def test_bulk_delete(self):
+        response = self.client.delete(f"{self.url}bulk/", [
+            str(self.document1.pk),
+            "6d8b1b51-9b6b-4e3f-8f0a-59a6c2d2a0f1",
+        ], format="json")
+        self.assertEqual(response.status_code, 207)
+        results = json.loads(response.content)
+        self.assertEqual(results[0]["status"], 204)
+        self.assertEqual(results[1]["status"], 404)
+        self.assertEqual(Document.objects.count(), 1)
+
+    def test_anonymous_bulk_create(self):
+        response = Client().post(f"{self.url}bulk/", [], format="json")
+        self.assertEqual(response.status_code, 401)
+
+
+class DocumentApiUploadTestCase(DocumentApiTestCase):
+    """
+    Integration tests for direct-to-storage uploads at Document endpoints
+    """
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def request_upload(self, filename="report.pdf"):
+        response = self.client.post(f"{self.url}uploads/", {
+            "filename": filename,
+            "content_type": "application/pdf"
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        return json.loads(response.content)
+
+    def finalize(self, upload):
+        return self.client.post(f"{self.url}finalize/", {
+            "upload": upload,
+            "name": "report",
+            "folder": str(self.child_folder.pk),
+            "topics": []
+        }, format="json")
+
+    def test_upload_and_finalize(self):
+        target = self.request_upload()
+        self.assertEqual(target["method"], "PUT")
+        self.assertEqual(target["headers"], {"Content-Type": "application/pdf"})
+
+        # The upload target needs no credentials of its own
+        response = Client().put(target["url"], b"%PDF-1.4 lorem ipsum", content_type="application/pdf")
+        self.assertEqual(response.status_code, 204)
+
+        response = self.finalize(target["upload"])
+        self.assertEqual(response.status_code, 201)
+        document = Document.objects.get(pk=json.loads(response.content)["id"])
+        self.assertTrue(document.file.name.endswith("/report.pdf"))
+        with document.file.open() as f:
+            self.assertEqual(f.read(), b"%PDF-1.4 lorem ipsum")
+
+    def test_finalize_before_upload(self):
+        target = self.request_upload()
+        response = self.finalize(target["upload"])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("upload", json.loads(response.content))
+
+    def test_finalize_twice(self):
+        target = self.request_upload()
+        Client().put(target["url"], b"lorem ipsum", content_type="application/pdf")
+        self.assertEqual(self.finalize(target["upload"]).status_code, 201)
+        self.assertEqual(self.finalize(target["upload"]).status_code, 400)
+
+    def test_finalize_invalid_upload(self):
+        response = self.finalize("not-a-token")
+        self.assertEqual(response.status_code, 400)
+
+    def test_finalize_another_users_upload(self):
+        target = self.request_upload()
+        Client().put(target["url"], b"lorem ipsum", content_type="application/pdf")
+
+        other = User.objects.create(username="other", email="other@example.com")
+        token, _ = Token.objects.get_or_create(user=other)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(self.finalize(target["upload"]).status_code, 400)
+
+    def test_upload_twice(self):
+        target = self.request_upload()
+        Client().put(target["url"], b"lorem ipsum", content_type="application/pdf")
+        response = Client().put(target["url"], b"dolor sit amet", content_type="application/pdf")
+        self.assertEqual(response.status_code, 409)
+
+    def test_upload_invalid_token(self):
+        response = Client().put(f"{self.url}uploads/not-a-token/", b"lorem ipsum", content_type="application/pdf")
+        self.assertEqual(response.status_code, 404)
+
+    def test_anonymous_request_upload(self):
+        response = Client().post(f"{self.url}uploads/", {"filename": "report.pdf"}, format="json")
+        self.assertEqual(response.status_code, 401)
+
+    def test_s3_upload_target(self):
+        storage = S3Boto3Storage(
+            bucket_name="bucket",
+            access_key="key",
+            secret_key="secret",
+            region_name="us-east-1",
+            location="media"
+        )
+        target = S3UploadBackend(storage).get_upload_target(
+            "uploads/1/report.pdf", "token", "application/pdf", None
+        )
+        self.assertEqual(target["method"], "PUT")
+        self.assertEqual(target["headers"], {"Content-Type": "application/pdf"})
+        self.assertIn("bucket", target["url"])
+        self.assertIn("/media/uploads/1/report.pdf?", target["url"])
+
+
+class DocumentApiMultipartUploadTestCase(DocumentApiTestCase):
+    """
+    Integration tests for multipart uploads at Document endpoints
+    """
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        response = self.client.post(f"{self.url}multipart/", {"filename": "video.mp4"}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.upload = json.loads(response.content)["upload"]
+        self.upload_url = f"{self.url}multipart/{self.upload}/"
+
+    def upload_part(self, number, data):
+        return self.client.put(
+            f"{self.upload_url}parts/{number}/", data, content_type="application/octet-stream"
+        )
+
+    def complete(self):
+        return self.client.post(f"{self.upload_url}complete/", {
+            "name": "video",
+            "folder": str(self.child_folder.pk),
+            "topics": []
+        }, format="json")
+
+    def test_multipart_upload(self):
+        # Parts can arrive in any order, and be retried
+        self.assertEqual(self.upload_part(2, b"ipsum").status_code, 200)
+        self.assertEqual(self.upload_part(1, b"garbled").status_code, 200)
+        response = self.upload_part(1, b"lorem ")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["number"], 1)
+
+        response = self.complete()
+        self.assertEqual(response.status_code, 201)
+        document = Document.objects.get(pk=json.loads(response.content)["id"])
+        self.assertTrue(document.file.name.endswith("/video.mp4"))
+        with document.file.open() as f:
+            self.assertEqual(f.read(), b"lorem ipsum")
+
+        # Parts can't be added once the upload is complete
+        self.assertEqual(self.upload_part(3, b"dolor").status_code, 404)
+
+    def test_complete_without_parts(self):
+        response = self.complete()
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Document.objects.filter(name="video").exists())
+
+    def test_complete_invalid_document(self):
+        self.upload_part(1, b"lorem ipsum")
+        response = self.client.post(f"{self.upload_url}complete/", {"name": "video"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+        # The upload can still be completed once the document is fixed
+        self.assertEqual(self.complete().status_code, 201)
+
+    def test_abort(self):
+        self.upload_part(1, b"lorem ipsum")
+        response = self.client.delete(self.upload_url)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.complete().status_code, 404)
+        self.assertEqual(self.client.delete(self.upload_url).status_code, 404)
+
+    def test_invalid_part_number(self):
+        self.assertEqual(self.upload_part(0, b"lorem ipsum").status_code, 400)
+
+    def test_part_too_large(self):
+        with patch("documents.views.MULTIPART_MAX_PART_SIZE", 4):
+            self.assertEqual(self.upload_part(1, b"lorem ipsum").status_code, 413)
+
+    def test_another_users_upload(self):
+        other = User.objects.create(username="other", email="other@example.com")
+        token, _ = Token.objects.get_or_create(user=other)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.assertEqual(self.upload_part(1, b"lorem ipsum").status_code, 404)
+
+    def test_anonymous_upload_part(self):
+        response = Client().put(f"{self.upload_url}parts/1/", b"lorem ipsum", content_type="application/octet-stream")
+        self.assertEqual(response.status_code, 401)
+
+    def test_s3_multipart_upload(self):
+        storage = S3Boto3Storage(
+            bucket_name="bucket",
+            access_key="key",
+            secret_key="secret",
+            region_name="us-east-1"
+        )
+        backend = S3UploadBackend(storage)
+        params = {"Bucket": "bucket", "Key": "uploads/1/video.mp4", "UploadId": "abc"}
+
+        with Stubber(backend.client) as stubber:
+            stubber.add_response("create_multipart_upload", {"UploadId": "abc"}, {
+                "Bucket": "bucket", "Key": "uploads/1/video.mp4", "ContentType": "video/mp4"
+            })
+            stubber.add_response("upload_part", {"ETag": '"1"'}, {
+                **params, "PartNumber": 1, "Body": b"lorem ipsum"
+            })
+            stubber.add_response("list_parts", {
+                "Parts": [{"PartNumber": 1, "ETag": '"1"'}], "IsTruncated": False
+            }, {**params, "PartNumberMarker": 0})
+            stubber.add_response("complete_multipart_upload", {}, {
+                **params, "MultipartUpload": {"Parts": [{"PartNumber": 1, "ETag": '"1"'}]}
+            })
+            stubber.add_client_error("abort_multipart_upload", "NoSuchUpload", expected_params=params)
+
+            self.assertEqual(backend.create_multipart_upload("uploads/1/video.mp4", "video/mp4"), "abc")
+            self.assertEqual(
+                backend.upload_part("uploads/1/video.mp4", "abc", 1, BytesIO(b"lorem ipsum"), 11), '"1"'
+            )
+            backend.complete_multipart_upload("uploads/1/video.mp4", "abc")
+            with self.assertRaises(UploadNotFound):
+                backend.abort_multipart_upload("uploads/1/video.mp4", "abc")
+            stubber.assert_no_pending_responses()
+
+
+class DocumentApiContentTestCase(DocumentApiTestCase):
+    """
+    Integration tests for downloading files at Document endpoints
+    """
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.content_url = f"{self.url}{self.document1.pk}/content/"
+
+    def test_download(self):
+        response = self.client.get(self.content_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"lorem ipsum")
+        self.assertEqual(response["Content-Length"], "11")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response["Content-Type"], "text/plain")
+        self.assertIn("ETag", response)
+        self.assertIn("Last-Modified", response)
+
+    def test_download_accepts_file_media_type(self):
+        response = self.client.get(self.content_url, HTTP_ACCEPT="text/plain")
+        self.assertEqual(response.status_code, 200)
+
+    def test_download_range(self):
+        response = self.client.get(self.content_url, HTTP_RANGE="bytes=6-")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), b"ipsum")
+        self.assertEqual(response["Content-Range"], "bytes 6-10/11")
+        self.assertEqual(response["Content-Length"], "5")
+
+    def test_download_suffix_range(self):
+        response = self.client.get(self.content_url, HTTP_RANGE="bytes=-5")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b"".join(response.streaming_content), b"ipsum")
+
+    def test_download_unsatisfiable_range(self):
+        response = self.client.get(self.content_url, HTTP_RANGE="bytes=20-30")
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */11")
+
+    def test_download_invalid_range_ignored(self):
+        for header in ("bytes=5-2", "bytes=abc", "items=0-4"):
+            response = self.client.get(self.content_url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(b"".join(response.streaming_content), b"lorem ipsum")
+
+    def test_download_stale_if_range(self):
+        response = self.client.get(self.content_url, HTTP_RANGE="bytes=0-4", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b"".join(response.streaming_content), b"lorem ipsum")
+
+    def test_download_if_none_match(self):
+        etag = self.client.get(self.content_url)["ETag"]
+        response = self.client.get(self.content_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.document1.file.save("foo.txt", ContentFile(b"dolor sit amet"))
+        response = self.client.get(self.content_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_download_redirect(self):
+        presigned_url = "https://bucket.s3.amazonaws.com/foo.txt?X-Amz-Signature=abc"
+        with patch("documents.downloads.can_presign", return_value=True), \
+                patch.object(FileSystemStorage, "url", return_value=presigned_url) as url:
+            response = self.client.get(self.content_url)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Location"], presigned_url)
+        url.assert_called_once_with(self.document1.file.name, parameters={
+            "ResponseContentDisposition": f'inline; filename="{os.path.basename(self.document1.file.name)}"'
+        })
+
+    def test_download_missing(self):
+        response = self.client.get(f"{self.url}6d8b1b51-9b6b-4e3f-8f0a-59a6c2d2a0f1/content/")
+        self.assertEqual(response.status_code, 404)
+
+
+class DocumentApiConditionalGetTestCase(DocumentApiTestCase):
+    """
+    Integration tests for conditional GETs at Document endpoints
+    """
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+
+    def test_detail_not_modified(self):
+        url = f"{self.url}{self.document1.pk}/"
+        response = self.client.get(url)
+        self.assertIn("Last-Modified", response)
+        etag = response["ETag"]
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+
+        self.document1.name = "renamed"
+        self.document1.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_if_modified_since(self):
+        url = f"{self.url}{self.document1.pk}/"
+        last_modified = self.client.get(url)["Last-Modified"]
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_not_modified(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        # One aggregate query, and nothing serialized
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_list_etag_depends_on_query(self):
+        etag = self.client.get(self.url)["ETag"]
+        response = self.client.get(f"{self.url}?folder_id={self.root_folder.pk}", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_modified_by_delete(self):
+        etag = self.client.get(self.url)["ETag"]
+        self.document1.delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_modified_by_topic_link(self):
+        topic = Topic.objects.create(name="topic")
+        etag = self.client.get(self.url)["ETag"]
+        topic.documents.add(self.document1)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class DocumentApiFacetsTestCase(DocumentApiTestCase):
+    """
+    Integration tests for faceted counts at Document endpoints
+    """
+    def setUp(self):
+        super().setUp()
+        self.other_root = Folder.add_root(name="other")
+        self.document3 = Document.objects.create(name="doc 3", folder=self.other_root, file="baz.txt")
+
+        self.topic1 = Topic.objects.create(name="topic 1")
+        self.topic2 = Topic.objects.create(name="topic 2")
+        self.topic3 = Topic.objects.create(name="topic 3")
+        self.topic1.documents.add(self.document1, self.document2, self.document3)
+        self.topic2.documents.add(self.document2)
+
+    def get_facets(self, query=""):
+        response = self.client.get(f"{self.url}facets/{query}")
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_facets(self):
+        # folder branches, root folders, topics
+        with self.assertNumQueries(3):
+            facets = self.get_facets()
+        self.assertEqual(facets["count"], 3)
+        self.assertEqual(facets["topics"], [
+            {"id": str(self.topic1.pk), "name": "topic 1", "count": 3},
+            {"id": str(self.topic2.pk), "name": "topic 2", "count": 1},
+        ])
+        self.assertEqual(facets["folders"], [
+            {"id": str(self.root_folder.pk), "name": "root", "count": 2},
+            {"id": str(self.other_root.pk), "name": "other", "count": 1},
+        ])
+
+    def test_facets_filtered(self):
+        facets = self.get_facets(f"?topics={self.topic2.pk}")
+        self.assertEqual(facets["count"], 1)
+        self.assertEqual([topic["count"] for topic in facets["topics"]], [1, 1])
+        self.assertEqual(facets["folders"], [
+            {"id": str(self.root_folder.pk), "name": "root", "count": 1},
+        ])
+
+    def test_facets_search(self):
+        facets = self.get_facets("?search=doc")
+        self.assertEqual(facets["count"], 3)
+
+    def test_folder_facets(self):
+        grandchild = Folder.objects.get(pk=self.child_folder.pk).add_child(name="grandchild")
+        Document.objects.create(name="doc 4", folder=grandchild, file="qux.txt")
+
+        response = self.client.get(f"/folders/{self.root_folder.pk}/facets/?name=doc 4")
+        self.assertEqual(response.status_code, 200)
+        facets = json.loads(response.content)
+        self.assertEqual(facets["count"], 1)
+        self.assertEqual(facets["topics"], [])
+        self.assertEqual(facets["folders"], [
+            {"id": str(self.child_folder.pk), "name": "child", "count": 1},
+        ])
+
+        response = self.client.get(f"/folders/{self.root_folder.pk}/facets/")
+        facets = json.loads(response.content)
+        # document1 is directly inside the root folder
+        self.assertEqual(facets["count"], 3)
+        self.assertEqual(facets["folders"], [
+            {"id": str(self.child_folder.pk), "name": "child", "count": 2},
+        ])
+
+    def test_folder_facets_invalid_filter(self):
+        response = self.client.get(f"/folders/{self.root_folder.pk}/facets/?created_at_after=nope")
+        self.assertEqual(response.status_code, 400)
+
+
+class DocumentApiTopicFilterTestCase(DocumentApiTestCase):
+    """
+    Integration tests for the multi-topic filters at Document endpoints
+    """
+    def setUp(self):
+        super().setUp()
+        get_cache().clear()
+        self.document3 = Document.objects.create(name="doc 3", folder=self.root_folder, file="baz.txt")
+
+        self.topic1 = Topic.objects.create(name="topic 1")
+        self.topic2 = Topic.objects.create(name="topic 2")
+        self.topic3 = Topic.objects.create(name="topic 3")
+        self.topic1.documents.add(self.document1, self.document2)
+        self.topic2.documents.add(self.document2, self.document3)
+
+    def get_ids(self, query):
+        response = self.client.get(f"{self.url}?{query}")
+        self.assertEqual(response.status_code, 200)
+        return {result["id"] for result in json.loads(response.content)["results"]}
+
+    def assertFilters(self):
+        ids = self.get_ids(f"topics_all={self.topic1.pk},{self.topic2.pk}")
+        self.assertEqual(ids, {str(self.document2.pk)})
+
+        ids = self.get_ids(f"topics_any={self.topic1.pk},{self.topic3.pk}")
+        self.assertEqual(ids, {str(self.document1.pk), str(self.document2.pk)})
+
+        ids = self.get_ids(f"topics_none={self.topic1.pk}")
+        self.assertEqual(ids, {str(self.document3.pk)})
+
+        ids = self.get_ids(f"topics_any={self.topic2.pk}&topics_none={self.topic1.pk}")
+        self.assertEqual(ids, {str(self.document3.pk)})
+
+        ids = self.get_ids(f"topics_all={self.topic3.pk}")
+        self.assertEqual(ids, set())
+
+    def test_filters(self):
+        self.assertFilters()
+
+    @override_settings(TOPIC_INDEX_ENABLED=True)
+    def test_indexed_filters(self):
+        self.assertFilters()
+
+    @override_settings(TOPIC_INDEX_ENABLED=True)
+    def test_index_kept_fresh(self):
+        url_query = f"topics_all={self.topic1.pk},{self.topic2.pk}"
+        self.assertEqual(self.get_ids(url_query), {str(self.document2.pk)})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.document1.topics.add(self.topic2)
+        self.assertEqual(self.get_ids(url_query), {str(self.document1.pk), str(self.document2.pk)})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.topic1.documents.remove(self.document2)
+        self.assertEqual(self.get_ids(url_query), {str(self.document1.pk)})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Document.objects.get(pk=self.document1.pk).delete()
+        self.assertEqual(self.get_ids(url_query), set())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Topic.objects.get(pk=self.topic2.pk).delete()
+        self.assertEqual(self.get_ids(f"topics_none={self.topic2.pk}"), {str(self.document2.pk), str(self.document3.pk)})
+
+    @override_settings(TOPIC_INDEX_ENABLED=True)
+    def test_index_rebuilt_by_other_process(self):
+        url_query = f"topics_any={self.topic3.pk}"
+        self.assertEqual(self.get_ids(url_query), set())
+
+        # Links written without m2m_changed, e.g. by another worker
+        Topic.documents.through.objects.create(topic=self.topic3, document=self.document1)
+        get_cache().incr(topic_index.GENERATION_KEY)
+        self.assertEqual(self.get_ids(url_query), {str(self.document1.pk)})
+
+    @override_settings(TOPIC_INDEX_ENABLED=True)
+    def test_index_replays_changes_from_other_process(self):
+        url_query = f"topics_any={self.topic3.pk}"
+        self.assertEqual(self.get_ids(url_query), set())
+
+        # Another worker links a document and logs the change
+        Topic.documents.through.objects.create(topic=self.topic3, document=self.document1)
+        generation = topic_index.next_generation()
+        get_cache().set(topic_index.get_change_key(generation), [("add", self.topic3.pk, [self.document1.pk])])
+        with patch.object(topic_index.TopicIndex, "build") as build:
+            self.assertEqual(self.get_ids(url_query), {str(self.document1.pk)})
+        build.assert_not_called()
+
+    @override_settings(TOPIC_INDEX_ENABLED=True)
+    def test_index_kept_fresh_by_bulk_writes(self):
+        url_query = f"topics_any={self.topic1.pk}"
+        self.assertEqual(self.get_ids(url_query), {str(self.document1.pk), str(self.document2.pk)})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            set_related_in_bulk(Document, "topics", {self.document1.pk: [self.topic3]}, replace=True)
+            set_related_in_bulk(Topic, "documents", {self.topic1.pk: [self.document3]})
+        with patch.object(topic_index.TopicIndex, "build") as build:
+            self.assertEqual(self.get_ids(url_query), {str(self.document2.pk), str(self.document3.pk)})
+            self.assertEqual(self.get_ids(f"topics_any={self.topic3.pk}"), {str(self.document1.pk)})
+        build.assert_not_called()
+
+    @override_settings(TOPIC_INDEX_ENABLED=True)
+    def test_index_fallback(self):
+        with patch("documents.topic_index.MAX_INDEXED_PKS", 1):
+            ids = self.get_ids(f"topics_any={self.topic1.pk},{self.topic2.pk}")
+        self.assertEqual(len(ids), 3)
+
+    def test_invalid_topic_ids(self):
+        response = self.client.get(f"{self.url}?topics_all=nope")
+        self.assertEqual(response.status_code, 400)
+
+
+class DocumentApiBreadcrumbTestCase(DocumentApiTestCase):
+    """
+    Integration tests for the expandable breadcrumb fields at Document endpoints
+    """
+    def test_detail(self):
+        response = self.client.get(f"{self.url}{self.document2.pk}/?expand=ancestors,path_names")
+        document = json.loads(response.content)
+        self.assertEqual(document["ancestors"], [
+            {"id": str(self.root_folder.pk), "name": "root"},
+            {"id": str(self.child_folder.pk), "name": "child"},
+        ])
+        self.assertEqual(document["path_names"], ["root", "child", "doc 2"])
+
+    def test_list_adds_one_query(self):
+        grandchild = Folder.objects.get(pk=self.child_folder.pk).add_child(name="grandchild")
+        for i in range(5):
+            Document.objects.create(name=f"doc {i}", folder=grandchild, file="foo.txt")
+
+        with CaptureQueriesContext(connection) as plain:
+            self.client.get(self.url)
+        with CaptureQueriesContext(connection) as expanded:
+            response = self.client.get(f"{self.url}?expand=path_names")
+        # The ETag also depends on the folders' latest updated_at
+        self.assertEqual(len(expanded), len(plain) + 2)
+
+        results = {r["id"]: r for r in json.loads(response.content)["results"]}
+        self.assertEqual(results[str(self.document1.pk)]["path_names"], ["root", "doc 1"])
+        self.assertNotIn("ancestors", results[str(self.document1.pk)])
+
+    @override_settings(RESPONSE_CACHE_ENABLED=True)
+    def test_cached_list_dropped_by_ancestor_rename(self):
+        get_cache().clear()
+        url = f"{self.url}?expand=path_names"
+        self.client.get(url)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            root = Folder.objects.get(pk=self.root_folder.pk)
+            root.name = "renamed"
+            root.save()
+
+        results = {r["id"]: r for r in json.loads(self.client.get(url).content)["results"]}
+        self.assertEqual(results[str(self.document2.pk)]["path_names"], ["renamed", "child", "doc 2"])
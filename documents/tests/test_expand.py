@@ -0,0 +1,111 @@
+import json
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient as Client
+from rest_framework.authtoken.models import Token
+
+from accounts.models import User
+from documents.models import Document, Folder, Topic
+
+
+class ResponseShapingTestCase(TestCase):
+    """
+    Integration tests for the fields, omit and expand query parameters
+    """
+    def setUp(self):
+        self.client = Client()
+
+        self.user = User.objects.create(username="jdoe", email="jdoe@example.com")
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.auth_client = Client()
+        self.auth_client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        self.root_folder = Folder.add_root(name="root")
+        self.child_folder = Folder.objects.get(pk=self.root_folder.pk).add_child(name="child")
+
+        self.topic = Topic.objects.create(name="topic")
+        self.documents = []
+        for i in range(3):
+            document = Document(name=f"doc {i}", folder=self.child_folder)
+            document.file.save(f"doc{i}.txt", ContentFile(b"lorem ipsum"))
+            document.save()
+            document.topics.add(self.topic)
+            self.documents.append(document)
+
+    def get(self, url, **kwargs):
+        response = self.client.get(url, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+    def test_fields(self):
+        with CaptureQueriesContext(connection) as queries:
+            results = self.get("/documents/?fields=id,name")["results"]
+        self.assertEqual(set(results[0]), {"id", "name"})
+
+        page_query = next(q["sql"] for q in queries if "LIMIT" in q["sql"])
+        self.assertNotIn("long_description", page_query)
+        self.assertNotIn("topic", " ".join(q["sql"] for q in queries))
+
+    def test_omit(self):
+        results = self.get("/documents/?omit=file,topics")["results"]
+        self.assertNotIn("file", results[0])
+        self.assertNotIn("topics", results[0])
+        self.assertIn("long_description", results[0])
+
+    def test_topics_prefetched(self):
+        with CaptureQueriesContext(connection) as queries:
+            results = self.get("/documents/")["results"]
+        self.assertEqual(results[0]["topics"], [str(self.topic.pk)])
+        self.assertEqual(len([q for q in queries if "documents_topic" in q["sql"]]), 1)
+
+    def test_expand_folder_and_topics(self):
+        with CaptureQueriesContext(connection) as plain:
+            self.get("/documents/")
+        with CaptureQueriesContext(connection) as expanded:
+            results = self.get("/documents/?expand=folder,topics")["results"]
+        # Only the ETag's latest updated_at of the folders and of the topics
+        self.assertEqual(len(expanded), len(plain) + 2)
+
+        self.assertEqual(results[0]["folder"]["id"], str(self.child_folder.pk))
+        self.assertEqual(results[0]["folder"]["name"], "child")
+        self.assertEqual(results[0]["topics"][0]["name"], "topic")
+
+    def test_expand_topic_documents(self):
+        topic = self.get(f"/topics/{self.topic.pk}/?expand=documents")
+        self.assertCountEqual([document["name"] for document in topic["documents"]], ["doc 0", "doc 1", "doc 2"])
+
+    def test_fields_with_breadcrumbs(self):
+        results = self.get("/documents/?fields=id,path_names&expand=path_names")["results"]
+        self.assertEqual(set(results[0]), {"id", "path_names"})
+        self.assertEqual(results[0]["path_names"][:2], ["root", "child"])
+
+    def test_folder_fields(self):
+        results = self.get("/folders/?fields=id,children")["results"]
+        root = next(result for result in results if result["id"] == str(self.root_folder.pk))
+        self.assertEqual(root["children"], [str(self.child_folder.pk)])
+
+    def test_detail_etag_depends_on_fields(self):
+        url = f"/documents/{self.documents[0].pk}/"
+        etag = self.client.get(url)["ETag"]
+        response = self.client.get(f"{url}?fields=name", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), {"name": "doc 0"})
+
+    def test_expanded_etag_modified_by_related_change(self):
+        url = "/documents/?expand=topics"
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        topic = Topic.objects.get(pk=self.topic.pk)
+        topic.name = "renamed"
+        topic.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_writes_not_shaped(self):
+        response = self.auth_client.patch(
+            f"/documents/{self.documents[0].pk}/?fields=id", {"name": "renamed"}, format="json"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["name"], "renamed")
@@ -1,11 +1,20 @@
 import json
+from io import StringIO
+from unittest.mock import patch
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIClient as Client
 from rest_framework.authtoken.models import Token
 from freezegun import freeze_time
+from treebeard.exceptions import InvalidMoveToDescendant, PathOverflow
 
 from accounts.models import User
-from documents.models import Folder
+from documents.models import Document, Folder, Topic
+from documents import tree
+from documents.tree import move_folder
+from documents.uploads import make_upload_token
 
 
 class FolderApiTestCase(TestCase):
@@ -46,7 +55,7 @@ class FolderApiAnonymousTestCase(FolderApiTestCase):
 
     def test_anonymous_user_read(self):
         client = Client()
-        response = client.get(self.url)
+        response = client.get(f"{self.url}?page=1")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json.loads(response.content)["count"], 3)
 
@@ -84,6 +93,12 @@ class FolderApiAuthenticatedUserTestCase(FolderApiTestCase):
         new_root = Folder.objects.get(pk=new_pk)
         self.assertIsNone(new_root.get_parent())
 
+    def test_lock_last_root_after_concurrent_root(self):
+        # Another request adds a root after this one has read the last root
+        last_root = Folder.add_root(name="zzz")
+        with patch.object(tree, "get_last_root_pk", side_effect=[self.root_folder.pk, last_root.pk]):
+            self.assertEqual(tree.lock_last_root(), last_root)
+
     def test_authenticated_user_create_leaf(self):
         response = self.client.post(self.url, {
             "name": "new root",
@@ -96,7 +111,7 @@ class FolderApiAuthenticatedUserTestCase(FolderApiTestCase):
         self.assertEqual(new_leaf.get_parent().pk, self.child_folder.pk)
 
     def test_authenticated_user_read(self):
-        response = self.client.get(self.url)
+        response = self.client.get(f"{self.url}?page=1")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json.loads(response.content)["count"], 3)
 
@@ -135,6 +150,58 @@ class FolderApiAuthenticatedUserTestCase(FolderApiTestCase):
         updated_leaf = Folder.objects.get(pk=self.child_folder.pk)
         self.assertEqual(updated_leaf.get_parent().pk, new_node.pk)
 
+    def test_authenticated_user_move_keeps_tree_consistent(self):
+        new_node = Folder.add_root(name="bar")
+        response = self.client.patch(f"{self.url}{self.child_folder.pk}/", {
+            "parent": new_node.pk,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Folder.find_problems(), ([], [], [], [], []))
+        self.assertEqual(Folder.objects.get(pk=self.root_folder.pk).numchild, 0)
+        self.assertEqual(Folder.objects.get(pk=new_node.pk).numchild, 1)
+        updated_grandchild = Folder.objects.get(pk=self.grandchild_folder.pk)
+        self.assertEqual(updated_grandchild.get_parent().pk, self.child_folder.pk)
+        self.assertEqual(updated_grandchild.depth, 3)
+
+    def test_authenticated_user_move_to_root(self):
+        response = self.client.patch(f"{self.url}{self.child_folder.pk}/", {
+            "parent": "",
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Folder.find_problems(), ([], [], [], [], []))
+        updated_child = Folder.objects.get(pk=self.child_folder.pk)
+        self.assertTrue(updated_child.is_root())
+        self.assertEqual(updated_child.get_children().get().pk, self.grandchild_folder.pk)
+
+    def test_authenticated_user_move_to_same_parent(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(f"{self.url}{self.grandchild_folder.pk}/", {
+                "parent": self.child_folder.pk,
+            })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any(
+            q["sql"].startswith("UPDATE") and '"path"' in q["sql"] for q in queries
+        ))
+        unchanged = Folder.objects.get(pk=self.grandchild_folder.pk)
+        self.assertEqual(unchanged.path, self.grandchild_folder.path)
+
+    def test_authenticated_user_move_to_descendant(self):
+        response = self.client.patch(f"{self.url}{self.root_folder.pk}/", {
+            "parent": self.grandchild_folder.pk,
+        })
+        self.assertEqual(response.status_code, 400)
+
+    def test_authenticated_user_move_fails_after_validation(self):
+        for error in (InvalidMoveToDescendant, PathOverflow):
+            with patch("documents.serializers.move_folder", side_effect=error):
+                response = self.client.patch(f"{self.url}{self.grandchild_folder.pk}/", {
+                    "name": "renamed",
+                    "parent": self.root_folder.pk,
+                })
+            self.assertEqual(response.status_code, 400)
+            self.assertIn("parent", json.loads(response.content))
+            self.assertEqual(Folder.objects.get(pk=self.grandchild_folder.pk).name, "grandchild")
+
     def test_authenticated_user_delete(self):
         response = self.client.delete(f"{self.url}{self.child_folder.pk}/")
         self.assertEqual(response.status_code, 204)
@@ -146,29 +213,467 @@ class FolderApiFilterTestCase(FolderApiTestCase):
     Integration tests for filters at Folder endpoints
     """
     def test_filter_name(self):
-        response = self.client.get(f"{self.url}?name=root")
+        response = self.client.get(f"{self.url}?page=1&name=root")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json.loads(response.content)["count"], 1)
 
+    def test_filter_search(self):
+        response = self.client.get(f"{self.url}?search=child")
+        self.assertEqual(response.status_code, 200)
+        json_resp = json.loads(response.content)
+        self.assertEqual(json_resp["count"], 1)
+        self.assertEqual(json_resp["results"][0]["id"], str(self.child_folder.pk))
+
     def test_filter_parent(self):
-        response = self.client.get(f"{self.url}?parent={self.root_folder.pk}")
+        response = self.client.get(f"{self.url}?page=1&parent={self.root_folder.pk}")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json.loads(response.content)["count"], 1)
 
     def test_filter_child(self):
-        response = self.client.get(f"{self.url}?child={self.child_folder.pk}")
+        response = self.client.get(f"{self.url}?page=1&child={self.child_folder.pk}")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json.loads(response.content)["count"], 1)
 
+    def get_ids(self, query):
+        response = self.client.get(f"{self.url}?{query}")
+        self.assertEqual(response.status_code, 200)
+        return {result["id"] for result in json.loads(response.content)["results"]}
+
+    def test_filter_missing_parent(self):
+        self.assertEqual(self.get_ids("parent=6d8b1b51-9b6b-4e3f-8f0a-59a6c2d2a0f1"), set())
+
+    def test_filter_ancestor_of(self):
+        ids = self.get_ids(f"ancestor_of={self.grandchild_folder.pk}")
+        self.assertEqual(ids, {str(self.root_folder.pk), str(self.child_folder.pk)})
+        self.assertEqual(self.get_ids(f"ancestor_of={self.root_folder.pk}"), set())
+
+    def test_filter_descendant_of(self):
+        ids = self.get_ids(f"descendant_of={self.root_folder.pk}")
+        self.assertEqual(ids, {str(self.child_folder.pk), str(self.grandchild_folder.pk)})
+
+    def test_filter_depth(self):
+        self.assertEqual(self.get_ids("depth=2"), {str(self.child_folder.pk)})
+        self.assertEqual(self.get_ids("min_depth=2&max_depth=3"), {
+            str(self.child_folder.pk), str(self.grandchild_folder.pk)
+        })
+
+    def test_filter_is_root_and_is_leaf(self):
+        self.assertEqual(self.get_ids("is_root=true"), {str(self.root_folder.pk)})
+        self.assertEqual(self.get_ids("is_leaf=true"), {str(self.grandchild_folder.pk)})
+        self.assertEqual(self.get_ids("is_root=false&is_leaf=false"), {str(self.child_folder.pk)})
+
+    def test_tree_filters_compose(self):
+        topic = Topic.objects.create(name="topic")
+        topic.folders.add(self.grandchild_folder)
+        ids = self.get_ids(f"descendant_of={self.root_folder.pk}&topics={topic.pk}&is_leaf=true")
+        self.assertEqual(ids, {str(self.grandchild_folder.pk)})
+
+    def test_tree_filter_is_single_query(self):
+        with CaptureQueriesContext(connection) as unfiltered:
+            self.client.get(f"{self.url}?page=1&name=child")
+        with CaptureQueriesContext(connection) as filtered:
+            self.client.get(f"{self.url}?page=1&ancestor_of={self.grandchild_folder.pk}&min_depth=2")
+        self.assertEqual(len(filtered), len(unfiltered))
+
     def test_filter_created_at(self):
-        response = self.client.get(f"{self.url}?created_at_before=2020-09-01T19:58:21.942889Z")
+        response = self.client.get(f"{self.url}?page=1&created_at_before=2020-09-01T19:58:21.942889Z")
         self.assertEqual(response.status_code, 200)
         json_resp = json.loads(response.content)
         self.assertEqual(json_resp["count"], 1)
         self.assertEqual(json_resp["results"][0]["id"], str(self.root_folder.pk))
 
     def test_filter_updated_at(self):
-        response = self.client.get(f"{self.url}?updated_at_before=2020-09-01T19:58:21.942889Z")
+        response = self.client.get(f"{self.url}?page=1&updated_at_before=2020-09-01T19:58:21.942889Z")
         json_resp = json.loads(response.content)
         self.assertEqual(json_resp["count"], 1)
         self.assertEqual(json_resp["results"][0]["id"], str(self.root_folder.pk))
+
+
+class FolderApiTreeTestCase(FolderApiTestCase):
+    """
+    Integration tests for the parent and children fields at Folder endpoints
+    """
+    def test_list_tree_links(self):
+        response = self.client.get(self.url)
+        results = {r["id"]: r for r in json.loads(response.content)["results"]}
+
+        root = results[str(self.root_folder.pk)]
+        self.assertIsNone(root["parent"])
+        self.assertEqual(root["children"], [str(self.child_folder.pk)])
+
+        child = results[str(self.child_folder.pk)]
+        self.assertEqual(child["parent"], str(self.root_folder.pk))
+        self.assertEqual(child["children"], [str(self.grandchild_folder.pk)])
+
+        grandchild = results[str(self.grandchild_folder.pk)]
+        self.assertEqual(grandchild["parent"], str(self.child_folder.pk))
+        self.assertEqual(grandchild["children"], [])
+
+    def test_list_query_count_is_constant(self):
+        for i in range(5):
+            Folder.objects.get(pk=self.grandchild_folder.pk).add_child(name=f"leaf {i}")
+            Folder.objects.get(pk=self.root_folder.pk).add_child(name=f"branch {i}")
+
+        # count, page, parents, children, topics
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(queries), 5)
+
+
+class FolderApiBulkTestCase(FolderApiTestCase):
+    """
+    Integration tests for the Folder bulk endpoint
+    """
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_bulk_create(self):
+        response = self.client.post(f"{self.url}bulk/", [
+            {"name": "a", "parent": str(self.child_folder.pk), "topics": []},
+            {"name": "b", "parent": str(self.child_folder.pk), "topics": []},
+            {"name": "c", "parent": None, "topics": []},
+        ], format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Folder.find_problems(), ([], [], [], [], []))
+        self.assertEqual(Folder.objects.get(pk=self.child_folder.pk).numchild, 3)
+        self.assertEqual(Folder.get_root_nodes().count(), 2)
+
+    def test_bulk_update_moves(self):
+        response = self.client.patch(f"{self.url}bulk/", [
+            {"id": str(self.grandchild_folder.pk), "parent": None, "name": "moved"},
+        ], format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Folder.find_problems(), ([], [], [], [], []))
+        moved = Folder.objects.get(pk=self.grandchild_folder.pk)
+        self.assertTrue(moved.is_root())
+        self.assertEqual(moved.name, "moved")
+
+    def test_bulk_update_move_cycle(self):
+        other = Folder.add_root(name="other")
+        response = self.client.patch(f"{self.url}bulk/", [
+            {"id": str(other.pk), "parent": str(self.child_folder.pk)},
+            {"id": str(self.child_folder.pk), "parent": str(other.pk), "name": "renamed"},
+        ], format="json")
+        self.assertEqual(response.status_code, 207)
+        content = json.loads(response.content)
+        self.assertEqual(content[0]["status"], 200)
+        self.assertEqual(content[1]["status"], 400)
+        self.assertIn("parent", content[1]["errors"])
+        self.assertEqual(Folder.find_problems(), ([], [], [], [], []))
+        self.assertEqual(Folder.objects.get(pk=other.pk).get_parent(), self.child_folder)
+        self.assertEqual(Folder.objects.get(pk=self.child_folder.pk).name, self.child_folder.name)
+
+    def test_bulk_delete(self):
+        response = self.client.delete(f"{self.url}bulk/", [
+            str(self.child_folder.pk),
+        ], format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Folder.objects.count(), 1)
+
+
+class FolderApiImportTestCase(FolderApiTestCase):
+    """
+    Integration tests for the Folder tree import endpoint
+    """
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        self.topic = Topic.objects.create(name="topic")
+
+    def test_import_tree(self):
+        tree = [
+            {
+                "name": "a",
+                "topics": [str(self.topic.pk)],
+                "children": [
+                    {"name": "a1", "children": [{"name": "a1x"}]},
+                    {"name": "a2", "long_description": "second"},
+                ]
+            },
+            {"name": "b"},
+        ]
+        # auth, parent, topics, savepoint, lock parent, last child,
+        # insert folders, insert topic links, touch topics, update numchild,
+        # release
+        with self.assertNumQueries(11):
+            response = self.client.post(f"{self.url}import/", {
+                "parent": str(self.child_folder.pk),
+                "folders": tree
+            }, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(json.loads(response.content)["ids"]), 2)
+        self.assertEqual(Folder.find_problems(), ([], [], [], [], []))
+
+        a = Folder.objects.get(name="a")
+        self.assertEqual(a.get_parent().pk, self.child_folder.pk)
+        self.assertEqual([f.name for f in a.get_children()], ["a1", "a2"])
+        self.assertEqual(Folder.objects.get(name="a1x").get_parent().name, "a1")
+        self.assertEqual(list(a.topics.all()), [self.topic])
+        self.assertEqual(Folder.objects.get(pk=self.child_folder.pk).numchild, 3)
+
+    def test_import_as_roots(self):
+        response = self.client.post(f"{self.url}import/", {
+            "folders": [{"name": "new root", "children": [{"name": "leaf"}]}]
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Folder.find_problems(), ([], [], [], [], []))
+        self.assertEqual(Folder.get_root_nodes().count(), 2)
+
+    def test_import_duplicate_topics(self):
+        response = self.client.post(f"{self.url}import/", {
+            "folders": [{"name": "a", "topics": [str(self.topic.pk), str(self.topic.pk)]}]
+        }, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(list(Folder.objects.get(name="a").topics.all()), [self.topic])
+
+    def test_import_invalid_topic(self):
+        response = self.client.post(f"{self.url}import/", {
+            "folders": [{"name": "a", "children": [
+                {"name": "b", "topics": ["6d8b1b51-9b6b-4e3f-8f0a-59a6c2d2a0f1"]}
+            ]}]
+        }, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Folder.objects.count(), 3)
+
+    def test_import_invalid_child(self):
+        response = self.client.post(f"{self.url}import/", {
+            "folders": [{"name": "a", "children": [{"long_description": "no name"}]}]
+        }, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Folder.objects.count(), 3)
+
+
+class FolderApiTreeEndpointTestCase(FolderApiTestCase):
+    """
+    Integration tests for the Folder tree endpoints
+    """
+    def test_subtree(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(f"{self.url}{self.root_folder.pk}/tree/")
+        self.assertEqual(response.status_code, 200)
+        tree = json.loads(response.content)
+        self.assertEqual(tree["id"], str(self.root_folder.pk))
+        child = tree["children"][0]
+        self.assertEqual(child["id"], str(self.child_folder.pk))
+        self.assertEqual(child["children"][0]["id"], str(self.grandchild_folder.pk))
+        self.assertEqual(child["children"][0]["children"], [])
+
+    def test_subtree_max_depth(self):
+        response = self.client.get(f"{self.url}{self.child_folder.pk}/tree/?max_depth=0")
+        tree = json.loads(response.content)
+        self.assertEqual(tree["id"], str(self.child_folder.pk))
+        self.assertEqual(tree["children"], [])
+
+    def test_subtree_document_counts(self):
+        Document.objects.create(name="doc", folder=self.child_folder, file="foo.txt")
+        response = self.client.get(f"{self.url}{self.root_folder.pk}/tree/?document_counts=true")
+        tree = json.loads(response.content)
+        self.assertEqual(tree["document_count"], 0)
+        self.assertEqual(tree["children"][0]["document_count"], 1)
+
+    def test_forest(self):
+        other_root = Folder.add_root(name="other")
+        with self.assertNumQueries(1):
+            response = self.client.get(f"{self.url}tree/?max_depth=2")
+        self.assertEqual(response.status_code, 200)
+        forest = json.loads(response.content)
+        self.assertCountEqual([node["id"] for node in forest], [str(self.root_folder.pk), str(other_root.pk)])
+        root = next(node for node in forest if node["id"] == str(self.root_folder.pk))
+        self.assertEqual(root["children"][0]["children"], [])
+
+    def test_invalid_max_depth(self):
+        response = self.client.get(f"{self.url}tree/?max_depth=-1")
+        self.assertEqual(response.status_code, 400)
+
+
+class FolderApiConditionalGetTestCase(FolderApiTestCase):
+    """
+    Integration tests for conditional GETs at Folder endpoints
+    """
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        self.detail_url = f"{self.url}{self.root_folder.pk}/"
+
+    def test_detail_modified_by_new_child(self):
+        etag = self.client.get(self.detail_url)["ETag"]
+        self.assertEqual(self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        Folder.objects.get(pk=self.root_folder.pk).add_child(name="new child")
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_detail_modified_by_moved_child(self):
+        etag = self.client.get(self.detail_url)["ETag"]
+        move_folder(self.grandchild_folder, None)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        move_folder(self.child_folder, None)
+        response = self.client.get(self.detail_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_list_modified_by_deleted_child(self):
+        url = f"{self.url}?name=child"
+        etag = self.client.get(url)["ETag"]
+        Folder.objects.get(pk=self.grandchild_folder.pk).delete()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class FolderApiDocumentCountTestCase(FolderApiTestCase):
+    """
+    Integration tests for the denormalized document counts of Folders
+    """
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username="counter", email="counter@example.com")
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client = Client()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def assertCounts(self, folder, document_count, descendant_document_count):
+        folder = Folder.objects.get(pk=folder.pk)
+        self.assertEqual(folder.document_count, document_count)
+        self.assertEqual(folder.descendant_document_count, descendant_document_count)
+
+    def test_create_and_delete(self):
+        document = Document.objects.create(name="doc", folder=self.grandchild_folder, file="foo.txt")
+        self.assertCounts(self.root_folder, 0, 1)
+        self.assertCounts(self.child_folder, 0, 1)
+        self.assertCounts(self.grandchild_folder, 1, 0)
+
+        document.delete()
+        self.assertCounts(self.root_folder, 0, 0)
+        self.assertCounts(self.grandchild_folder, 0, 0)
+
+    def test_move_document(self):
+        document = Document.objects.create(name="doc", folder=self.grandchild_folder, file="foo.txt")
+        document = Document.objects.get(pk=document.pk)
+        document.folder = self.child_folder
+        document.save()
+        self.assertCounts(self.root_folder, 0, 1)
+        self.assertCounts(self.child_folder, 1, 0)
+        self.assertCounts(self.grandchild_folder, 0, 0)
+
+    def test_deferred_folder_not_counted_twice(self):
+        document = Document.objects.create(name="doc", folder=self.grandchild_folder, file="foo.txt")
+        document = Document.objects.only("name").get(pk=document.pk)
+        document.name = "renamed"
+        document.save()
+        self.assertCounts(self.grandchild_folder, 1, 0)
+        self.assertCounts(self.root_folder, 0, 1)
+
+    def test_counts_modify_etags(self):
+        url = f"{self.url}{self.root_folder.pk}/"
+        etag = self.client.get(url)["ETag"]
+        list_etag = self.client.get(self.url)["ETag"]
+
+        Document.objects.create(name="doc", folder=self.grandchild_folder, file="foo.txt")
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["descendant_document_count"], 1)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=list_etag).status_code, 200)
+
+    def test_move_folder(self):
+        other_root = Folder.add_root(name="other")
+        Document.objects.create(name="doc", folder=self.child_folder, file="foo.txt")
+        Document.objects.create(name="doc", folder=self.grandchild_folder, file="bar.txt")
+
+        move_folder(Folder.objects.get(pk=self.child_folder.pk), other_root)
+        self.assertCounts(self.root_folder, 0, 0)
+        self.assertCounts(other_root, 0, 2)
+        self.assertCounts(self.child_folder, 1, 1)
+
+    def test_bulk(self):
+        response = self.client.post("/documents/bulk/", [
+            {"name": "a", "folder": str(self.grandchild_folder.pk),
+             "upload": make_upload_token("uploads/1/foo.txt", self.user), "topics": []},
+            {"name": "b", "folder": str(self.child_folder.pk),
+             "upload": make_upload_token("uploads/2/bar.txt", self.user), "topics": []},
+        ], format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertCounts(self.root_folder, 0, 2)
+        self.assertCounts(self.child_folder, 1, 1)
+
+        document_id = json.loads(response.content)[0]["id"]
+        response = self.client.patch("/documents/bulk/", [
+            {"id": document_id, "folder": str(self.root_folder.pk)},
+        ], format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertCounts(self.root_folder, 1, 1)
+        self.assertCounts(self.child_folder, 1, 0)
+        self.assertCounts(self.grandchild_folder, 0, 0)
+
+    def test_serialized(self):
+        Document.objects.create(name="doc", folder=self.child_folder, file="foo.txt")
+        response = self.client.get(f"{self.url}{self.root_folder.pk}/")
+        folder = json.loads(response.content)
+        self.assertEqual(folder["document_count"], 0)
+        self.assertEqual(folder["descendant_document_count"], 1)
+
+    def test_repair(self):
+        Document.objects.create(name="doc", folder=self.grandchild_folder, file="foo.txt")
+        Folder.objects.update(document_count=5, descendant_document_count=7)
+
+        out = StringIO()
+        call_command("repair_document_counts", "--dry-run", stdout=out)
+        self.assertCounts(self.root_folder, 5, 7)
+
+        call_command("repair_document_counts", stdout=out)
+        self.assertCounts(self.root_folder, 0, 1)
+        self.assertCounts(self.child_folder, 0, 1)
+        self.assertCounts(self.grandchild_folder, 1, 0)
+
+
+class FolderApiBreadcrumbTestCase(FolderApiTestCase):
+    """
+    Integration tests for the expandable breadcrumb fields at Folder endpoints
+    """
+    def test_not_expanded_by_default(self):
+        response = self.client.get(f"{self.url}{self.child_folder.pk}/")
+        folder = json.loads(response.content)
+        self.assertNotIn("ancestors", folder)
+        self.assertNotIn("path_names", folder)
+
+    def test_detail(self):
+        response = self.client.get(f"{self.url}{self.grandchild_folder.pk}/?expand=ancestors,path_names")
+        folder = json.loads(response.content)
+        self.assertEqual(folder["ancestors"], [
+            {"id": str(self.root_folder.pk), "name": "root"},
+            {"id": str(self.child_folder.pk), "name": "child"},
+        ])
+        self.assertEqual(folder["path_names"], ["root", "child", "grandchild"])
+
+    def test_list_adds_one_query(self):
+        for i in range(5):
+            Folder.objects.get(pk=self.grandchild_folder.pk).add_child(name=f"leaf {i}")
+
+        with CaptureQueriesContext(connection) as plain:
+            self.client.get(self.url)
+        with CaptureQueriesContext(connection) as expanded:
+            response = self.client.get(f"{self.url}?expand=path_names&expand=ancestors")
+        # The ETag also depends on the folders' latest updated_at
+        self.assertEqual(len(expanded), len(plain) + 2)
+
+        results = {r["id"]: r for r in json.loads(response.content)["results"]}
+        self.assertEqual(results[str(self.root_folder.pk)]["ancestors"], [])
+        self.assertEqual(results[str(self.grandchild_folder.pk)]["path_names"], ["root", "child", "grandchild"])
+
+    def test_etag_modified_by_ancestor_rename(self):
+        url = f"{self.url}{self.grandchild_folder.pk}/?expand=path_names"
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        root = Folder.objects.get(pk=self.root_folder.pk)
+        root.name = "renamed"
+        root.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["path_names"], ["renamed", "child", "grandchild"])
@@ -0,0 +1,55 @@
+import json
+from django.test import TestCase
+from rest_framework.test import APIClient as Client
+from freezegun import freeze_time
+
+from documents.models import Topic
+
+
+class PaginationTestCase(TestCase):
+    """
+    Integration tests for list endpoint pagination
+    """
+    def setUp(self):
+        self.url = "/topics/"
+        self.client = Client()
+
+        # Several topics share each timestamp, so the cursor has to break
+        # ties on id to avoid skipping or repeating rows
+        self.topics = []
+        for day in range(1, 6):
+            with freeze_time(f"2021-01-0{day}"):
+                for i in range(5):
+                    self.topics.append(Topic.objects.create(name=f"topic {day}-{i}"))
+
+    def test_cursor_pagination_forward(self):
+        seen = []
+        url = self.url
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            json_resp = json.loads(response.content)
+            self.assertNotIn("count", json_resp)
+            seen.extend(r["id"] for r in json_resp["results"])
+            url = json_resp["next"]
+
+        expected = sorted(self.topics, key=lambda t: (t.created_at, t.pk), reverse=True)
+        self.assertEqual(seen, [str(t.pk) for t in expected])
+
+    def test_cursor_pagination_backward(self):
+        first_page = json.loads(self.client.get(self.url).content)
+        second_page = json.loads(self.client.get(first_page["next"]).content)
+        previous_page = json.loads(self.client.get(second_page["previous"]).content)
+        self.assertEqual(previous_page["results"], first_page["results"])
+        self.assertIsNone(previous_page["previous"])
+
+    def test_cursor_pagination_invalid_cursor(self):
+        response = self.client.get(f"{self.url}?cursor=garbage")
+        self.assertEqual(response.status_code, 404)
+
+    def test_page_number_pagination(self):
+        response = self.client.get(f"{self.url}?page=3")
+        self.assertEqual(response.status_code, 200)
+        json_resp = json.loads(response.content)
+        self.assertEqual(json_resp["count"], 25)
+        self.assertEqual(len(json_resp["results"]), 5)
@@ -0,0 +1,99 @@
+import json
+from unittest.mock import patch
+from django.db import OperationalError, connections
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient as Client
+from rest_framework.authtoken.models import Token
+
+from accounts.models import User
+from documents import replicas, topic_index
+from documents.models import Document, Folder, Topic
+from documents.views import TopicViewSet
+
+
+@override_settings(DATABASE_REPLICAS={'replica': 1})
+class ReplicaRoutingTestCase(TestCase):
+    """
+    Integration tests for routing reads to a replica
+    """
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        replicas._unavailable_until.clear()
+        self.client = Client()
+
+        self.user = User.objects.create(username="jdoe", email="jdoe@example.com")
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.auth_client = Client()
+        self.auth_client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        self.topic = Topic.objects.create(name="primary")
+        self.replica_topic = Topic.objects.using('replica').create(name="replica")
+
+    def get_names(self, client, **kwargs):
+        response = client.get("/topics/", **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return [topic["name"] for topic in json.loads(response.content)["results"]]
+
+    def test_reads_from_replica(self):
+        self.assertEqual(self.get_names(self.client), ["replica"])
+        response = self.client.get(f"/topics/{self.replica_topic.pk}/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_writes_go_to_primary(self):
+        response = self.auth_client.post("/topics/", {"name": "new", "folders": [], "documents": []}, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Topic.objects.filter(name="new").exists())
+        self.assertFalse(Topic.objects.using('replica').filter(name="new").exists())
+
+    def test_pinned_after_write(self):
+        response = self.auth_client.patch(f"/topics/{self.topic.pk}/", {"name": "renamed"}, format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.cookies[replicas.PIN_COOKIE]["max-age"], 10)
+        self.assertEqual(self.get_names(self.auth_client), ["renamed"])
+
+        # Failed writes don't pin
+        response = self.client.patch(f"/topics/{self.topic.pk}/", {"name": "anonymous"}, format="json")
+        self.assertNotIn(replicas.PIN_COOKIE, response.cookies)
+        self.assertEqual(self.get_names(self.client), ["replica"])
+
+    def test_pinned_by_header(self):
+        self.assertEqual(self.get_names(self.client, HTTP_X_READ_PRIMARY="1"), ["primary"])
+
+    def test_failover(self):
+        with patch.object(connections['replica'], 'ensure_connection', side_effect=OperationalError):
+            self.assertEqual(self.get_names(self.client), ["primary"])
+        # The replica isn't tried again until REPLICA_RETRY_AFTER has passed
+        self.assertEqual(self.get_names(self.client), ["primary"])
+
+    def test_reset_after_unhandled_exception(self):
+        with patch.object(TopicViewSet, 'list_response', side_effect=OperationalError):
+            with self.assertRaises(OperationalError):
+                self.client.get("/topics/")
+        self.assertEqual(Topic.objects.all().db, 'default')
+
+    def test_weights(self):
+        with override_settings(DATABASE_REPLICAS={'replica': 0}):
+            self.assertEqual(self.get_names(self.client), ["primary"])
+
+    def test_other_reads_use_primary(self):
+        self.get_names(self.client)
+        self.assertEqual(Topic.objects.get().name, "primary")
+
+    @override_settings(RESPONSE_CACHE_ENABLED=True)
+    def test_cached_responses_read_from_primary(self):
+        # The cached response mustn't be one a lagging replica built
+        self.assertEqual(self.get_names(self.client), ["primary"])
+        self.assertEqual(self.get_names(self.client), ["primary"])
+
+    @override_settings(TOPIC_INDEX_ENABLED=True)
+    def test_topic_index_built_from_primary(self):
+        document = Document.objects.create(name="doc", folder=Folder.add_root(name="root"))
+        document.topics.add(self.topic)
+        topic_index.index.generation = None
+        token = replicas._replica.set('replica')
+        try:
+            index = topic_index.get_index()
+        finally:
+            replicas._replica.reset(token)
+        self.assertEqual(index.get_pks(index.match_any([self.topic.pk])), [document.pk])
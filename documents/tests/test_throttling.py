@@ -0,0 +1,116 @@
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from unittest.mock import patch
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from freezegun import freeze_time
+from rest_framework.test import APIClient as Client
+from rest_framework.authtoken.models import Token
+from rest_framework.throttling import SimpleRateThrottle
+
+from accounts.models import User
+from documents import throttling
+from documents.models import Folder
+
+
+@override_settings(THROTTLE_ENABLED=1)
+class ThrottleTestCase(TestCase):
+    """
+    Integration tests for the token bucket throttles
+    """
+    def setUp(self):
+        caches['throttle'].clear()
+        rates = patch.dict(SimpleRateThrottle.THROTTLE_RATES, {
+            'anon_read': '10/min', 'user_read': '10/min', 'write': '10/min'
+        })
+        rates.start()
+        self.addCleanup(rates.stop)
+
+        self.client = Client()
+        self.user = User.objects.create(username="jdoe", email="jdoe@example.com")
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.auth_client = Client()
+        self.auth_client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        self.root_folder = Folder.add_root(name="root")
+
+    def get_statuses(self, client, url, count):
+        return [client.get(url).status_code for _ in range(count)]
+
+    def test_anonymous_reads(self):
+        self.assertEqual(self.get_statuses(self.client, "/topics/", 10), [200] * 10)
+        response = self.client.get("/topics/")
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response["Retry-After"], "6")
+
+        # Authenticated reads and writes have their own buckets
+        self.assertEqual(self.auth_client.get("/topics/").status_code, 200)
+        response = self.auth_client.post("/topics/", {"name": "topic", "folders": [], "documents": []}, format="json")
+        self.assertEqual(response.status_code, 201)
+
+    def test_refill(self):
+        self.get_statuses(self.client, "/topics/", 10)
+        with freeze_time(timezone.now() + timedelta(seconds=12)):
+            self.assertEqual(self.get_statuses(self.client, "/topics/", 3), [200, 200, 429])
+
+    def test_users_have_own_buckets(self):
+        self.assertEqual(self.get_statuses(self.auth_client, "/folders/", 11)[-1], 429)
+        self.assertEqual(self.client.get("/folders/").status_code, 200)
+
+    def test_costs(self):
+        url = f"/folders/{self.root_folder.pk}/tree/"
+        self.assertEqual(self.get_statuses(self.client, url, 3), [200, 200, 429])
+
+        caches['throttle'].clear()
+        url = f"/documents/?folder_subtree={self.root_folder.pk}"
+        self.assertEqual(self.get_statuses(self.client, url, 4), [200, 200, 200, 429])
+
+        caches['throttle'].clear()
+        self.assertEqual(self.get_statuses(self.client, "/documents/?page=21", 4), [404, 404, 404, 429])
+
+    def test_bulk_cost(self):
+        items = [{"name": f"topic {i}", "folders": [], "documents": []} for i in range(40)]
+        response = self.auth_client.post("/topics/bulk/", items, format="json")
+        self.assertEqual(response.status_code, 201)
+        statuses = [
+            self.auth_client.post("/topics/bulk/", [], format="json").status_code
+            for _ in range(6)
+        ]
+        self.assertEqual(statuses, [201] * 5 + [429])
+
+    def test_forwarded_for_ignored(self):
+        statuses = [
+            self.client.get("/topics/", HTTP_X_FORWARDED_FOR=f"10.0.0.{i}").status_code
+            for i in range(11)
+        ]
+        self.assertEqual(statuses[-1], 429)
+
+    def test_take_is_atomic(self):
+        results = []
+
+        def take():
+            results.append(throttling.take("throttle:test", 1, 10, 60))
+
+        threads = [threading.Thread(target=take) for _ in range(30)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results.count(0), 10)
+
+    def test_bucket_cache_culls_occasionally(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location, ignore_errors=True)
+        cache = throttling.BucketCache(location, {"OPTIONS": {"MAX_ENTRIES": 10}})
+        with patch.object(cache, "_list_cache_files", wraps=cache._list_cache_files) as list_files:
+            for i in range(throttling.CULL_INTERVAL * 2):
+                cache.set(f"bucket {i}", (1, 0))
+        self.assertEqual(list_files.call_count, 2)
+        self.assertLess(len(cache._list_cache_files()), throttling.CULL_INTERVAL * 2)
+
+    @override_settings(THROTTLE_ENABLED=0)
+    def test_disabled(self):
+        self.assertEqual(self.get_statuses(self.client, "/topics/", 11)[-1], 200)
@@ -65,7 +65,7 @@ class TopicApiAnonymousTestCase(TopicApiTestCase):
 
     def test_anonymous_user_read(self):
         client = Client()
-        response = client.get(self.url)
+        response = client.get(f"{self.url}?page=1")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json.loads(response.content)["count"], 2)
 
@@ -106,7 +106,7 @@ class TopicApiAuthenticatedUserTestCase(TopicApiTestCase):
         self.assertEqual(new_topic.documents.all().count(), 1)
 
     def test_authenticated_user_read(self):
-        response = self.client.get(self.url)
+        response = self.client.get(f"{self.url}?page=1")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json.loads(response.content)["count"], 2)
 
@@ -129,29 +129,108 @@ class TopicApiFilterTestCase(TopicApiTestCase):
     Integration tests for filters at Document endpoints
     """
     def test_filter_name(self):
-        response = self.client.get(f"{self.url}?name=topic 1")
+        response = self.client.get(f"{self.url}?page=1&name=topic 1")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json.loads(response.content)["count"], 1)
 
+    def test_filter_search(self):
+        response = self.client.get(f"{self.url}?search=topic")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)["count"], 2)
+
     def test_filter_folders(self):
-        response = self.client.get(f"{self.url}?folders={self.root_folder.pk}")
+        response = self.client.get(f"{self.url}?page=1&folders={self.root_folder.pk}")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json.loads(response.content)["count"], 1)
 
     def test_filter_documents(self):
-        response = self.client.get(f"{self.url}?documents={self.document1.pk}")
+        response = self.client.get(f"{self.url}?page=1&documents={self.document1.pk}")
         self.assertEqual(response.status_code, 200)
         self.assertEqual(json.loads(response.content)["count"], 1)
 
     def test_filter_created_at(self):
-        response = self.client.get(f"{self.url}?created_at_before=2020-01-15T19:58:21.942889Z")
+        response = self.client.get(f"{self.url}?page=1&created_at_before=2020-01-15T19:58:21.942889Z")
         self.assertEqual(response.status_code, 200)
         json_resp = json.loads(response.content)
         self.assertEqual(json_resp["count"], 1)
         self.assertEqual(json_resp["results"][0]["id"], str(self.topic1.pk))
 
     def test_filter_updated_at(self):
-        response = self.client.get(f"{self.url}?updated_at_before=2020-01-15T19:58:21.942889Z")
+        response = self.client.get(f"{self.url}?page=1&updated_at_before=2020-01-15T19:58:21.942889Z")
         json_resp = json.loads(response.content)
         self.assertEqual(json_resp["count"], 1)
         self.assertEqual(json_resp["results"][0]["id"], str(self.topic1.pk))
+
+
+class TopicApiBulkTestCase(TopicApiTestCase):
+    """
+    Integration tests for the Topic bulk endpoint
+    """
+    def setUp(self):
+        super().setUp()
+        self.client = Client()
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_bulk_create(self):
+        response = self.client.post(f"{self.url}bulk/", [
+            {"name": "a", "folders": [str(self.root_folder.pk)], "documents": []},
+            {"name": "b", "folders": [], "documents": [str(self.document1.pk), "nope"]},
+        ], format="json")
+        self.assertEqual(response.status_code, 207)
+        results = json.loads(response.content)
+        self.assertEqual(results[0]["status"], 201)
+        self.assertEqual(results[1]["status"], 400)
+        created = Topic.objects.get(pk=results[0]["id"])
+        self.assertEqual(list(created.folders.all()), [self.root_folder])
+
+    def test_bulk_duplicate_ids(self):
+        folder = str(self.root_folder.pk)
+        document = str(self.document1.pk)
+        response = self.client.post(f"{self.url}bulk/", [
+            {"name": "a", "folders": [folder, folder], "documents": [document, document]},
+        ], format="json")
+        self.assertEqual(response.status_code, 201)
+        created = Topic.objects.get(pk=json.loads(response.content)[0]["id"])
+        self.assertEqual(list(created.folders.all()), [self.root_folder])
+        self.assertEqual(list(created.documents.all()), [self.document1])
+
+        response = self.client.patch(f"{self.url}bulk/", [
+            {"id": str(created.pk), "folders": [folder, folder]},
+        ], format="json")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(created.folders.all()), [self.root_folder])
+
+    def test_bulk_update_not_found(self):
+        response = self.client.patch(f"{self.url}bulk/", [
+            {"id": str(self.topic1.pk), "name": "renamed"},
+            {"id": "6d8b1b51-9b6b-4e3f-8f0a-59a6c2d2a0f1", "name": "missing"},
+        ], format="json")
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(Topic.objects.get(pk=self.topic1.pk).name, "renamed")
+        self.assertEqual(list(self.topic1.documents.all()), [self.document1])
+
+    def test_bulk_requires_list(self):
+        response = self.client.post(f"{self.url}bulk/", {"name": "a"}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+
+class TopicApiConditionalGetTestCase(TopicApiTestCase):
+    """
+    Integration tests for conditional GETs at Topic endpoints
+    """
+    def test_detail_modified_by_document_topics(self):
+        url = f"{self.url}{self.topic1.pk}/"
+        etag = Client().get(url)["ETag"]
+
+        client = Client()
+        token, _ = Token.objects.get_or_create(user=self.user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        response = client.patch(f"/documents/{self.document2.pk}/", {
+            "topics": [str(self.topic1.pk)]
+        }, format="json")
+        self.assertEqual(response.status_code, 200)
+
+        response = Client().get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(str(self.document2.pk), json.loads(response.content)["documents"])
@@ -0,0 +1,100 @@
+import json
+import unittest
+from unittest.mock import patch
+from django.core.files.base import ContentFile
+from django.test import TestCase
+from rest_framework.test import APIClient as Client
+
+from documents import renderers
+from documents.models import Document, Folder, Topic
+from documents.views import DocumentViewSet, FolderViewSet, TopicViewSet
+
+
+class ValuesSerializerTestCase(TestCase):
+    """
+    Integration tests for the fast read path of the list endpoints
+    """
+    def setUp(self):
+        self.client = Client()
+
+        self.root_folder = Folder.add_root(name="root")
+        self.child_folder = Folder.objects.get(pk=self.root_folder.pk).add_child(name="child")
+        Folder.objects.get(pk=self.child_folder.pk).add_child(name="grandchild")
+        Folder.add_root(name="other", long_description="")
+
+        self.topic = Topic.objects.create(name="topic", long_description="ünïcode")
+        Topic.objects.create(name="empty")
+        self.topic.folders.add(self.root_folder, self.child_folder)
+        for i in range(12):
+            document = Document(name=f"doc {i}", folder=self.child_folder)
+            document.file.save(f"doc{i}.txt", ContentFile(b"lorem ipsum"))
+            document.save()
+            if i % 2:
+                document.topics.add(self.topic)
+
+    def assertSameAsModelSerializer(self, viewset, url):
+        fast = self.client.get(url)
+        self.assertEqual(fast.status_code, 200)
+        with patch.object(viewset, "values_serializer_class", None):
+            slow = self.client.get(url)
+        self.assertEqual(fast.content, slow.content)
+        return fast
+
+    def test_identical_output(self):
+        for viewset, url in [
+            (FolderViewSet, "/folders/"),
+            (DocumentViewSet, "/documents/"),
+            (TopicViewSet, "/topics/"),
+            (DocumentViewSet, "/documents/?page=2"),
+            (DocumentViewSet, "/documents/?fields=id,topics&omit=topics"),
+            (FolderViewSet, "/folders/?search=child"),
+        ]:
+            with self.subTest(url=url):
+                self.assertSameAsModelSerializer(viewset, url)
+
+    def test_cursor_pagination(self):
+        response = self.assertSameAsModelSerializer(DocumentViewSet, "/documents/")
+        next_url = json.loads(response.content)["next"]
+        self.assertSameAsModelSerializer(DocumentViewSet, next_url)
+
+    def test_falls_back_for_expanded_fields(self):
+        with patch("documents.values.ValuesSerializer.serialize") as serialize:
+            response = self.client.get("/documents/?expand=folder")
+        self.assertEqual(response.status_code, 200)
+        serialize.assert_not_called()
+        self.assertEqual(json.loads(response.content)["results"][0]["folder"]["name"], "child")
+
+    def test_fewer_queries(self):
+        # count, page, folder topics, then the parents and children
+        with self.assertNumQueries(5):
+            self.client.get("/folders/")
+
+
+class RendererTestCase(TestCase):
+    """
+    Integration tests for the orjson and MessagePack renderers
+    """
+    def setUp(self):
+        self.client = Client()
+        self.topic = Topic.objects.create(name="topic")
+
+    @unittest.skipIf(renderers.orjson is None, "orjson isn't installed")
+    def test_orjson(self):
+        response = self.client.get("/topics/?format=orjson")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/json")
+        default = self.client.get("/topics/")
+        self.assertEqual(json.loads(response.content), json.loads(default.content))
+        self.assertNotEqual(response["ETag"], default["ETag"])
+
+    @unittest.skipIf(renderers.msgpack is None, "msgpack isn't installed")
+    def test_msgpack(self):
+        response = self.client.get(f"/topics/{self.topic.pk}/", HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/msgpack")
+        self.assertEqual(renderers.msgpack.unpackb(response.content)["name"], "topic")
+
+    @unittest.skipIf(renderers.msgpack is not None, "msgpack is installed")
+    def test_msgpack_not_installed(self):
+        response = self.client.get(f"/topics/{self.topic.pk}/", HTTP_ACCEPT="application/msgpack")
+        self.assertEqual(response.status_code, 406)
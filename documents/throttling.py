@@ -0,0 +1,211 @@
+"""
+Token bucket throttles shared by every worker on a host.
+
+Each client has a bucket per scope that holds up to the scope's number of
+requests and refills continuously at its rate, so bursts are allowed up to
+the bucket size while the sustained rate is capped. Anonymous reads,
+authenticated reads and writes draw from separate buckets, with the rates
+in REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'].
+
+Requests don't all cost the same: views can weight their actions with
+`throttle_costs`, subtree filters cost extra, and so do page numbers deep
+enough to need a large OFFSET and bulk requests with many items.
+
+Anonymous clients are told apart by IP address. X-Forwarded-For is only
+trusted for the NUM_PROXIES proxies in REST_FRAMEWORK, since clients can
+send any address in it themselves.
+
+The buckets live in the `throttle` cache, a file-based cache by default, so
+the workers on a host share them without an external service. Updating a
+bucket holds an exclusive lock on a byte of a shared lock file, picked by
+the bucket's key, so two workers can't both spend the same tokens.
+BucketCache only checks whether the cache is full now and then, since
+Django's file-based cache lists its whole directory on every write, inside
+that lock.
+"""
+import hashlib
+import itertools
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import SimpleRateThrottle
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LOCK_FILE = os.path.join(tempfile.gettempdir(), 'spekit-throttle.lock')
+
+# How many independent locks the buckets are spread over
+LOCK_STRIPES = 256
+
+# Filters that query a whole branch of the folder tree
+SUBTREE_PARAMS = ['folder_subtree', 'ancestor_of', 'descendant_of']
+SUBTREE_COST = 2
+
+# Page numbers are served with an OFFSET, so every DEEP_PAGE_STEP pages
+# past the first costs one more
+DEEP_PAGE_STEP = 10
+
+# Every BULK_ITEMS_PER_TOKEN items in a /bulk/ request cost one more
+BULK_ITEMS_PER_TOKEN = 10
+
+UNSAFE_METHODS = ('POST', 'PUT', 'PATCH', 'DELETE')
+
+# BucketCache checks whether it's full every CULL_INTERVAL writes
+CULL_INTERVAL = 100
+
+_thread_lock = threading.Lock()
+_lock_file = None
+
+
+def is_enabled():
+    return bool(settings.THROTTLE_ENABLED)
+
+
+def get_cache():
+    return caches['throttle']
+
+
+class BucketCache(FileBasedCache):
+    """
+    A FileBasedCache that lists its directory to see whether it needs culling
+    every CULL_INTERVAL writes in each process, rather than on every write.
+    It can hold more than MAX_ENTRIES entries in between.
+    """
+    def __init__(self, dir, params):
+        super().__init__(dir, params)
+        self._writes = itertools.count(1)
+
+    def _cull(self):
+        if next(self._writes) % CULL_INTERVAL == 0:
+            super()._cull()
+
+
+@contextmanager
+def bucket_lock(key):
+    """
+    Holds an exclusive lock on the bucket `key`, across threads and processes.
+    """
+    global _lock_file
+    with _thread_lock:
+        if fcntl is None:
+            yield
+            return
+        if _lock_file is None:
+            _lock_file = open(LOCK_FILE, 'a+b')
+        stripe = int(hashlib.md5(key.encode()).hexdigest(), 16) % LOCK_STRIPES
+        fcntl.lockf(_lock_file, fcntl.LOCK_EX, 1, stripe)
+        try:
+            yield
+        finally:
+            fcntl.lockf(_lock_file, fcntl.LOCK_UN, 1, stripe)
+
+
+def take(key, cost, capacity, duration):
+    """
+    Takes `cost` tokens from the bucket `key`, which holds up to `capacity`
+    tokens and refills completely in `duration` seconds.
+
+    Returns 0 if there were enough tokens, or else how many seconds until
+    there will be, in which case none are taken.
+    """
+    cost = min(cost, capacity)
+    per_second = capacity / duration
+    cache = get_cache()
+    with bucket_lock(key):
+        now = time.time()
+        tokens, updated_at = cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + max(now - updated_at, 0) * per_second)
+        if tokens < cost:
+            return (cost - tokens) / per_second
+        cache.set(key, (tokens - cost, now), timeout=duration)
+    return 0
+
+
+def get_cost(request, view):
+    """
+    Returns how many tokens `request` costs.
+    """
+    cost = getattr(view, 'throttle_costs', {}).get(getattr(view, 'action', None), 1)
+    cost += SUBTREE_COST * sum(param in request.query_params for param in SUBTREE_PARAMS)
+    try:
+        page = int(request.query_params.get('page', 1))
+    except ValueError:
+        page = 1
+    cost += max(page - 1, 0) // DEEP_PAGE_STEP
+    if getattr(view, 'action', None) == 'bulk' and isinstance(request.data, list):
+        cost += len(request.data) // BULK_ITEMS_PER_TOKEN
+    return cost
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    A SimpleRateThrottle with a token bucket in the `throttle` cache rather
+    than a request history in the default cache.
+
+    Subclasses narrow down the requests they throttle with `methods` and
+    `authenticated`.
+    """
+    cache_format = 'throttle:%(scope)s:%(ident)s'
+
+    # The request methods that are throttled, or None for every method
+    methods = None
+
+    # Whether only authenticated (True) or anonymous (False) clients are
+    # throttled, or None for both
+    authenticated = None
+
+    def applies(self, request):
+        if self.methods is not None and request.method not in self.methods:
+            return False
+        if self.authenticated is not None:
+            return bool(request.user and request.user.is_authenticated) == self.authenticated
+        return True
+
+    def get_cache_key(self, request, view):
+        if not self.applies(request):
+            return None
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def allow_request(self, request, view):
+        self.delay = 0
+        if self.rate is None or not is_enabled():
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+        self.delay = take(key, get_cost(request, view), self.num_requests, self.duration)
+        return not self.delay
+
+    def wait(self):
+        return self.delay
+
+
+class AnonReadThrottle(TokenBucketThrottle):
+    scope = 'anon_read'
+    methods = SAFE_METHODS
+    authenticated = False
+
+
+class UserReadThrottle(TokenBucketThrottle):
+    scope = 'user_read'
+    methods = SAFE_METHODS
+    authenticated = True
+
+
+class WriteThrottle(TokenBucketThrottle):
+    scope = 'write'
+    methods = UNSAFE_METHODS
@@ -0,0 +1,340 @@
+"""
+Multi-topic filtering for documents: `topics_all`, `topics_any` and
+`topics_none`.
+
+By default each filter compiles to a single subquery over the topics through
+table. `topics_all` groups the links by document and keeps the documents
+linked to every topic, rather than joining the through table once per topic.
+
+Set TOPIC_INDEX_ENABLED to also keep an in-memory index in each process that
+maps every topic to a bitmap of the documents it tags. Each document gets an
+ordinal, and each bitmap is a Python int with the ordinals' bits set, so the
+filters become bitwise ANDs and ORs. The database is then only asked for the
+matching primary keys, and only when there are few enough of them.
+
+The index is built from a single query the first time it's used, and kept
+fresh in place from `m2m_changed` and `post_delete`, and from the bulk
+writes that bypass them, once the transaction that changed the links
+commits. Every change bumps a generation counter in the shared response
+cache and is logged there under its generation, as a list of TopicIndex
+method calls. A worker that notices the counter moved on without it replays
+the changes it missed, and only rebuilds its index if some have been
+evicted, if it has fallen too far behind or if its index is old enough that
+changes logged out of commit order could have left it out of date. With
+several workers, the `responses` cache has to be a shared backend for that
+to work.
+"""
+import random
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.db.models.signals import m2m_changed, post_delete
+
+from documents.cache import get_cache
+from documents.models import Document, Topic
+from documents.replicas import read_from_primary
+
+GENERATION_KEY = 'documents:topic_index:generation'
+
+CHANGE_KEY = 'documents:topic_index:change:%s'
+
+# Above this many primary keys, filter with a subquery rather than a list
+MAX_INDEXED_PKS = 500
+
+# A worker that missed more changes than this rebuilds its index rather
+# than replaying them
+MAX_REPLAYED_CHANGES = 1000
+
+# Rebuild an index that is older than this many seconds rather than replay
+# changes into it
+REBUILD_AFTER = 600
+
+
+def is_enabled():
+    return bool(settings.TOPIC_INDEX_ENABLED)
+
+
+def get_links():
+    return Topic.documents.through.objects.all()
+
+
+def get_generation():
+    cache = get_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        # Start somewhere random, so a counter that was evicted can't come
+        # back at a value some worker has already seen
+        cache.add(GENERATION_KEY, random.randrange(1 << 32), timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def get_change_key(generation):
+    return CHANGE_KEY % generation
+
+
+def next_generation():
+    try:
+        return get_cache().incr(GENERATION_KEY)
+    except ValueError:
+        # The counter was evicted, so start a new one
+        return get_generation()
+
+
+class TopicIndex:
+    """
+    Maps topics to bitmaps of the documents they tag.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.generation = None
+        self.built_at = None
+        self.ordinals = {}
+        self.pks = []
+        self.bitmaps = {}
+
+    def build(self, generation):
+        self.ordinals = {}
+        self.pks = []
+        self.bitmaps = {}
+        for topic_id, document_id in get_links().values_list('topic_id', 'document_id').iterator():
+            self.bitmaps[topic_id] = self.bitmaps.get(topic_id, 0) | (1 << self.get_ordinal(document_id))
+        self.generation = generation
+        self.built_at = time.monotonic()
+
+    def get_ordinal(self, pk):
+        ordinal = self.ordinals.get(pk)
+        if ordinal is None:
+            ordinal = self.ordinals[pk] = len(self.pks)
+            self.pks.append(pk)
+        return ordinal
+
+    def get_mask(self, pks):
+        mask = 0
+        for pk in pks:
+            mask |= 1 << self.get_ordinal(pk)
+        return mask
+
+    def add(self, topic_id, document_ids):
+        self.bitmaps[topic_id] = self.bitmaps.get(topic_id, 0) | self.get_mask(document_ids)
+
+    def remove(self, topic_id, document_ids):
+        if topic_id in self.bitmaps:
+            self.bitmaps[topic_id] &= ~self.get_mask(document_ids)
+
+    def remove_topic(self, topic_id):
+        self.bitmaps.pop(topic_id, None)
+
+    def remove_documents(self, document_ids):
+        mask = 0
+        for document_id in document_ids:
+            ordinal = self.ordinals.pop(document_id, None)
+            if ordinal is not None:
+                # The ordinal isn't reused until the index is next rebuilt
+                self.pks[ordinal] = None
+                mask |= 1 << ordinal
+        if mask:
+            for topic_id in self.bitmaps:
+                self.bitmaps[topic_id] &= ~mask
+
+    def match_all(self, topic_ids):
+        bitmaps = [self.bitmaps.get(topic_id, 0) for topic_id in topic_ids]
+        result = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            result &= bitmap
+        return result
+
+    def match_any(self, topic_ids):
+        result = 0
+        for topic_id in topic_ids:
+            result |= self.bitmaps.get(topic_id, 0)
+        return result
+
+    def get_pks(self, bitmap, limit=None):
+        """
+        Returns the primary keys of the documents in `bitmap`, or None if
+        there are more than `limit` of them.
+        """
+        if limit is not None and bin(bitmap).count('1') > limit:
+            return None
+        pks = []
+        while bitmap:
+            low = bitmap & -bitmap
+            pks.append(self.pks[low.bit_length() - 1])
+            bitmap ^= low
+        return pks
+
+    def apply_changes(self, changes):
+        """
+        Applies `changes`, a list of `(method name, *args)` tuples.
+        """
+        for method, *args in changes:
+            getattr(self, method)(*args)
+
+    def apply(self, generation, changes):
+        """
+        Applies `changes` to the index, which moved the shared generation on
+        to `generation`. If other changes were made in between, the index is
+        left as it is, to catch up with all of them in order when it's next
+        used.
+        """
+        with self.lock:
+            if self.generation is not None and self.generation + 1 == generation:
+                self.apply_changes(changes)
+                self.generation = generation
+
+    def catch_up(self, generation):
+        """
+        Brings the index up to `generation`, by replaying the changes logged
+        since its own generation if it can, and by rebuilding it otherwise.
+        """
+        with self.lock:
+            if self.generation == generation:
+                return
+            behind = generation - self.generation if self.generation is not None else 0
+            if 0 < behind <= MAX_REPLAYED_CHANGES and time.monotonic() - self.built_at < REBUILD_AFTER:
+                keys = [get_change_key(missed) for missed in range(self.generation + 1, generation + 1)]
+                logged = get_cache().get_many(keys)
+                if len(logged) == len(keys):
+                    for key in keys:
+                        self.apply_changes(logged[key])
+                    self.generation = generation
+                    return
+            # A replica may not have the changes that moved the generation on
+            with read_from_primary():
+                self.build(generation)
+
+
+index = TopicIndex()
+
+
+def get_index():
+    """
+    Returns the index, bringing it up to date first if it's stale.
+    """
+    index.catch_up(get_generation())
+    return index
+
+
+def changed(changes=None):
+    """
+    Applies `changes`, a list of `(TopicIndex method name, *args)` tuples,
+    to this process's index once the current transaction commits, and logs
+    them for the other processes. Without `changes`, every index is rebuilt.
+    """
+    if is_enabled():
+        transaction.on_commit(partial(_changed, changes))
+
+
+def _changed(changes):
+    generation = next_generation()
+    if changes is None:
+        with index.lock:
+            index.generation = None
+        return
+    get_cache().set(get_change_key(generation), changes)
+    index.apply(generation, changes)
+
+
+def links_changed(removed=(), added=()):
+    """
+    Like changed(), for the `(topic_id, document_id)` links that were
+    `removed` and then `added`.
+    """
+    changes = []
+    for method, links in (('remove', removed), ('add', added)):
+        by_topic = {}
+        for topic_id, document_id in links:
+            by_topic.setdefault(topic_id, []).append(document_id)
+        changes.extend((method, topic_id, document_ids) for topic_id, document_ids in by_topic.items())
+    if changes:
+        changed(changes)
+
+
+def topic_links_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action == 'pre_clear':
+        # The links are gone by post_clear, so find out which they are now
+        own = 'document_id' if reverse else 'topic_id'
+        links_changed(removed=sender.objects.filter(**{own: instance.pk}).values_list('topic_id', 'document_id'))
+        return
+    if action not in ('post_add', 'post_remove'):
+        return
+
+    if reverse:
+        # document.topics.add(*topics)
+        links = [(topic_id, instance.pk) for topic_id in pk_set]
+    else:
+        # topic.documents.add(*documents)
+        links = [(instance.pk, document_id) for document_id in pk_set]
+
+    if action == 'post_add':
+        links_changed(added=links)
+    else:
+        links_changed(removed=links)
+
+
+def document_deleted(sender, instance, **kwargs):
+    changed([('remove_documents', [instance.pk])])
+
+
+def topic_deleted(sender, instance, **kwargs):
+    changed([('remove_topic', instance.pk)])
+
+
+def connect_signals():
+    m2m_changed.connect(topic_links_changed, sender=Topic.documents.through)
+    post_delete.connect(document_deleted, sender=Document)
+    post_delete.connect(topic_deleted, sender=Topic)
+
+
+def filter_topics_all(queryset, topic_ids):
+    """
+    Filters `queryset` down to the documents tagged with every one of
+    `topic_ids`.
+    """
+    topic_ids = set(topic_ids)
+    pks = get_indexed_pks(TopicIndex.match_all, topic_ids)
+    if pks is not None:
+        return queryset.filter(pk__in=pks)
+
+    matches = get_links().filter(topic_id__in=topic_ids).values('document_id').annotate(
+        topic_count=Count('topic_id', distinct=True)
+    ).filter(topic_count=len(topic_ids)).values('document_id')
+    return queryset.filter(pk__in=matches)
+
+
+def filter_topics_any(queryset, topic_ids):
+    """
+    Filters `queryset` down to the documents tagged with any of `topic_ids`.
+    """
+    pks = get_indexed_pks(TopicIndex.match_any, topic_ids)
+    if pks is not None:
+        return queryset.filter(pk__in=pks)
+    return queryset.filter(pk__in=get_links().filter(topic_id__in=topic_ids).values('document_id'))
+
+
+def filter_topics_none(queryset, topic_ids):
+    """
+    Filters `queryset` down to the documents tagged with none of `topic_ids`.
+    """
+    pks = get_indexed_pks(TopicIndex.match_any, topic_ids)
+    if pks is not None:
+        return queryset.exclude(pk__in=pks)
+    return queryset.exclude(pk__in=get_links().filter(topic_id__in=topic_ids).values('document_id'))
+
+
+def get_indexed_pks(match, topic_ids):
+    """
+    Returns the primary keys of the documents that `match` `topic_ids`
+    according to the index, or None if the index is disabled or there are
+    too many of them to filter by.
+    """
+    if not is_enabled():
+        return None
+    index = get_index()
+    with index.lock:
+        return index.get_pks(match(index, list(topic_ids)), limit=MAX_INDEXED_PKS)
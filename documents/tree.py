@@ -0,0 +1,525 @@
+"""
+Helpers for working with the Folder materialized path tree in bulk.
+
+treebeard's node API is built around one node at a time: get_parent() and
+get_children() each issue their own query. These helpers work on whole
+collections of folders instead, deriving the tree relationships directly
+from the denormalized `path` and `depth` columns.
+"""
+import operator
+from functools import reduce
+
+from django.db import transaction
+from django.db.models import Exists, ExpressionWrapper, F, Func, IntegerField, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Concat, Substr
+from django.utils import timezone
+from treebeard.exceptions import InvalidMoveToDescendant, PathOverflow
+
+from documents.bulk import set_related_in_bulk
+from documents.cache import invalidate, invalidate_folder_paths
+from documents.models import Document, Folder, Topic
+
+
+def prefetch_tree(folders):
+    """
+    Resolves the parent and children of every folder in `folders` using a
+    constant number of queries (at most two), regardless of how many folders
+    are given.
+
+    The parent is stored in treebeard's own `_cached_parent_obj` cache, so
+    get_parent() won't hit the database afterward. The children are stored
+    in `_cached_children`, which is read by Folder.get_cached_children().
+    """
+    folders = list(folders)
+
+    parent_paths = {
+        Folder._get_parent_path_from_path(folder.path)
+        for folder in folders
+        if folder.depth > 1
+    }
+    parents = {}
+    if parent_paths:
+        parents = {
+            parent.path: parent
+            for parent in Folder.objects.filter(path__in=parent_paths)
+        }
+
+    # Leaf nodes can't have children, so we don't need to look for them
+    branches = [(folder.path, folder.depth) for folder in folders if not folder.is_leaf()]
+    children = {folder.path: [] for folder in folders}
+    if branches:
+        for child in Folder.objects.filter(children_q(branches)).order_by('path'):
+            children[Folder._get_parent_path_from_path(child.path)].append(child)
+
+    for folder in folders:
+        if folder.depth > 1:
+            folder._cached_parent_obj = parents.get(
+                Folder._get_parent_path_from_path(folder.path)
+            )
+        folder._cached_children = children[folder.path]
+
+    return folders
+
+
+def children_q(branches):
+    """
+    Returns a Q object matching the children of the folders at the `(path,
+    depth)` pairs in `branches`.
+    """
+    return reduce(operator.or_, [
+        Q(depth=depth + 1, path__range=Folder._get_children_path_interval(path))
+        for path, depth in branches
+    ])
+
+
+def get_tree_pks(rows):
+    """
+    Like prefetch_tree(), for rows from values() with `path`, `depth` and
+    `numchild` keys. Returns a dictionary mapping the path of every row to
+    its parent's pk, and another mapping it to its children's pks, in at
+    most two queries.
+    """
+    parent_paths = {
+        Folder._get_parent_path_from_path(row['path'])
+        for row in rows
+        if row['depth'] > 1
+    }
+    pks = {}
+    if parent_paths:
+        pks = dict(Folder.objects.filter(path__in=parent_paths).values_list('path', 'pk'))
+    parents = {
+        row['path']: pks.get(Folder._get_parent_path_from_path(row['path']))
+        for row in rows
+        if row['depth'] > 1
+    }
+
+    branches = [(row['path'], row['depth']) for row in rows if row['numchild']]
+    children = {row['path']: [] for row in rows}
+    if branches:
+        for path, pk in Folder.objects.filter(children_q(branches)).order_by('path').values_list('path', 'pk'):
+            children[Folder._get_parent_path_from_path(path)].append(pk)
+
+    return parents, children
+
+
+def prefetch_ancestors(folders):
+    """
+    Resolves the ancestors of every folder in `folders` with a single query,
+    by looking up every ancestor path prefix at once, and stores them (root
+    first) in `_cached_ancestors`, which is read by
+    Folder.get_cached_ancestors().
+    """
+    folders = list(folders)
+
+    paths = {
+        path
+        for folder in folders
+        for path in Folder.get_ancestor_paths(folder.path)
+    }
+    ancestors = {}
+    if paths:
+        ancestors = {
+            ancestor.path: ancestor
+            for ancestor in Folder.objects.filter(path__in=paths)
+        }
+
+    for folder in folders:
+        folder._cached_ancestors = [
+            ancestors[path]
+            for path in Folder.get_ancestor_paths(folder.path)
+            if path in ancestors
+        ]
+
+    return folders
+
+
+def subtree_q(pk, max_depth=None, prefix=''):
+    """
+    Returns a Q object matching the folder with primary key `pk` and all of
+    its descendants, optionally no more than `max_depth` levels below it.
+    `prefix` is prepended to the lookups, e.g. 'folder__' to match the
+    documents inside the branch.
+
+    The folder's path is looked up in a subquery, and the branch is matched
+    as a range of paths rather than with LIKE, so the whole filter compiles
+    to a single query that can use the index on `path`.
+    """
+    folder = Folder.objects.filter(pk=pk)
+    path = Subquery(folder.values('path')[:1])
+    last_path = Concat(path, Value(Folder.alphabet[-1] * Folder._meta.get_field('path').max_length))
+
+    q = Q(**{f'{prefix}path__gte': path, f'{prefix}path__lte': last_path})
+    if max_depth is not None:
+        depth = ExpressionWrapper(
+            Subquery(folder.values('depth')[:1]) + max_depth,
+            output_field=IntegerField()
+        )
+        q &= Q(**{f'{prefix}depth__lte': depth})
+    return q
+
+
+def descendants_q(pk, max_depth=None, prefix=''):
+    """
+    Like subtree_q(), without the folder itself.
+    """
+    return subtree_q(pk, max_depth, prefix) & ~Q(**{f'{prefix}pk': pk})
+
+
+def ancestors_q(pk, levels=None):
+    """
+    Returns an expression matching the ancestors of the folder with primary
+    key `pk`, or only its ancestor `levels` levels up (e.g. 1 for its
+    parent).
+
+    An ancestor's path is a prefix of its descendants' paths, so this is an
+    EXISTS subquery that compares each folder's path against the given
+    folder's, rather than walking up the tree one query at a time.
+    """
+    depth = {'depth__gt': OuterRef('depth')}
+    if levels is not None:
+        depth = {'depth': OuterRef('depth') + levels}
+    return Exists(Folder.objects.filter(pk=pk, path__startswith=OuterRef('path'), **depth))
+
+
+def get_subtree(parent=None, max_depth=None, document_counts=False):
+    """
+    Returns the branch under `parent` as nested dictionaries, or the whole
+    forest as a list of them if `parent` is None.
+
+    The tree is assembled in memory from a single `path__startswith` query.
+    `max_depth` limits how many levels below `parent` (or below the top of
+    the forest) are included. If `document_counts` is True, every node also
+    has its `document_count` and `descendant_document_count`.
+    """
+    queryset = Folder.objects.order_by('path')
+    depth = 0
+    if parent is not None:
+        queryset = queryset.filter(path__startswith=parent.path)
+        depth = parent.depth
+    if max_depth is not None:
+        queryset = queryset.filter(depth__lte=depth + max_depth)
+
+    fields = ['id', 'name', 'long_description', 'created_at', 'updated_at']
+    if document_counts:
+        fields += ['document_count', 'descendant_document_count']
+    queryset = queryset.values('path', *fields)
+
+    nodes = {}
+    top_level = []
+    for row in queryset:
+        path = row.pop('path')
+        node = {**row, 'children': []}
+        nodes[path] = node
+
+        parent_node = nodes.get(Folder._get_parent_path_from_path(path))
+        if parent_node is None:
+            top_level.append(node)
+        else:
+            parent_node['children'].append(node)
+
+    if parent is not None:
+        return top_level[0] if top_level else None
+    return top_level
+
+
+def get_next_child_path(parent):
+    """
+    Returns the path for a new last child of `parent`, or for a new last root
+    node if `parent` is None.
+
+    Siblings are unordered in the document store, so appending at the end
+    means no other branch ever needs to be shifted to make room.
+    """
+    parent_path = parent.path if parent else ''
+    depth = parent.depth + 1 if parent else 1
+
+    last_child = Folder.objects.filter(
+        depth=depth,
+        path__range=Folder._get_children_path_interval(parent_path)
+    ).order_by('-path').first()
+
+    if last_child:
+        return last_child._inc_path()
+
+    path = Folder._get_path(parent_path, depth, 1)
+    if len(path) > Folder._meta.get_field('path').max_length:
+        raise PathOverflow("The new node is too deep in the tree.")
+    return path
+
+
+def get_last_root_pk():
+    """
+    Returns the pk of the last root node, or None if the tree is empty.
+    """
+    return Folder.objects.filter(depth=1).order_by('-path').values_list('pk', flat=True).first()
+
+
+def is_last_root(root):
+    """
+    Returns whether `root` is still the last root node, or, if it's None,
+    whether the tree is still empty.
+    """
+    later = Folder.objects.filter(depth=1)
+    if root is not None:
+        later = later.filter(path__gt=root.path)
+    return not later.exists()
+
+
+def lock_last_root():
+    """
+    Locks and returns the last root node, or returns None if the tree is
+    empty.
+
+    Root nodes have no parent to lock while a new root path is allocated, so
+    the last root is locked instead: a transaction adding another root waits
+    for the previous one to commit before picking the next path. The last
+    root is looked up again once it's locked, since another root may have
+    been added after it in the meantime, in which case that one is locked.
+    """
+    while True:
+        root = Folder.objects.select_for_update().filter(pk=get_last_root_pk()).first()
+        if is_last_root(root):
+            return root
+
+
+def allocate_child_paths(parent, count):
+    """
+    Returns `count` consecutive paths for new last children of `parent`, or
+    for new last root nodes if `parent` is None.
+    """
+    first = get_next_child_path(parent)
+    depth = len(first) // Folder.steplen
+    start = Folder._str2int(first[-Folder.steplen:])
+
+    paths = [Folder._get_path(first, depth, start + i) for i in range(count)]
+    if paths and len(paths[-1]) > len(first):
+        raise PathOverflow(f"Path Overflow from: '{first}'")
+    return paths
+
+
+def add_folders(folders):
+    """
+    Adds unsaved folders to the tree in bulk. `folders` is a list of
+    `(parent, folder)` pairs, where `parent` is None for new root nodes.
+
+    Paths are allocated for all the children of each parent at once, the
+    parents are locked while their numchild counters are bumped, and the
+    folders are inserted with a single bulk_create().
+
+    Returns the list of folders.
+    """
+    groups = {}
+    for parent, folder in folders:
+        groups.setdefault(parent.pk if parent else None, []).append(folder)
+
+    with transaction.atomic():
+        if None in groups:
+            lock_last_root()
+        parents = Folder.objects.select_for_update().in_bulk([pk for pk in groups if pk is not None])
+
+        for pk, children in groups.items():
+            parent = parents[pk] if pk is not None else None
+            for folder, path in zip(children, allocate_child_paths(parent, len(children))):
+                folder.path = path
+                folder.depth = len(path) // Folder.steplen
+            if parent:
+                Folder.objects.filter(pk=pk).update(
+                    numchild=F('numchild') + len(children),
+                    children_updated_at=timezone.now()
+                )
+
+        folders = Folder.objects.bulk_create([folder for _, folder in folders])
+        invalidate(Folder, [pk for pk in groups if pk is not None])
+        return folders
+
+
+def import_folders(nodes, parent=None, batch_size=1000):
+    """
+    Builds whole new branches of folders under `parent` (or as new root
+    nodes if `parent` is None) in one pass.
+
+    `nodes` is a list of dictionaries with `name`, `long_description`,
+    `topics` (a list of topic pks) and `children` (a list of nodes) keys.
+
+    Unlike treebeard's load_bulk(), which adds every node with its own
+    add_child() call, every path is computed up front: the new branches
+    start at fresh slots under `parent`, so the children of each new node are
+    simply numbered from one. The folders and their topic links are then
+    inserted with bulk_create().
+
+    Returns the list of new top-level folders.
+    """
+    max_length = Folder._meta.get_field('path').max_length
+
+    with transaction.atomic():
+        if parent is not None:
+            parent = Folder.objects.select_for_update().get(pk=parent.pk)
+        else:
+            lock_last_root()
+
+        paths = allocate_child_paths(parent, len(nodes))
+        stack = list(zip(paths, nodes))[::-1]
+        folders, links = [], {}
+
+        while stack:
+            path, node = stack.pop()
+            depth = len(path) // Folder.steplen
+            children = node.get('children', [])
+
+            folder = Folder(
+                name=node['name'],
+                long_description=node.get('long_description', ''),
+                path=path,
+                depth=depth,
+                numchild=len(children)
+            )
+            folders.append(folder)
+            if node.get('topics'):
+                # A topic listed twice is still only linked once
+                links[folder.pk] = [Topic(pk=pk) for pk in dict.fromkeys(node['topics'])]
+
+            for index in range(len(children) - 1, -1, -1):
+                child_path = Folder._get_path(path, depth + 1, index + 1)
+                if len(child_path) > max_length or len(child_path) != (depth + 1) * Folder.steplen:
+                    raise PathOverflow(f"Path Overflow from: '{path}'")
+                stack.append((child_path, children[index]))
+
+        Folder.objects.bulk_create(folders, batch_size=batch_size)
+        set_related_in_bulk(Folder, 'topics', links, batch_size=batch_size)
+
+        if parent is not None:
+            Folder.objects.filter(pk=parent.pk).update(
+                numchild=F('numchild') + len(nodes),
+                children_updated_at=timezone.now()
+            )
+        invalidate(Folder, [parent.pk] if parent is not None else [])
+
+    top_level = set(paths)
+    return [folder for folder in folders if folder.path in top_level]
+
+
+def move_folder(folder, parent):
+    """
+    Moves `folder` and its whole branch under `parent`, or to the root of the
+    tree if `parent` is None.
+
+    Only the rows in the moved branch have their paths rewritten, along with
+    the numchild counters of the old and new parents. Everything happens in a
+    single transaction, with the moved folder and its new parent locked so
+    that concurrent moves can't hand out the same path twice (the last root
+    stands in for the parent of a move to the root). If the folder
+    is already under `parent`, nothing is written.
+
+    Returns the moved folder, freshly loaded from the database.
+    """
+    with transaction.atomic():
+        while True:
+            pks = [folder.pk, get_last_root_pk() if parent is None else parent.pk]
+            locked = {
+                node.pk: node
+                for node in Folder.objects.select_for_update().filter(pk__in=pks).order_by('pk')
+            }
+            # Another root may have been added while waiting for the locks
+            if parent is not None or is_last_root(locked.get(pks[1])):
+                break
+        node = locked[folder.pk]
+        target = locked[parent.pk] if parent is not None else None
+
+        old_parent_path = Folder._get_parent_path_from_path(node.path)
+        new_parent_path = target.path if target else ''
+        if old_parent_path == new_parent_path:
+            return node
+
+        if target and target.path.startswith(node.path):
+            raise InvalidMoveToDescendant("Can't move node to a descendant.")
+
+        # Lock the rest of the branch, finding out how deep it goes as we do
+        branch_depths = list(
+            Folder.objects.select_for_update()
+            .filter(path__startswith=node.path)
+            .values_list('depth', flat=True)
+        )
+
+        new_path = get_next_child_path(target)
+        height = (max(branch_depths) - node.depth) * Folder.steplen
+        if len(new_path) + height > Folder._meta.get_field('path').max_length:
+            raise PathOverflow("The moved branch is too deep for its new parent.")
+
+        Folder.objects.filter(path__startswith=node.path).update(
+            path=Concat(Value(new_path), Substr('path', len(node.path) + 1)),
+            depth=F('depth') + (len(new_path) - len(node.path)) // Folder.steplen
+        )
+
+        # Carry the branch's documents from the old ancestors to the new ones
+        total = node.document_count + node.descendant_document_count
+        if total:
+            below = {}
+            for path in Folder.get_ancestor_paths(node.path):
+                below[path] = below.get(path, 0) - total
+            for path in Folder.get_ancestor_paths(new_path):
+                below[path] = below.get(path, 0) + total
+            Folder.apply_document_count_deltas({}, below)
+
+        # The folder's parent and both parents' children have changed
+        now = timezone.now()
+        Folder.objects.filter(pk=node.pk).update(updated_at=now)
+        if old_parent_path:
+            Folder.objects.filter(path=old_parent_path).update(
+                numchild=F('numchild') - 1,
+                children_updated_at=now
+            )
+        if new_parent_path:
+            Folder.objects.filter(path=new_parent_path).update(
+                numchild=F('numchild') + 1,
+                children_updated_at=now
+            )
+
+        invalidate(Folder, [node.pk] + ([target.pk] if target else []))
+        if old_parent_path:
+            invalidate_folder_paths([old_parent_path])
+        # The branch's documents now match different folder_subtree filters
+        invalidate(Document)
+
+        return Folder.objects.get(pk=node.pk)
+
+
+def document_deleted(sender, instance, **kwargs):
+    Folder.adjust_document_counts({instance.folder_id: -1})
+
+
+def repair_document_counts(dry_run=False):
+    """
+    Recomputes the document counts of every folder whose stored counts have
+    drifted from the documents actually in the store, and returns how many
+    there were. If `dry_run` is True, nothing is written.
+    """
+    def count(documents):
+        return Subquery(
+            documents.order_by().annotate(count=Func(F('pk'), function='COUNT')).values('count'),
+            output_field=IntegerField()
+        )
+
+    document_count = count(Document.objects.filter(folder=OuterRef('pk')))
+    descendant_document_count = count(Document.objects.filter(
+        folder__path__startswith=OuterRef('path'),
+        folder__depth__gt=OuterRef('depth')
+    ))
+
+    drifted = Folder.objects.annotate(
+        expected_document_count=document_count,
+        expected_descendant_document_count=descendant_document_count
+    ).exclude(
+        document_count=F('expected_document_count'),
+        descendant_document_count=F('expected_descendant_document_count')
+    )
+    pks = list(drifted.values_list('pk', flat=True))
+
+    if pks and not dry_run:
+        # Recount as part of the UPDATE itself, so documents added or removed
+        # since the rows were found are counted too
+        Folder.objects.filter(pk__in=pks).update(
+            document_count=document_count,
+            descendant_document_count=descendant_document_count
+        )
+
+    return len(pks)
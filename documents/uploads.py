@@ -0,0 +1,340 @@
+"""
+Direct-to-storage uploads for Document files.
+
+Instead of streaming a file through the API, clients ask for an upload target,
+PUT the file straight to storage, and then finalize the Document with the
+signed `upload` token they were given. The API only ever handles metadata.
+
+In production the target is a presigned S3 URL. When files are stored on the
+local filesystem (in development and in the tests), the target is an endpoint
+on the API itself that accepts the file in place of S3.
+
+Very large files can instead be sent in parts with a resumable multipart
+upload: initiate it, PUT each part, then complete it to create the Document
+(or abort it). Parts map onto an S3 multipart upload, or onto part files in a
+scratch directory on the local filesystem. Either way, the API holds at most
+one part in memory at a time.
+"""
+import hashlib
+import os
+import shutil
+import uuid
+
+from botocore.exceptions import ClientError
+from django.core import signing
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.urls import reverse
+from django.utils.text import get_valid_filename
+from storages.backends.s3boto3 import S3Boto3Storage
+
+UPLOAD_PREFIX = 'uploads'
+
+# How long clients have to upload a file and finalize its Document
+UPLOAD_EXPIRES_IN = 60 * 60
+
+UPLOAD_TOKEN_SALT = 'documents.uploads'
+
+# How long clients have to upload every part of a multipart upload and
+# complete it
+MULTIPART_EXPIRES_IN = 24 * 60 * 60
+
+MULTIPART_TOKEN_SALT = 'documents.uploads.multipart'
+
+# S3 allows up to 10,000 parts of up to 5GB, but every part passes through
+# the API, so keep them small enough to buffer one
+MULTIPART_MAX_PARTS = 10000
+MULTIPART_MAX_PART_SIZE = 64 * 1024 * 1024
+
+# Where local multipart uploads keep their parts, relative to MEDIA_ROOT
+MULTIPART_SCRATCH_DIR = '.multipart'
+
+
+class UploadError(Exception):
+    pass
+
+
+class UploadNotFound(UploadError):
+    pass
+
+
+def new_upload_key(filename, max_length=100):
+    """
+    Returns a new, unique storage key for a file called `filename`, no longer
+    than `max_length` characters.
+    """
+    prefix = f'{UPLOAD_PREFIX}/{uuid.uuid4()}/'
+    name, ext = os.path.splitext(get_valid_filename(os.path.basename(filename)))
+    name = name[:max(max_length - len(prefix) - len(ext), 1)]
+    return f'{prefix}{name}{ext}'
+
+
+def make_upload_token(key, user):
+    """
+    Signs the storage `key` of an upload on behalf of `user`.
+    """
+    return signing.dumps({'key': key, 'user': str(user.pk)}, salt=UPLOAD_TOKEN_SALT)
+
+
+def read_upload_token(token, user=None):
+    """
+    Returns the storage key signed into `token`.
+
+    Raises signing.SignatureExpired if the token is older than
+    UPLOAD_EXPIRES_IN, or signing.BadSignature if it is invalid or, when
+    `user` is given, was issued to someone else.
+    """
+    return _load_token(token, UPLOAD_TOKEN_SALT, UPLOAD_EXPIRES_IN, user)['key']
+
+
+def make_multipart_token(key, upload_id, user):
+    """
+    Signs the storage `key` and `upload_id` of a multipart upload on behalf
+    of `user`.
+    """
+    return signing.dumps(
+        {'key': key, 'upload_id': upload_id, 'user': str(user.pk)},
+        salt=MULTIPART_TOKEN_SALT
+    )
+
+
+def read_multipart_token(token, user):
+    """
+    Returns the `(key, upload_id)` signed into `token`. Raises like
+    read_upload_token().
+    """
+    payload = _load_token(token, MULTIPART_TOKEN_SALT, MULTIPART_EXPIRES_IN, user)
+    return payload['key'], payload['upload_id']
+
+
+def _load_token(token, salt, max_age, user):
+    payload = signing.loads(token, salt=salt, max_age=max_age)
+    if user is not None and payload['user'] != str(user.pk):
+        raise signing.BadSignature('The upload belongs to another user.')
+    return payload
+
+
+class UploadBackend:
+    """
+    Issues upload targets for a storage backend.
+    """
+    def __init__(self, storage):
+        self.storage = storage
+
+    def get_upload_target(self, key, token, content_type, request):
+        """
+        Returns the `method`, `url` and `headers` a client should use to
+        upload the file stored at `key`.
+        """
+        raise NotImplementedError
+
+    def create_multipart_upload(self, key, content_type):
+        """
+        Starts a multipart upload of the file to be stored at `key`, and
+        returns its id.
+        """
+        raise NotImplementedError
+
+    def upload_part(self, key, upload_id, number, stream, size):
+        """
+        Stores part `number` of a multipart upload, read from `stream`, and
+        returns its ETag. Uploading a part again replaces it.
+        """
+        raise NotImplementedError
+
+    def complete_multipart_upload(self, key, upload_id):
+        """
+        Joins the uploaded parts, in order, into the file stored at `key`.
+        """
+        raise NotImplementedError
+
+    def abort_multipart_upload(self, key, upload_id):
+        """
+        Discards a multipart upload and its parts.
+        """
+        raise NotImplementedError
+
+
+class S3UploadBackend(UploadBackend):
+    """
+    Uploads straight to S3 with presigned PUT URLs, and relays multipart
+    uploads to S3's own.
+    """
+    @property
+    def client(self):
+        return self.storage.bucket.meta.client
+
+    def get_object_key(self, key):
+        # Applies the storage's `location`, exactly as its save() would
+        return self.storage._normalize_name(self.storage._clean_name(key))
+
+    def get_upload_target(self, key, token, content_type, request):
+        params = {'Bucket': self.storage.bucket_name, 'Key': self.get_object_key(key)}
+        headers = {}
+        if content_type:
+            # The signature covers the content type, so the client must send
+            # the same header
+            params['ContentType'] = content_type
+            headers['Content-Type'] = content_type
+
+        url = self.client.generate_presigned_url(
+            'put_object',
+            Params=params,
+            ExpiresIn=UPLOAD_EXPIRES_IN,
+            HttpMethod='PUT'
+        )
+        return {'method': 'PUT', 'url': url, 'headers': headers}
+
+    def get_upload_params(self, key, upload_id):
+        return {
+            'Bucket': self.storage.bucket_name,
+            'Key': self.get_object_key(key),
+            'UploadId': upload_id,
+        }
+
+    def call(self, method, **params):
+        try:
+            return getattr(self.client, method)(**params)
+        except ClientError as exc:
+            if exc.response['Error']['Code'] == 'NoSuchUpload':
+                raise UploadNotFound()
+            raise UploadError(exc.response['Error'].get('Message', str(exc)))
+
+    def create_multipart_upload(self, key, content_type):
+        params = {'Bucket': self.storage.bucket_name, 'Key': self.get_object_key(key)}
+        if content_type:
+            params['ContentType'] = content_type
+        return self.call('create_multipart_upload', **params)['UploadId']
+
+    def upload_part(self, key, upload_id, number, stream, size):
+        # boto3 needs a sized, seekable body, so this is the one part that
+        # gets buffered
+        body = stream.read(size)
+        response = self.call(
+            'upload_part',
+            PartNumber=number,
+            Body=body,
+            **self.get_upload_params(key, upload_id)
+        )
+        return response['ETag']
+
+    def complete_multipart_upload(self, key, upload_id):
+        params = self.get_upload_params(key, upload_id)
+        parts = []
+        marker = 0
+        while True:
+            response = self.call('list_parts', PartNumberMarker=marker, **params)
+            parts.extend(
+                {'PartNumber': part['PartNumber'], 'ETag': part['ETag']}
+                for part in response.get('Parts', [])
+            )
+            if not response.get('IsTruncated'):
+                break
+            marker = response['NextPartNumberMarker']
+
+        if not parts:
+            raise UploadError('No parts have been uploaded.')
+
+        self.call('complete_multipart_upload', MultipartUpload={'Parts': parts}, **params)
+
+    def abort_multipart_upload(self, key, upload_id):
+        self.call('abort_multipart_upload', **self.get_upload_params(key, upload_id))
+
+
+class FileSystemUploadBackend(UploadBackend):
+    """
+    Stands in for S3 when files are stored on the local filesystem: clients
+    PUT the file to an API endpoint that is authorized by the upload token.
+    """
+    def get_upload_target(self, key, token, content_type, request):
+        url = request.build_absolute_uri(
+            reverse('document-upload-content', kwargs={'token': token})
+        )
+        headers = {'Content-Type': content_type} if content_type else {}
+        return {'method': 'PUT', 'url': url, 'headers': headers}
+
+    def receive(self, key, stream):
+        """
+        Streams an uploaded file into storage at `key`, chunk by chunk.
+        """
+        return self.storage.save(key, File(stream, name=key))
+
+    def get_parts_dir(self, upload_id):
+        if not upload_id.isalnum():
+            raise UploadNotFound()
+        return self.storage.path(os.path.join(MULTIPART_SCRATCH_DIR, upload_id))
+
+    def get_part_paths(self, upload_id):
+        parts_dir = self.get_parts_dir(upload_id)
+        try:
+            names = sorted(name for name in os.listdir(parts_dir) if name.isdigit())
+        except FileNotFoundError:
+            raise UploadNotFound()
+        return [os.path.join(parts_dir, name) for name in names]
+
+    def create_multipart_upload(self, key, content_type):
+        upload_id = uuid.uuid4().hex
+        os.makedirs(self.get_parts_dir(upload_id))
+        return upload_id
+
+    def upload_part(self, key, upload_id, number, stream, size):
+        parts_dir = self.get_parts_dir(upload_id)
+        if not os.path.isdir(parts_dir):
+            raise UploadNotFound()
+
+        # Stream the part to a temporary file, and only swap it in once it's
+        # complete, so a failed retry never leaves half a part behind
+        path = os.path.join(parts_dir, f'{number:05d}')
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        md5 = hashlib.md5()
+        with open(tmp_path, 'wb') as f:
+            for chunk in iter(lambda: stream.read(File.DEFAULT_CHUNK_SIZE), b''):
+                md5.update(chunk)
+                f.write(chunk)
+        os.replace(tmp_path, path)
+
+        return f'"{md5.hexdigest()}"'
+
+    def complete_multipart_upload(self, key, upload_id):
+        paths = self.get_part_paths(upload_id)
+        if not paths:
+            raise UploadError('No parts have been uploaded.')
+
+        self.storage.save(key, MultipartFile(paths, name=key))
+        shutil.rmtree(self.get_parts_dir(upload_id))
+
+    def abort_multipart_upload(self, key, upload_id):
+        parts_dir = self.get_parts_dir(upload_id)
+        if not os.path.isdir(parts_dir):
+            raise UploadNotFound()
+        shutil.rmtree(parts_dir)
+
+
+class MultipartFile(File):
+    """
+    The concatenation of the part files at `paths`, read one chunk at a time.
+    """
+    def __init__(self, paths, name=None):
+        super().__init__(None, name)
+        self.paths = paths
+
+    @property
+    def size(self):
+        return sum(os.path.getsize(path) for path in self.paths)
+
+    def chunks(self, chunk_size=None):
+        for path in self.paths:
+            with File(open(path, 'rb')) as part:
+                yield from part.chunks(chunk_size)
+
+
+def get_upload_backend(storage=None):
+    storage = storage or default_storage
+    if isinstance(storage, S3Boto3Storage):
+        return S3UploadBackend(storage)
+    if isinstance(storage, FileSystemStorage):
+        return FileSystemUploadBackend(storage)
+    raise ImproperlyConfigured(
+        f"Direct uploads aren't supported for {storage.__class__.__name__}."
+    )
@@ -0,0 +1,195 @@
+"""
+A fast read path for list responses.
+
+Serializing a large page with a ModelSerializer builds a model instance per
+row and walks every field's get_attribute() and to_representation(). For the
+fields that map straight onto columns or relations, ValuesSerializer skips
+all of that: it fetches the page as values() dictionaries, resolves the
+many-to-many relations of the whole page with one query each, and only calls
+to_representation() on the scalar fields that need converting.
+
+The output is identical to the ModelSerializer's. Whenever a serializer has a
+field the fast path doesn't know how to read (like the expanded fields from
+?expand=), the list falls back to the ModelSerializer.
+"""
+from collections import OrderedDict
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import ForeignKey, ManyToManyField, ManyToManyRel
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from documents.tree import get_tree_pks
+
+
+class Unsupported(Exception):
+    pass
+
+
+class ValuesSerializer:
+    """
+    Serializes values() rows with the fields of a ModelSerializer.
+    """
+    # Columns that are always fetched: the cursor pagination keys on
+    # `created_at`, and subclasses' readers may need more
+    required_columns = ['created_at']
+
+    def __init__(self, serializer):
+        self.model = serializer.Meta.model
+        self.request = serializer.context.get('request')
+        self.columns = {self.model._meta.pk.name, *self.required_columns}
+        self.relations = []
+        self.readers = []
+        for name, field in serializer.fields.items():
+            if not field.write_only:
+                self.readers.append((name, self.get_reader(name, field)))
+
+    def get_reader(self, name, field):
+        """
+        Returns a function that takes a row and the page's related pks, and
+        returns the representation of `field`. Raises Unsupported if it can't
+        be read from values().
+        """
+        if isinstance(field, ManyRelatedField):
+            if not isinstance(field.child_relation, PrimaryKeyRelatedField):
+                raise Unsupported(name)
+            model_field = self.get_model_field(field.source)
+            if not isinstance(model_field, (ManyToManyField, ManyToManyRel)):
+                raise Unsupported(name)
+            self.relations.append(field.source)
+            pk = self.model._meta.pk.attname
+            return lambda row, related: related[field.source].get(row[pk], [])
+
+        model_field = self.get_model_field(field.source)
+        if not model_field.concrete or isinstance(model_field, ManyToManyField):
+            raise Unsupported(name)
+        column = model_field.name
+        self.columns.add(column)
+
+        if isinstance(field, PrimaryKeyRelatedField):
+            if not isinstance(model_field, ForeignKey) or field.pk_field is not None:
+                raise Unsupported(name)
+            return lambda row, related: row[column]
+
+        if isinstance(field, serializers.FileField):
+            return self.get_file_reader(field, model_field, column)
+
+        if isinstance(field, (serializers.RelatedField, serializers.BaseSerializer)):
+            raise Unsupported(name)
+
+        to_representation = field.to_representation
+
+        def read(row, related):
+            value = row[column]
+            return None if value is None else to_representation(value)
+
+        return read
+
+    def get_file_reader(self, field, model_field, column):
+        # Mirrors FileField.to_representation(), from the stored name
+        storage = model_field.storage
+        use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+        request = self.request
+
+        def read(row, related):
+            name = row[column]
+            if not name:
+                return None
+            if not use_url:
+                return name
+            url = storage.url(name)
+            return request.build_absolute_uri(url) if request is not None else url
+
+        return read
+
+    def get_model_field(self, source):
+        if not source or '.' in source:
+            raise Unsupported(source)
+        try:
+            return self.model._meta.get_field(source)
+        except FieldDoesNotExist:
+            raise Unsupported(source)
+
+    def get_related(self, rows):
+        """
+        Returns a dictionary mapping each serialized relation to a
+        dictionary of row pks to related pks, with one query per relation.
+        """
+        pk = self.model._meta.pk.attname
+        pks = [row[pk] for row in rows]
+        related = {}
+        for source in self.relations:
+            descriptor = getattr(self.model, source)
+            if descriptor.reverse:
+                related_model, query_name = descriptor.rel.related_model, descriptor.field.name
+            else:
+                related_model, query_name = descriptor.field.related_model, descriptor.field.related_query_name()
+
+            # The same join, in the same order, as prefetch_related() would
+            links = {}
+            if pks:
+                for own, other in related_model.objects.filter(
+                    **{f'{query_name}__in': pks}
+                ).values_list(query_name, 'pk'):
+                    links.setdefault(own, []).append(other)
+            related[source] = links
+        return related
+
+    def prepare(self, rows):
+        """
+        Fetches whatever the readers need for the whole page of `rows`.
+        """
+        return self.get_related(rows)
+
+    def serialize(self, rows):
+        rows = list(rows)
+        related = self.prepare(rows)
+        return [
+            OrderedDict((name, read(row, related)) for name, read in self.readers)
+            for row in rows
+        ]
+
+
+class FolderValuesSerializer(ValuesSerializer):
+    required_columns = [*ValuesSerializer.required_columns, 'path', 'depth', 'numchild']
+
+    def get_reader(self, name, field):
+        if field.source == 'get_parent':
+            return lambda row, related: related['parent'].get(row['path'])
+        if field.source == 'get_cached_children':
+            return lambda row, related: related['children'][row['path']]
+        return super().get_reader(name, field)
+
+    def prepare(self, rows):
+        related = super().prepare(rows)
+        related['parent'], related['children'] = get_tree_pks(rows)
+        return related
+
+
+class ValuesListMixin:
+    """
+    Serializes the pages of a viewset's list action with its
+    `values_serializer_class`, when the fields being serialized allow it.
+    """
+    values_serializer_class = ValuesSerializer
+
+    def get_values_serializer(self):
+        if self.values_serializer_class is None:
+            return None
+        try:
+            return self.values_serializer_class(self.get_serializer())
+        except Unsupported:
+            return None
+
+    def list_response(self, queryset):
+        values_serializer = self.get_values_serializer()
+        if values_serializer is None:
+            return super().list_response(queryset)
+
+        rows = queryset.prefetch_related(None).values(*values_serializer.columns)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(values_serializer.serialize(page))
+        return Response(values_serializer.serialize(rows))
@@ -1,22 +1,120 @@
+from django.core import signing
+from django.core.files.base import ContentFile
 from rest_framework import viewsets
 from rest_framework import permissions
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.response import Response
 
+from documents.bulk import BulkModelMixin
+from documents.cache import ResponseCacheMixin
+from documents.conditional import ConditionalGetMixin
+from documents.deletion import delete_documents, delete_subtrees
+from documents.downloads import FileContentNegotiation, serve_file
+from documents.expand import ExpandMixin, expands_breadcrumbs
+from documents.facets import get_facets
 from documents.models import Document, Folder, Topic
-from documents.serializers import DocumentSerializer, FolderSerializer, TopicSerializer
+from documents.replicas import ReplicaReadMixin
+from documents.serializers import (
+    DocumentBulkSerializer, DocumentFinalizeSerializer, DocumentMultipartCompleteSerializer,
+    DocumentSerializer, DocumentUploadSerializer, FolderImportSerializer, FolderSerializer,
+    FolderTreeQuerySerializer, TopicSerializer
+)
+from documents.tree import get_subtree
+from documents.uploads import (
+    MULTIPART_EXPIRES_IN, MULTIPART_MAX_PART_SIZE, MULTIPART_MAX_PARTS, UPLOAD_EXPIRES_IN,
+    FileSystemUploadBackend, UploadError, UploadNotFound, get_upload_backend,
+    make_multipart_token, make_upload_token, new_upload_key, read_multipart_token,
+    read_upload_token
+)
+from documents.values import FolderValuesSerializer, ValuesListMixin
 from documents.filters import DocumentFilter, FolderFilter, TopicFilter
 
 
-class FolderViewSet(viewsets.ModelViewSet):
+class FolderViewSet(ReplicaReadMixin, ExpandMixin, ResponseCacheMixin, ValuesListMixin, ConditionalGetMixin, BulkModelMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows CRUD operations on Folder objects
     """
-    queryset = Folder.objects.all().order_by('-created_at')
+    queryset = Folder.objects.prefetch_related('topics').order_by('-created_at')
     serializer_class = FolderSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     filterset_class = FolderFilter
+    validator_fields = ['updated_at', 'children_updated_at']
+    prefetch_fields = ['topics']
+    # The tree fields are needed to resolve parents and children
+    required_columns = ['path', 'depth', 'numchild']
+    field_columns = {'path_names': ['name']}
+    values_serializer_class = FolderValuesSerializer
+    # Whole trees cost as much as several pages, see documents.throttling
+    throttle_costs = {'tree': 5, 'forest': 5, 'facets': 5, 'import_tree': 5}
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('tree', 'facets', 'destroy'):
+            # These are built from their own queries, so don't prefetch topics
+            return queryset.prefetch_related(None)
+        return queryset
 
-class DocumentViewSet(viewsets.ModelViewSet):
+    def filter_queryset(self, queryset):
+        if self.action in ('tree', 'facets'):
+            # The query string configures the action, rather than filtering
+            # the folder
+            return queryset
+        return super().filter_queryset(queryset)
+
+    @action(detail=False, methods=['post'], url_path='import', serializer_class=FolderImportSerializer)
+    def import_tree(self, request):
+        """
+        Imports a nested tree of new folders in one pass.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        folders = serializer.save()
+        return Response(
+            {'ids': [folder.pk for folder in folders]},
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=True, methods=['get'])
+    def tree(self, request, pk=None):
+        """
+        Returns the nested branch under a folder in a single query.
+        """
+        return Response(get_subtree(self.get_object(), **self.get_tree_params(request)))
+
+    @action(detail=False, methods=['get'], url_path='tree')
+    def forest(self, request):
+        """
+        Returns every folder in the store as a nested forest in a single query.
+        """
+        return Response(get_subtree(None, **self.get_tree_params(request)))
+
+    @action(detail=True, methods=['get'])
+    def facets(self, request, pk=None):
+        """
+        Counts the documents inside a folder's branch that match the Document
+        filters, per topic and per child folder.
+        """
+        folder = self.get_object()
+        filterset = DocumentFilter(request.query_params, queryset=Document.objects.all(), request=request)
+        if not filterset.is_valid():
+            raise ValidationError(filterset.errors)
+        return Response(get_facets(filterset.qs, folder))
+
+    def get_tree_params(self, request):
+        serializer = FolderTreeQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def perform_destroy(self, instance):
+        delete_subtrees([instance])
+
+    def perform_bulk_destroy(self, queryset):
+        delete_subtrees(queryset)
+
+
+class DocumentViewSet(ReplicaReadMixin, ExpandMixin, ResponseCacheMixin, ValuesListMixin, ConditionalGetMixin, BulkModelMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows CRUD operations on Document objects
     """
@@ -24,9 +122,209 @@ class DocumentViewSet(viewsets.ModelViewSet):
     serializer_class = DocumentSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     filterset_class = DocumentFilter
+    prefetch_fields = ['topics']
+    select_fields = ['folder']
+    field_columns = {'ancestors': ['folder'], 'path_names': ['name', 'folder']}
+    throttle_costs = {'facets': 5}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if expands_breadcrumbs(self.request):
+            # The breadcrumbs start from each document's folder
+            return queryset.select_related('folder')
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action == 'bulk':
+            return DocumentBulkSerializer
+        return super().get_serializer_class()
+
+    def perform_bulk_destroy(self, queryset):
+        delete_documents(queryset)
+
+    @action(detail=True, methods=['get'], content_negotiation_class=FileContentNegotiation)
+    def content(self, request, pk=None):
+        """
+        Downloads the document's file, either by redirecting to a presigned
+        URL or by streaming it. Supports Range and If-None-Match requests.
+        """
+        return serve_file(request, self.get_object().file)
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        Counts the documents that match the filters per topic and per root
+        folder.
+        """
+        return Response(get_facets(self.filter_queryset(self.get_queryset())))
+
+    @action(detail=False, methods=['post'], serializer_class=DocumentUploadSerializer)
+    def uploads(self, request):
+        """
+        Returns a target to upload a file to directly, and the `upload` token
+        to finalize its Document with once the file is in storage.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        key = self.get_upload_key(serializer.validated_data['filename'])
+        token = make_upload_token(key, request.user)
+        target = get_upload_backend().get_upload_target(
+            key, token, serializer.validated_data['content_type'], request
+        )
+        return Response(
+            {'upload': token, 'expires_in': UPLOAD_EXPIRES_IN, **target},
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(
+        detail=False,
+        methods=['put'],
+        url_path=r'uploads/(?P<token>[^/]+)',
+        url_name='upload-content',
+        authentication_classes=[],
+        permission_classes=[permissions.AllowAny]
+    )
+    def upload_content(self, request, token=None):
+        """
+        Accepts an upload in place of S3 when files are stored on the local
+        filesystem. Authorized by the upload token rather than by a user.
+        """
+        backend = get_upload_backend()
+        if not isinstance(backend, FileSystemUploadBackend):
+            raise NotFound()
+
+        try:
+            key = read_upload_token(token)
+        except signing.BadSignature:
+            raise NotFound()
+
+        if backend.storage.exists(key):
+            return Response(status=status.HTTP_409_CONFLICT)
+
+        backend.receive(key, request.stream or ContentFile(b''))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=False, methods=['post'], serializer_class=DocumentFinalizeSerializer)
+    def finalize(self, request):
+        """
+        Creates a Document for a file that was uploaded with `uploads`.
+        """
+        return self.create(request)
+
+    @action(detail=False, methods=['post'], serializer_class=DocumentUploadSerializer)
+    def multipart(self, request):
+        """
+        Starts a resumable multipart upload. Returns the `upload` token that
+        identifies it to the other multipart endpoints.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        key = self.get_upload_key(serializer.validated_data['filename'])
+        upload_id = get_upload_backend().create_multipart_upload(
+            key, serializer.validated_data['content_type']
+        )
+        return Response({
+            'upload': make_multipart_token(key, upload_id, request.user),
+            'expires_in': MULTIPART_EXPIRES_IN,
+            'max_part_size': MULTIPART_MAX_PART_SIZE,
+            'max_parts': MULTIPART_MAX_PARTS,
+        }, status=status.HTTP_201_CREATED)
+
+    @action(
+        detail=False,
+        methods=['put'],
+        url_path=r'multipart/(?P<token>[^/]+)/parts/(?P<number>[0-9]+)',
+        url_name='multipart-part'
+    )
+    def upload_part(self, request, token=None, number=None):
+        """
+        Uploads part `number` of a multipart upload, numbered from 1, as the
+        raw request body. Parts can be uploaded in any order, and uploading a
+        part again replaces it.
+        """
+        key, upload_id = self.get_multipart_upload(request, token)
+
+        number = int(number)
+        if not 1 <= number <= MULTIPART_MAX_PARTS:
+            raise ValidationError({'number': [f'Parts are numbered from 1 to {MULTIPART_MAX_PARTS}.']})
+
+        try:
+            size = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            size = 0
+        if not size:
+            return Response(status=status.HTTP_411_LENGTH_REQUIRED)
+        if size > MULTIPART_MAX_PART_SIZE:
+            return Response(status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+        try:
+            etag = get_upload_backend().upload_part(key, upload_id, number, request.stream, size)
+        except UploadNotFound:
+            raise NotFound()
+        except UploadError as exc:
+            raise ValidationError({'non_field_errors': [str(exc)]})
+
+        return Response({'number': number, 'etag': etag})
+
+    @action(
+        detail=False,
+        methods=['post'],
+        url_path=r'multipart/(?P<token>[^/]+)/complete',
+        url_name='multipart-complete',
+        serializer_class=DocumentMultipartCompleteSerializer
+    )
+    def complete_multipart(self, request, token=None):
+        """
+        Joins the uploaded parts into one file and creates its Document.
+        """
+        key, upload_id = self.get_multipart_upload(request, token)
+
+        # Validate the document before assembling its file
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            get_upload_backend().complete_multipart_upload(key, upload_id)
+        except UploadNotFound:
+            raise NotFound()
+        except UploadError as exc:
+            raise ValidationError({'non_field_errors': [str(exc)]})
+
+        serializer.save(file=key)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+    @action(
+        detail=False,
+        methods=['delete'],
+        url_path=r'multipart/(?P<token>[^/]+)',
+        url_name='multipart-abort'
+    )
+    def abort_multipart(self, request, token=None):
+        """
+        Abandons a multipart upload and discards its parts.
+        """
+        key, upload_id = self.get_multipart_upload(request, token)
+
+        try:
+            get_upload_backend().abort_multipart_upload(key, upload_id)
+        except UploadNotFound:
+            raise NotFound()
+
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def get_upload_key(self, filename):
+        return new_upload_key(filename, Document._meta.get_field('file').max_length)
+
+    def get_multipart_upload(self, request, token):
+        try:
+            return read_multipart_token(token, request.user)
+        except signing.BadSignature:
+            raise NotFound()
 
 
-class TopicViewSet(viewsets.ModelViewSet):
+class TopicViewSet(ReplicaReadMixin, ExpandMixin, ResponseCacheMixin, ValuesListMixin, ConditionalGetMixin, BulkModelMixin, viewsets.ModelViewSet):
     """
     API endpoint that allows CRUD operations on Topic objects
     """
@@ -34,3 +332,4 @@ class TopicViewSet(viewsets.ModelViewSet):
     serializer_class = TopicSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
     filterset_class = TopicFilter
+    prefetch_fields = ['folders', 'documents']
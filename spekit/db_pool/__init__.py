@@ -0,0 +1,27 @@
+"""
+A PostgreSQL database backend that pools connections in each process.
+
+Django opens a connection per thread and either closes it after each
+request or keeps it for CONN_MAX_AGE seconds. With this backend, closing a
+connection returns it to a pool of up to `POOL['MAX_SIZE']` connections
+instead, which the next request on any thread checks out again, so a
+process never holds more than that many connections. Set `ENGINE` to
+`spekit.db_pool` and `CONN_MAX_AGE` to 0, so that each request returns its
+connection when it's done.
+
+`POOL` in the database's settings accepts:
+
+- `MAX_SIZE`: the most connections the process may hold (default 10).
+- `TIMEOUT`: how many seconds to wait for a connection when they are all
+  checked out, before raising PoolTimeout (default 10).
+- `HEALTH_CHECK_AFTER`: connections idle for longer than this many seconds
+  are checked with a `SELECT 1` when they are checked out, and replaced if
+  they fail (default 0, every time).
+- `MAX_LIFETIME`: connections are closed instead of reused once they are
+  this many seconds old (default 0, never).
+- `IDLE_TIMEOUT`: idle connections are closed once they have been idle for
+  this many seconds (default 0, never).
+
+get_pool_stats() returns the size and counters of the process' pools.
+"""
+from spekit.db_pool.pool import PoolTimeout, get_pool_stats  # noqa: F401
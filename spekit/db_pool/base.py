@@ -0,0 +1,53 @@
+from django.db.backends.postgresql import base
+from psycopg2 import extensions
+
+from spekit.db_pool.pool import get_pool
+
+Database = base.Database
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    def get_pool(self, conn_params):
+        options = self.settings_dict.get('POOL', {})
+        return get_pool(
+            self.alias,
+            connect=lambda: super(DatabaseWrapper, self).get_new_connection(conn_params),
+            is_healthy=self.is_healthy,
+            max_size=options.get('MAX_SIZE', 10),
+            timeout=options.get('TIMEOUT', 10),
+            health_check_after=options.get('HEALTH_CHECK_AFTER', 0),
+            max_lifetime=options.get('MAX_LIFETIME', 0),
+            idle_timeout=options.get('IDLE_TIMEOUT', 0),
+        )
+
+    def get_new_connection(self, conn_params):
+        self.pool = self.get_pool(conn_params)
+        return self.pool.getconn()
+
+    def is_healthy(self, connection):
+        if connection.closed:
+            return False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            if not connection.autocommit:
+                connection.rollback()
+        except Database.Error:
+            return False
+        return True
+
+    def _close(self):
+        # Return the connection rather than close it. It's closed when it's
+        # broken, or when it was closed in the middle of an atomic block,
+        # since this wrapper still refers to it until the block exits.
+        connection = self.connection
+        if connection.closed or self.in_atomic_block:
+            self.pool.putconn(connection, close=True)
+            return
+        try:
+            if connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except Database.Error:
+            self.pool.putconn(connection, close=True)
+        else:
+            self.pool.putconn(connection)
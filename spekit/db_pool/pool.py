@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+from collections import Counter
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of up to `max_size` database connections.
+
+    Checking out a connection reuses the most recently returned one, after
+    checking its health with `is_healthy` if it has been idle for more than
+    `health_check_after` seconds, or opens a new one with `connect`. When
+    every connection is checked out, callers wait up to `timeout` seconds
+    for one to be returned before PoolTimeout is raised.
+
+    Connections are closed rather than reused once they are `max_lifetime`
+    seconds old, or once they have been idle for `idle_timeout` seconds,
+    unless those are 0.
+    """
+    def __init__(self, connect, is_healthy, max_size, timeout=10, health_check_after=0,
+                 max_lifetime=0, idle_timeout=0):
+        self.connect = connect
+        self.is_healthy = is_healthy
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self.max_lifetime = max_lifetime
+        self.idle_timeout = idle_timeout
+        self.pid = os.getpid()
+        self.counters = Counter()
+        # (connection, opened_at, returned_at), most recently returned last
+        self._idle = []
+        # When each checked out connection was opened, by id()
+        self._opened_at = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def getconn(self):
+        if not self._slots.acquire(blocking=False):
+            self._count('waits')
+            if not self._slots.acquire(timeout=self.timeout):
+                self._count('timeouts')
+                raise PoolTimeout(
+                    f'No database connection was returned to the pool within {self.timeout} seconds.'
+                )
+        try:
+            self._retire_idle()
+            return self._checkout()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                connection, opened_at, returned_at = self._idle.pop()
+            now = time.monotonic()
+            if self._has_expired(opened_at, now):
+                self._count('connections_retired')
+                self._discard(connection)
+            elif now - returned_at <= self.health_check_after or self.is_healthy(connection):
+                self._checked_out(connection, opened_at)
+                return connection
+            else:
+                self._count('failed_health_checks')
+                self._discard(connection)
+
+        connection = self.connect()
+        self._count('connections_opened')
+        self._checked_out(connection, time.monotonic())
+        return connection
+
+    def _checked_out(self, connection, opened_at):
+        with self._lock:
+            self._opened_at[id(connection)] = opened_at
+            self.counters['checkouts'] += 1
+
+    def _has_expired(self, opened_at, now):
+        return bool(self.max_lifetime) and now - opened_at >= self.max_lifetime
+
+    def _retire_idle(self):
+        """
+        Closes the connections that have been idle for `idle_timeout`.
+        """
+        if not self.idle_timeout:
+            return
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            retired = [connection for connection, _, returned_at in self._idle if returned_at <= cutoff]
+            self._idle = [entry for entry in self._idle if entry[2] > cutoff]
+            self.counters['connections_retired'] += len(retired)
+        for connection in retired:
+            self._discard(connection)
+
+    def putconn(self, connection, close=False):
+        """
+        Returns a checked out `connection` to the pool, or closes it if
+        `close` is true or it has reached `max_lifetime`.
+        """
+        try:
+            now = time.monotonic()
+            with self._lock:
+                opened_at = self._opened_at.pop(id(connection), now)
+            if close:
+                self._discard(connection)
+            elif self._has_expired(opened_at, now):
+                self._count('connections_retired')
+                self._discard(connection)
+            else:
+                with self._lock:
+                    self._idle.append((connection, opened_at, now))
+        finally:
+            self._slots.release()
+        self._retire_idle()
+
+    def _discard(self, connection):
+        self._count('connections_closed')
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def closeall(self):
+        """
+        Closes every idle connection.
+        """
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _, _ in idle:
+            self._discard(connection)
+
+    def get_stats(self):
+        with self._lock:
+            idle = len(self._idle)
+            in_use = len(self._opened_at)
+            counters = dict(self.counters)
+        return {
+            'max_size': self.max_size,
+            'size': idle + in_use,
+            'idle': idle,
+            'in_use': in_use,
+            **counters,
+        }
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, **kwargs):
+    """
+    Returns the pool for the database `alias` in this process, creating it
+    with `kwargs` on first use. Connections can't be shared with a forked
+    child, so a child process starts with pools of its own.
+    """
+    with _pools_lock:
+        pool = _pools.get(alias)
+        if pool is None or pool.pid != os.getpid():
+            pool = _pools[alias] = ConnectionPool(**kwargs)
+        return pool
+
+
+def get_pool_stats():
+    """
+    Returns the stats of every pool in this process, by database alias.
+    """
+    with _pools_lock:
+        return {alias: pool.get_stats() for alias, pool in _pools.items() if pool.pid == os.getpid()}
@@ -10,8 +10,10 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import importlib.util
 import os
 import sys
+import tempfile
 from pathlib import Path
 
 import dj_database_url
@@ -86,9 +88,12 @@ WSGI_APPLICATION = 'spekit.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
+# How long to keep database connections open between requests, in seconds
+DATABASE_CONN_MAX_AGE = int(os.environ.get("DATABASE_CONN_MAX_AGE", default=600))
+
 if os.environ.get("DATABASE_URL", None):
     DATABASES = {
-        "default": dj_database_url.config(conn_max_age=600)
+        "default": dj_database_url.config(conn_max_age=DATABASE_CONN_MAX_AGE)
     }
 else:
     DATABASES = {
@@ -99,9 +104,104 @@ else:
             "PASSWORD": os.environ.get("POSTGRES_PASSWORD", ""),
             "HOST": os.environ.get("POSTGRES_HOST", ""),
             "PORT": os.environ.get("POSTGRES_PORT", ""),
+            "CONN_MAX_AGE": DATABASE_CONN_MAX_AGE,
         }
     }
 
+# Read replicas for the API's safe requests, see documents.replicas. Set
+# DATABASE_REPLICA_URLS to comma-separated database URLs, and optionally
+# DATABASE_REPLICA_WEIGHTS to as many comma-separated weights.
+DATABASE_REPLICAS = {}
+_replica_urls = [url for url in os.environ.get("DATABASE_REPLICA_URLS", "").split(",") if url]
+_replica_weights = [int(weight) for weight in os.environ.get("DATABASE_REPLICA_WEIGHTS", "").split(",") if weight]
+for _i, _url in enumerate(_replica_urls):
+    DATABASES[f"replica_{_i}"] = {**dj_database_url.parse(_url, conn_max_age=DATABASE_CONN_MAX_AGE), "TEST": {"MIRROR": "default"}}
+    DATABASE_REPLICAS[f"replica_{_i}"] = _replica_weights[_i] if _i < len(_replica_weights) else 1
+
+# Pool the connections to every PostgreSQL database in each process, see
+# spekit.db_pool. Connections go back to the pool after each request.
+DATABASE_POOL_ENABLED = int(os.environ.get("DATABASE_POOL_ENABLED", default=0))
+if DATABASE_POOL_ENABLED:
+    for _database in DATABASES.values():
+        if _database["ENGINE"] in ("django.db.backends.postgresql", "django.db.backends.postgresql_psycopg2"):
+            _database["ENGINE"] = "spekit.db_pool"
+            _database["CONN_MAX_AGE"] = 0
+            _database["POOL"] = {
+                "MAX_SIZE": int(os.environ.get("DATABASE_POOL_MAX_SIZE", default=10)),
+                "TIMEOUT": int(os.environ.get("DATABASE_POOL_TIMEOUT", default=10)),
+                "HEALTH_CHECK_AFTER": int(os.environ.get("DATABASE_POOL_HEALTH_CHECK_AFTER", default=5)),
+                "MAX_LIFETIME": int(os.environ.get("DATABASE_POOL_MAX_LIFETIME", default=3600)),
+                "IDLE_TIMEOUT": int(os.environ.get("DATABASE_POOL_IDLE_TIMEOUT", default=600)),
+            }
+
+DATABASE_ROUTERS = ['documents.replicas.ReplicaRouter']
+
+# How long a client reads from the primary after writing
+REPLICA_PIN_SECONDS = int(os.environ.get("REPLICA_PIN_SECONDS", default=10))
+
+# How long to wait before trying a replica that couldn't be connected to again
+REPLICA_RETRY_AFTER = int(os.environ.get("REPLICA_RETRY_AFTER", default=30))
+
+
+# Cache
+# https://docs.djangoproject.com/en/3.2/ref/settings/#caches
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Serialized API responses, see documents.cache. The local memory cache
+    # is per process, so use a shared backend when running several workers.
+    "responses": {
+        "BACKEND": os.environ.get("RESPONSE_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"),
+        "LOCATION": os.environ.get("RESPONSE_CACHE_LOCATION", "responses"),
+        "TIMEOUT": int(os.environ.get("RESPONSE_CACHE_TIMEOUT", default=300)),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", default=10000)),
+        },
+    },
+    # Verified credentials and the users they belong to, see
+    # accounts.authentication. Kept short-lived and local to each process.
+    "auth": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "auth",
+        "TIMEOUT": int(os.environ.get("AUTH_CACHE_TIMEOUT", default=60)),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.environ.get("AUTH_CACHE_MAX_ENTRIES", default=10000)),
+        },
+    },
+    # Revocations of cached users and credentials, see
+    # accounts.authentication. Every worker must share it: the file-based
+    # cache covers the workers on one host, so use a shared backend when
+    # running on several.
+    "auth_revocations": {
+        "BACKEND": os.environ.get("AUTH_REVOCATIONS_CACHE_BACKEND", "django.core.cache.backends.filebased.FileBasedCache"),
+        "LOCATION": os.environ.get("AUTH_REVOCATIONS_CACHE_LOCATION", os.path.join(tempfile.gettempdir(), "spekit-auth-revocations")),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.environ.get("AUTH_REVOCATIONS_CACHE_MAX_ENTRIES", default=10000)),
+        },
+    },
+    # Token buckets for the API's throttles, see documents.throttling. The
+    # file-based cache is shared by every worker on the host.
+    "throttle": {
+        "BACKEND": os.environ.get("THROTTLE_CACHE_BACKEND", "documents.throttling.BucketCache"),
+        "LOCATION": os.environ.get("THROTTLE_CACHE_LOCATION", os.path.join(tempfile.gettempdir(), "spekit-throttle")),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.environ.get("THROTTLE_CACHE_MAX_ENTRIES", default=10000)),
+        },
+    },
+}
+
+RESPONSE_CACHE_ENABLED = int(os.environ.get("RESPONSE_CACHE_ENABLED", default=0))
+
+# Keep an in-memory topic index in each process for the topics_all,
+# topics_any and topics_none filters, see documents.topic_index
+TOPIC_INDEX_ENABLED = int(os.environ.get("TOPIC_INDEX_ENABLED", default=0))
+
+# Throttle each client with the rates in REST_FRAMEWORK, see
+# documents.throttling
+THROTTLE_ENABLED = int(os.environ.get("THROTTLE_ENABLED", default=1))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
@@ -158,18 +258,44 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 #
 
 REST_FRAMEWORK = {
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
+    'DEFAULT_PAGINATION_CLASS': 'documents.pagination.DocumentStorePagination',
     'PAGE_SIZE': 10,
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
     ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'documents.throttling.AnonReadThrottle',
+        'documents.throttling.UserReadThrottle',
+        'documents.throttling.WriteThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'anon_read': os.environ.get("THROTTLE_ANON_READ_RATE", "120/min"),
+        'user_read': os.environ.get("THROTTLE_USER_READ_RATE", "600/min"),
+        'write': os.environ.get("THROTTLE_WRITE_RATE", "120/min"),
+    },
+    # How many proxies in front of the app add to X-Forwarded-For (1 on
+    # Heroku). With 0, clients are throttled by the address that connects.
+    'NUM_PROXIES': int(os.environ.get("NUM_PROXIES", default=0)),
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.BasicAuthentication',
+        'accounts.authentication.CachedBasicAuthentication',
         'rest_framework.authentication.SessionAuthentication',
-        'rest_framework.authentication.TokenAuthentication'
+        'accounts.authentication.CachedTokenAuthentication',
+        'accounts.authentication.AccessTokenAuthentication',
     ]
 }
 
+# The faster renderers in documents.renderers are only offered when their
+# packages are installed, so that asking for one without them is a 406
+# rather than a 500
+if importlib.util.find_spec("orjson"):
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('documents.renderers.ORJSONRenderer')
+if importlib.util.find_spec("msgpack"):
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('documents.renderers.MessagePackRenderer')
+
 
 # Django Storages
 # https://django-storages.readthedocs.io
@@ -184,6 +310,19 @@ AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY", None)
 
 AWS_STORAGE_BUCKET_NAME = os.getenv("AWS_STORAGE_BUCKET_NAME")
 
+# Whether /documents/{id}/content/ redirects to a presigned URL, when the
+# storage can presign one, instead of streaming the file
+DOCUMENT_DOWNLOAD_REDIRECT = os.getenv("DOCUMENT_DOWNLOAD_REDIRECT", "true").lower() == "true"
+
 if 'test' in sys.argv:
     DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
     STATICFILES_STORAGE = 'django.core.files.storage.FileSystemStorage'
+    # The test client makes every request from the same address
+    THROTTLE_ENABLED = 0
+    CACHES["throttle"] = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "throttle"}
+    CACHES["auth_revocations"] = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "auth_revocations"}
+    # A second database, standing in for a replica in documents.tests.test_replicas
+    DATABASES["replica"] = {
+        **DATABASES["default"],
+        "TEST": {} if "sqlite" in DATABASES["default"]["ENGINE"] else {"NAME": f"test_{DATABASES['default']['NAME']}_replica"},
+    }
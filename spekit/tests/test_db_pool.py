@@ -0,0 +1,135 @@
+import sqlite3
+import threading
+from unittest.mock import MagicMock, patch
+from django.test import SimpleTestCase
+from psycopg2 import extensions
+
+from spekit.db_pool import base, pool
+from spekit.db_pool.pool import ConnectionPool, PoolTimeout, time as pool_time
+
+
+class ConnectionPoolTestCase(SimpleTestCase):
+    """
+    Tests for the connection pool behind the spekit.db_pool backend
+    """
+    def make_pool(self, **kwargs):
+        def is_healthy(connection):
+            try:
+                connection.execute("SELECT 1")
+            except sqlite3.Error:
+                return False
+            return True
+
+        options = {'max_size': 2, 'timeout': 0.1, **kwargs}
+        pool = ConnectionPool(
+            lambda: sqlite3.connect(":memory:", check_same_thread=False), is_healthy, **options
+        )
+        self.addCleanup(pool.closeall)
+        return pool
+
+    def test_reuses_connections(self):
+        pool = self.make_pool()
+        connection = pool.getconn()
+        pool.putconn(connection)
+        self.assertIs(pool.getconn(), connection)
+        self.assertEqual(pool.get_stats()['connections_opened'], 1)
+        self.assertEqual(pool.get_stats()['checkouts'], 2)
+
+    def test_max_size(self):
+        pool = self.make_pool()
+        first, second = pool.getconn(), pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            pool.getconn()
+
+        # A waiting thread gets the next connection that's returned
+        threading.Timer(0.02, pool.putconn, [first]).start()
+        self.assertIs(pool.getconn(), first)
+        pool.putconn(second)
+
+        stats = pool.get_stats()
+        self.assertEqual((stats['size'], stats['in_use'], stats['idle']), (2, 1, 1))
+        self.assertEqual((stats['waits'], stats['timeouts']), (2, 1))
+
+    def test_health_check(self):
+        pool = self.make_pool()
+        connection = pool.getconn()
+        pool.putconn(connection)
+        connection.close()
+
+        replacement = pool.getconn()
+        self.assertIsNot(replacement, connection)
+        replacement.execute("SELECT 1")
+        self.assertEqual(pool.get_stats()['failed_health_checks'], 1)
+
+    def test_health_check_after(self):
+        pool = self.make_pool(health_check_after=60)
+        connection = pool.getconn()
+        pool.putconn(connection)
+        connection.close()
+        self.assertIs(pool.getconn(), connection)
+
+    def test_max_lifetime(self):
+        pool = self.make_pool(max_lifetime=60)
+        with patch.object(pool_time, "monotonic", return_value=0):
+            connection = pool.getconn()
+        with patch.object(pool_time, "monotonic", return_value=30):
+            pool.putconn(connection)
+            self.assertIs(pool.getconn(), connection)
+        with patch.object(pool_time, "monotonic", return_value=60):
+            pool.putconn(connection)
+            self.assertIsNot(pool.getconn(), connection)
+        stats = pool.get_stats()
+        self.assertEqual((stats['connections_retired'], stats['connections_opened']), (1, 2))
+
+    def test_idle_timeout(self):
+        pool = self.make_pool(idle_timeout=60)
+        first, second = pool.getconn(), pool.getconn()
+        with patch.object(pool_time, "monotonic", return_value=0):
+            pool.putconn(first)
+        with patch.object(pool_time, "monotonic", return_value=50):
+            pool.putconn(second)
+        with patch.object(pool_time, "monotonic", return_value=70):
+            self.assertIs(pool.getconn(), second)
+        stats = pool.get_stats()
+        self.assertEqual((stats['size'], stats['in_use'], stats['connections_retired']), (1, 1, 1))
+
+    def test_close(self):
+        pool = self.make_pool()
+        pool.putconn(pool.getconn(), close=True)
+        stats = pool.get_stats()
+        self.assertEqual((stats['size'], stats['connections_closed']), (0, 1))
+
+
+class PooledDatabaseWrapperTestCase(SimpleTestCase):
+    """
+    Tests for returning the backend's connections to the pool
+    """
+    def setUp(self):
+        settings_dict = {
+            'ENGINE': 'spekit.db_pool', 'NAME': 'spekit', 'USER': '', 'PASSWORD': '', 'HOST': '', 'PORT': '',
+            'OPTIONS': {}, 'AUTOCOMMIT': True, 'ATOMIC_REQUESTS': False, 'CONN_MAX_AGE': 0,
+            'TIME_ZONE': None, 'TEST': {}, 'POOL': {'MAX_SIZE': 1, 'TIMEOUT': 0},
+        }
+        self.raw = MagicMock(closed=0, autocommit=True)
+        patcher = patch.object(base.base.DatabaseWrapper, 'get_new_connection', return_value=self.raw)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.wrapper = base.DatabaseWrapper(settings_dict, alias='pool-test')
+        self.addCleanup(pool._pools.pop, 'pool-test', None)
+
+    def test_returned_to_pool(self):
+        self.raw.get_transaction_status.return_value = extensions.TRANSACTION_STATUS_INTRANS
+        connection = self.wrapper.get_new_connection({})
+        self.wrapper.connection = connection
+        self.wrapper.close()
+
+        self.raw.rollback.assert_called_once()
+        self.raw.close.assert_not_called()
+        self.assertIs(self.wrapper.get_new_connection({}), connection)
+
+    def test_broken_connection_closed(self):
+        self.wrapper.connection = self.wrapper.get_new_connection({})
+        self.raw.closed = 2
+        self.wrapper.close()
+        self.raw.close.assert_called_once()
+        self.assertEqual(self.wrapper.pool.get_stats()['size'], 0)
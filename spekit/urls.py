@@ -17,6 +17,7 @@ from django.contrib import admin
 from django.urls import include, path
 
 from rest_framework import routers
+from accounts.views import AccessTokenView, RefreshAccessTokenView
 from documents import views
 
 router = routers.DefaultRouter()
@@ -26,6 +27,8 @@ router.register(r'topics', views.TopicViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('auth/token/', AccessTokenView.as_view(), name='access-token'),
+    path('auth/token/refresh/', RefreshAccessTokenView.as_view(), name='refresh-access-token'),
     path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework'))
 ]